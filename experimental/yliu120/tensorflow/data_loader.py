@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Shuffled minibatches of a memory-mapped dataset, prefetched in the
+background.
+
+The rows are split into blocks of batch_size consecutive rows. Every epoch
+visits the blocks in a new random order and shuffles the rows inside each
+block, so a minibatch is a single contiguous read from the memmap. A
+background thread reads the next batches into a bounded queue while the
+current one is trained on.
+
+    loader = MinibatchLoader(np.load("features.npy", mmap_mode='r'))
+    for epoch in range(NUM_EPOCH):
+        for batch_x in loader.epoch():
+            ...
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import queue
+import threading
+
+import numpy as np
+
+__author__ = 'Yunlong Liu (davislong198833@gmail.com)'
+
+# Number of batches read ahead of the trainer.
+PREFETCH = 4
+
+# Marks the end of an epoch in the prefetch queue.
+_END = object()
+
+
+class MinibatchLoader(object):
+    """Iterates over a 2-dim array in shuffled, prefetched minibatches."""
+
+    def __init__(self, data, batch_size, prefetch=PREFETCH, seed=None):
+        """Create the loader.
+
+        Args:
+            data: np array or memmap. 2-dim.
+            batch_size: number of rows per minibatch.
+            prefetch: number of batches read ahead.
+            seed: seed of the shuffling, None for a random one.
+        """
+        self._data = data
+        self._batch_size = batch_size
+        self._prefetch = prefetch
+        self._random = np.random.RandomState(seed)
+
+    @property
+    def num_samples(self):
+        """Returns: number of rows of the data"""
+        return self._data.shape[0]
+
+    def _read(self, starts, batches, stop):
+        """Producer thread: read the blocks in order into the queue.
+
+        Args:
+            starts: np array, first row of every block in visiting order.
+            batches: queue.Queue, receives the batches, then _END or the
+                exception that stopped the reading.
+            stop: threading.Event, set when the consumer gives up early.
+        """
+        try:
+            for start in starts:
+                if stop.is_set():
+                    return
+                batch = np.array(self._data[start:start + self._batch_size],
+                                 dtype=np.float32)
+                self._random.shuffle(batch)
+                batches.put(batch)
+            batches.put(_END)
+        except Exception as error:  # pylint: disable=broad-except
+            batches.put(error)
+
+    def epoch(self):
+        """Read all rows once in a new random order.
+
+        Yields:
+            np array of float32 [batch_size, n_columns], the last batch
+            may be shorter.
+        """
+        starts = np.arange(0, self.num_samples, self._batch_size)
+        self._random.shuffle(starts)
+
+        batches = queue.Queue(maxsize=self._prefetch)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read,
+                                  args=(starts, batches, stop))
+        reader.daemon = True
+        reader.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _END:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            # unblock a reader waiting on the full queue.
+            while reader.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    reader.join(0.01)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Build the autoencoder dataset from trajectories, frame by frame.
+
+Every frame is turned into a fixed-size feature vector of the selected atoms
+(CA by default):
+
+    distances     the upper triangle of the pair-wise distance matrix
+    coordinates   the flattened coordinates around their center
+
+zero padded to --dim (INPUT_DIM of simple_autoencoder.py). The vectors are
+written to a .npy file in chunks of frames, so the dataset is never held in
+memory, then min-max scaled to [0, 1] column by column, again in chunks. The
+result is read with np.load(..., mmap_mode='r'). The scaling is saved to
+NAME_scale.npz to map reconstructions back.
+
+Usage:
+    python3 featurize.py sys.gro md_1.xtc md_2.xtc --output features.npy
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import os
+
+import numpy as np
+from MDAnalysis import Universe
+from MDAnalysis.lib.distances import self_distance_array
+
+__author__ = 'Yunlong Liu (davislong198833@gmail.com)'
+
+DESCRIPTION = "Stream trajectory frames into autoencoder features"
+
+FEATURES = ("distances", "coordinates")
+
+# Same as INPUT_DIM of simple_autoencoder.py.
+FEATURE_DIM = 1024
+
+# Number of frames buffered before they are written out.
+CHUNK_FRAMES = 1024
+
+
+def feature_size(num_atoms, feature):
+    """Number of values a frame of num_atoms atoms is turned into.
+
+    Args:
+        num_atoms: int, number of selected atoms
+        feature: string, one of FEATURES
+
+    Returns:
+        int, length of the feature vector before padding
+    """
+    if feature == "distances":
+        return num_atoms * (num_atoms - 1) // 2
+    return num_atoms * 3
+
+
+def frame_features(positions, feature):
+    """Compute the feature vector of a single frame.
+
+    Args:
+        positions: np array [n_atoms, 3], positions of the selected atoms
+        feature: string, one of FEATURES
+
+    Returns:
+        np array [feature_size], the features
+    """
+    if feature == "distances":
+        return self_distance_array(positions)
+    return (positions - positions.mean(axis=0)).ravel()
+
+
+def _scale(data, num_rows, chunk_frames):
+    """Min-max scale every column of data to [0, 1] in place, chunkwise.
+
+    Columns without any spread (e.g. the padding) become 0.
+
+    Args:
+        data: np memmap [n_rows, dim], the features
+        num_rows: int, number of rows
+        chunk_frames: int, rows scaled at a time
+
+    Returns:
+        (np array, np array), the min and max of every column
+    """
+    low = np.full(data.shape[1], np.inf, dtype=np.float32)
+    high = np.full(data.shape[1], -np.inf, dtype=np.float32)
+    for start in range(0, num_rows, chunk_frames):
+        block = data[start:start + chunk_frames]
+        np.minimum(low, block.min(axis=0), out=low)
+        np.maximum(high, block.max(axis=0), out=high)
+
+    span = high - low
+    span[span == 0] = np.inf
+    for start in range(0, num_rows, chunk_frames):
+        data[start:start + chunk_frames] -= low
+        data[start:start + chunk_frames] /= span
+    return (low, high)
+
+
+def featurize(topology, trajectories, output, selection="name CA",
+              feature="distances", dim=FEATURE_DIM, frames=None,
+              chunk_frames=CHUNK_FRAMES):
+    """Stream the frames of a trajectory into a memory-mappable .npy file.
+
+    Args:
+        topology: string, topology file name
+        trajectories: list of string, trajectory files in frame order
+        output: string, the .npy file to write
+        selection: string, MDAnalysis selection of the featurized atoms
+        feature: string, one of FEATURES
+        dim: int, length of the feature vectors, shorter ones are padded
+        frames: slice of the frames to featurize, None for all
+        chunk_frames: int, number of frames buffered in memory
+
+    Returns:
+        np memmap [n_frames, dim] of float32, the scaled features
+    """
+    universe = Universe(topology, trajectories)
+    atoms = universe.select_atoms(selection)
+    size = feature_size(len(atoms), feature)
+    if size > dim:
+        raise ValueError("%d atoms give %d %s, more than %d; narrow the "
+                         "selection" % (len(atoms), size, feature, dim))
+
+    trajectory = universe.trajectory[frames or slice(None)]
+    num_rows = len(trajectory)
+    data = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32,
+                                     shape=(num_rows, dim))
+    buffer = np.zeros((chunk_frames, dim), dtype=np.float32)
+
+    row = 0
+    filled = 0
+    for _ in trajectory:
+        buffer[filled, :size] = frame_features(atoms.positions, feature)
+        filled += 1
+        if filled == chunk_frames or row + filled == num_rows:
+            data[row:row + filled] = buffer[:filled]
+            row += filled
+            filled = 0
+            print("featurized %d of %d frames" % (row, num_rows))
+
+    (low, high) = _scale(data, num_rows, chunk_frames)
+    data.flush()
+    np.savez(os.path.splitext(output)[0] + "_scale.npz", low=low, high=high,
+             size=size)
+    return data
+
+
+def main():
+    """Parse the command line args and featurize the trajectory"""
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+
+    parser.add_argument('topology', metavar='TOPOLOGY',
+                        help='input topology file (.gro)')
+    parser.add_argument('trajectory', metavar='TRAJECTORY', nargs='+',
+                        help='input trajectory files in frame order')
+    parser.add_argument('--output', required=True,
+                        help='output .npy file')
+    parser.add_argument('--selection', default="name CA",
+                        help='selection string of the featurized atoms')
+    parser.add_argument('--feature', default="distances", choices=FEATURES,
+                        help='pair-wise distances or centered coordinates')
+    parser.add_argument('--dim', default=FEATURE_DIM, type=int,
+                        help='length of the feature vectors')
+    parser.add_argument('--step', default=1, type=int,
+                        help='featurize every step-th frame')
+    parser.add_argument('--chunk', default=CHUNK_FRAMES, type=int,
+                        help='number of frames buffered in memory')
+    args = parser.parse_args()
+
+    featurize(args.topology, args.trajectory, args.output, args.selection,
+              args.feature, args.dim, slice(None, None, args.step),
+              args.chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-"""Implement a basic classical autoencoder for experimental purposes"""
+"""Implement a basic classical autoencoder for experimental purposes
+
+The data is a [n_frames, INPUT_DIM] .npy file, see featurize.py. It is
+memory-mapped and read in shuffled minibatches prefetched in the background
+(see data_loader.py), so it can be larger than RAM.
+"""
 
 from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
 import argparse
+import time
+
 import numpy as np
 import tensorflow as tf
 
+from data_loader import MinibatchLoader
+
 __author__ = 'Yunlong Liu (davislong198833@gmail.com)'
 
 DESCRIPTION = "Experiment 2-layer Autoencoder with tensorflow"
@@ -19,7 +28,7 @@ INPUT_DIM = 1024
 HIDDEN_1_DIM = 256
 HIDDEN_2_DIM = 32
 
-NUM_BATCH = 20
+BATCH_SIZE = 256
 NUM_EPOCH = 50
 
 WEIGHTS = {
@@ -83,13 +92,18 @@ def model(dummy_x):
     return (loss_function, optimizer)
 
 
-def train(input_data):
+def train(input_data, seed=None):
     """Train the autoencoder with the input data array.
     The data array should be a two-dimensional array.
 
     Args:
-        input_data: np array. 2-dim.
+        input_data: np array or memmap. 2-dim.
+        seed: seed of the minibatch shuffling.
     """
+    if input_data.ndim != 2 or input_data.shape[1] != INPUT_DIM:
+        raise ValueError("expected data of shape (n, %d), got %s" %
+                         (INPUT_DIM, input_data.shape))
+
     input_x = tf.placeholder(tf.float32, shape=(None, INPUT_DIM))
 
     # Put input_x in our model
@@ -97,6 +111,7 @@ def train(input_data):
 
     # Initialize tf Session
     init = tf.initialize_all_variables()
+    loader = MinibatchLoader(input_data, BATCH_SIZE, seed=seed)
 
     # Launch training process
     with tf.Session() as session:
@@ -104,15 +119,20 @@ def train(input_data):
 
         # Training cycle
         for epoch in range(NUM_EPOCH):
-            for batch in range(NUM_BATCH):
-                batch_x = input_data[batch::NUM_BATCH]
-                session.run(optimizer, feed_dict={input_x: batch_x})
-
-            # output logs per epoch
-            loss_per_epoch = session.run(loss, feed_dict={
-                input_x: input_data[:NUM_BATCH * NUM_EPOCH:1]})
+            start = time.time()
+            loss_sum = 0.0
+            for batch_x in loader.epoch():
+                (batch_loss, _) = session.run(
+                    [loss, optimizer], feed_dict={input_x: batch_x})
+                loss_sum += batch_loss * len(batch_x)
+            seconds = time.time() - start
+
+            # output logs per epoch, the mean loss of the epoch's batches
             print("Epoch: ", '%02d' % (epoch + 1),
-                  " cost: ", "{:.6f}".format(loss_per_epoch))
+                  " cost: ", "{:.6f}".format(
+                      loss_sum / loader.num_samples),
+                  " samples/sec: ", "{:.1f}".format(
+                      loader.num_samples / seconds))
 
 
 def main():
@@ -121,10 +141,12 @@ def main():
 
     # Positional Args
     parser.add_argument('data', metavar='DATA', nargs='?',
-                        help='compressed Numpy data')
+                        help='Numpy data (.npy), see featurize.py')
+    parser.add_argument('--seed', type=int,
+                        help='seed of the minibatch shuffling')
     args = parser.parse_args()
 
-    train(np.load(args.data))
+    train(np.load(args.data, mmap_mode='r'), args.seed)
 
 
 if __name__ == "__main__":
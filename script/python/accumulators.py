@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per frame accumulators of the pair-wise min distance analysis.
+
+An analysis pass hands the min distances of all pairs in every frame to a
+few accumulators, each keeping one kind of result:
+
+    RawAccumulator         the min distance of every pair in every frame
+    HistogramAccumulator   the histogram of every pair, binned on the fly
+    StatsAccumulator       the contact frequency and mean/min/std of every
+                           pair
+    ContactMapAccumulator  the contacts of every frame, packed with
+                           np.packbits
+
+All of them have the same interface:
+
+    accumulator.add(row, min_dist)     # the row-th analyzed frame
+    partial = accumulator.partial()    # state to send back or checkpoint
+    accumulator.merge(partial)         # add up the state of another worker
+    accumulator.result()
+
+so worker processes can accumulate chunks of frames on their own and a
+Checkpoint can save and restore them. Min distances are clamped to
+[LEFT_LIM, RIGHT_LIM] A and binned into NUM_BINS bins of BIN_EDGES.
+"""
+
+import os
+
+import glog as log
+import numpy as np
+
+from distance_store import BlockRows, decode_distances, encode_distances
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+NUM_BINS = 50
+
+LEFT_LIM = 0
+RIGHT_LIM = 10
+
+# Bin edges shared by every histogram, same as np.histogram would use.
+BIN_EDGES = np.linspace(LEFT_LIM, RIGHT_LIM, NUM_BINS + 1)
+
+# A pair is in contact below this min distance (A), a bin edge.
+CONTACT_CUTOFF = 4.0
+
+
+def bin_indices(min_dist):
+    """find the histogram bin of every min distance.
+
+    Bins are half-open except the last one, exactly like np.histogram over
+    (LEFT_LIM, RIGHT_LIM), so the clamped RIGHT_LIM lands in the last bin.
+
+    Args:
+        min_dist: numpy-array, min distances within [LEFT_LIM, RIGHT_LIM]
+
+    Returns:
+        numpy-array [int], same shape as min_dist
+    """
+    return np.minimum(
+        np.searchsorted(BIN_EDGES, min_dist, side='right') - 1,
+        NUM_BINS - 1)
+
+
+def bin_data(data):
+    """bin the min distance time series into histogram counts.
+
+    Args:
+        data: dict type, (name, numpy-array [n_frames])
+
+    Returns:
+        dict type, (name, numpy-array [NUM_BINS] of bin counts)
+    """
+    return {name: np.bincount(bin_indices(dist_data), minlength=NUM_BINS)
+            for (name, dist_data) in data.items()}
+
+
+class RawAccumulator(object):
+    """Keeps the min distance of every pair in every frame."""
+
+    def __init__(self, raw_data):
+        """Create the accumulator over a [n_frames, n_pairs] array.
+
+        Args:
+            raw_data: numpy-array [n_frames, n_pairs], may be shared memory,
+                or the BlockRows of a DistanceStore. Its dtype is one of
+                distance_store.DTYPES.
+        """
+        self._raw_data = raw_data
+
+    def add(self, row, min_dist):
+        """Record the min distances of the row-th analyzed frame."""
+        self._raw_data[row] = encode_distances(min_dist, self._raw_data.dtype)
+
+    def partial(self):
+        """Rows are written in place, nothing to hand back."""
+        if isinstance(self._raw_data, BlockRows):
+            self._raw_data.flush()
+        return None
+
+    def merge(self, partial):
+        """Rows are written in place, nothing to merge."""
+        pass
+
+    def result(self):
+        """Returns: numpy-array [n_pairs, n_frames], one series per pair"""
+        if isinstance(self._raw_data, BlockRows):
+            return decode_distances(self._raw_data.pairs())
+        return np.transpose(decode_distances(self._raw_data))
+
+
+class HistogramAccumulator(object):
+    """Bins the min distances of every frame on the fly.
+
+    Memory stays O(n_pairs * NUM_BINS) no matter how many frames are
+    processed.
+    """
+
+    def __init__(self, num_pairs):
+        """Create empty histograms for num_pairs pairs."""
+        self._counts = np.zeros((num_pairs, NUM_BINS), dtype=np.int64)
+        self._pair_range = np.arange(num_pairs)
+
+    def add(self, row, min_dist):
+        """Record the min distances of the row-th analyzed frame."""
+        self._counts[self._pair_range, bin_indices(min_dist)] += 1
+
+    def partial(self):
+        """Returns: numpy-array [n_pairs, NUM_BINS], counts so far"""
+        return self._counts
+
+    def merge(self, partial):
+        """Add the counts accumulated by another worker."""
+        self._counts += partial
+
+    def result(self):
+        """Returns: numpy-array [n_pairs, NUM_BINS], one histogram per pair"""
+        return self._counts
+
+
+class StatsAccumulator(object):
+    """Keeps running contact counts and moments of every pair.
+
+    The statistics are over the min distances as clamped to
+    [LEFT_LIM, RIGHT_LIM].
+    """
+
+    # columns of the partial results
+    _FRAMES, _CONTACTS, _SUM, _SQUARES, _MIN = range(5)
+
+    def __init__(self, num_pairs, cutoff=CONTACT_CUTOFF):
+        """Create empty statistics for num_pairs pairs.
+
+        Args:
+            num_pairs: int, number of unit pairs
+            cutoff: float, a pair is in contact below this min distance
+        """
+        self._cutoff = cutoff
+        self._state = np.zeros((num_pairs, 5))
+        self._state[:, StatsAccumulator._MIN] = np.inf
+
+    def add(self, row, min_dist):
+        """Record the min distances of the row-th analyzed frame."""
+        self._state[:, StatsAccumulator._FRAMES] += 1
+        self._state[:, StatsAccumulator._CONTACTS] += min_dist < self._cutoff
+        self._state[:, StatsAccumulator._SUM] += min_dist
+        self._state[:, StatsAccumulator._SQUARES] += np.square(min_dist)
+        np.minimum(self._state[:, StatsAccumulator._MIN], min_dist,
+                   out=self._state[:, StatsAccumulator._MIN])
+
+    def partial(self):
+        """Returns: numpy-array [n_pairs, 5], the running sums"""
+        return self._state
+
+    def merge(self, partial):
+        """Combine with the running sums of another worker."""
+        minimum = np.minimum(self._state[:, StatsAccumulator._MIN],
+                             partial[:, StatsAccumulator._MIN])
+        self._state += partial
+        self._state[:, StatsAccumulator._MIN] = minimum
+
+    def result(self):
+        """Returns: numpy-array [n_pairs, 4], (contact frequency, mean, min,
+        std) of every pair"""
+        num_frames = np.maximum(self._state[:, StatsAccumulator._FRAMES], 1)
+        mean = self._state[:, StatsAccumulator._SUM] / num_frames
+        variance = self._state[:, StatsAccumulator._SQUARES] / num_frames - \
+            np.square(mean)
+        return np.column_stack([
+            self._state[:, StatsAccumulator._CONTACTS] / num_frames, mean,
+            self._state[:, StatsAccumulator._MIN],
+            np.sqrt(np.maximum(variance, 0.0))])
+
+
+class ContactMapAccumulator(object):
+    """Writes the contacts of every frame as a packed bitset.
+
+    Row r of the map is np.packbits(min_dist < cutoff) of the r-th analyzed
+    frame; np.unpackbits(contact_map, axis=1)[:, :n_pairs] gives the boolean
+    [n_frames, n_pairs] map back.
+    """
+
+    def __init__(self, contact_map, cutoff=CONTACT_CUTOFF):
+        """Create the accumulator over a packed map.
+
+        Args:
+            contact_map: numpy-array [n_frames, ceil(n_pairs / 8)] of uint8,
+                usually memory-mapped from a .npy file
+            cutoff: float, a pair is in contact below this min distance
+        """
+        self._contact_map = contact_map
+        self._cutoff = cutoff
+
+    def add(self, row, min_dist):
+        """Record the contacts of the row-th analyzed frame."""
+        self._contact_map[row] = np.packbits(min_dist < self._cutoff)
+
+    def partial(self):
+        """Rows are written in place, nothing to hand back."""
+        if isinstance(self._contact_map, np.memmap):
+            self._contact_map.flush()
+        return None
+
+    def merge(self, partial):
+        """Rows are written in place, nothing to merge."""
+        pass
+
+    def result(self):
+        """Returns: numpy-array [n_frames, ceil(n_pairs / 8)], packed map"""
+        return self._contact_map
+
+
+def write_stats(file_name, labels, stats):
+    """write the per pair statistics as a tab separated table.
+
+    Args:
+        file_name: output file name
+        labels: list of tuple, (label1, label2) of every pair
+        stats: numpy-array [n_pairs, 4], see StatsAccumulator.result
+    """
+    with open(file_name, 'w') as output:
+        output.write("#pair1\tpair2\tcontact_frequency\tmean\tmin\tstd\n")
+        for ((label1, label2), row) in zip(labels, stats):
+            output.write("%s\t%s\t%s\n" % (
+                label1, label2, "\t".join("%.6f" % value for value in row)))
+    log.info("pair statistics written to %s", file_name)
+
+
+def open_contact_map(contact_map, shape, resume=False):
+    """open or create the packed contact map file of a query.
+
+    Args:
+        contact_map: string, .npy file name
+        shape: tuple, (n_rows, n_pairs) of the analyzed frames
+        resume: boolean, reuse the map of an interrupted run
+
+    Returns:
+        numpy.memmap [n_rows, ceil(n_pairs / 8)] of uint8
+    """
+    packed_shape = (shape[0], (shape[1] + 7) // 8)
+    if resume and os.path.exists(contact_map):
+        packed = np.load(contact_map, mmap_mode='r+')
+        if packed.shape != packed_shape:
+            raise ValueError("contact map %s was written for a different "
+                             "selection or trajectory" % contact_map)
+        return packed
+    return np.lib.format.open_memmap(contact_map, mode='w+', dtype=np.uint8,
+                                     shape=packed_shape)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the trajectory analysis hot paths.
+
+A synthetic protein-like system is generated locally: residues of a few
+atoms each, spread over a box and diffusing a little from frame to frame,
+written as a .gro topology and xtc trajectory sections. Then
+
+    dist_histogram  end to end (analysis + plotting) and per stage: frame
+                    I/O, distance matrices, min reduction, binning, plotting
+    validate_pbc    end to end and per stage: CA I/O, batched superposition
+
+are timed. Every case runs in a freshly spawned process, so its peak RSS is
+its own. Results (seconds, frames/sec, peak RSS in MB) are written as json;
+--compare prints the speedup of every case against an earlier result file.
+
+Usage:
+    python benchmark.py --residues 400 --group1 50 --group2 200 \\
+        --frames 2000 --top-k 60 --output results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+DESCRIPTION = 'benchmark dist_histogram and validate_pbc on synthetic data'
+
+# Atom names of a synthetic residue, cycled if a residue has more atoms.
+_ATOM_NAMES = ["N", "CA", "C", "O", "CB", "CG", "CD", "CE", "NZ", "OG"]
+
+# Random displacement (A) of every atom between two frames.
+_DIFFUSION = 0.3
+
+# Distance (A) between the centers of two neighbouring residues.
+_SPACING = 6.0
+
+
+def make_system(workdir, config):
+    """Write a synthetic topology and trajectory.
+
+    Args:
+        workdir: string, output directory
+        config: dict, residues, atoms_per_residue, frames, sections and
+            seed, see main()
+
+    Returns:
+        dict, "topology" file name and "trajectory" list of file names
+    """
+    import MDAnalysis
+
+    num_residues = config["residues"]
+    atoms_per_residue = config["atoms_per_residue"]
+    num_atoms = num_residues * atoms_per_residue
+    rng = np.random.RandomState(config["seed"])
+
+    universe = MDAnalysis.Universe.empty(
+        num_atoms, n_residues=num_residues,
+        atom_resindex=np.repeat(np.arange(num_residues), atoms_per_residue),
+        trajectory=True)
+    universe.add_TopologyAttr(
+        'name', [_ATOM_NAMES[i % len(_ATOM_NAMES)]
+                 for i in range(atoms_per_residue)] * num_residues)
+    universe.add_TopologyAttr('resname', ['ALA'] * num_residues)
+    universe.add_TopologyAttr('resid', np.arange(1, num_residues + 1))
+
+    # residues on a cubic grid, atoms scattered around their center.
+    side = int(np.ceil(num_residues ** (1.0 / 3)))
+    grid = np.indices((side, side, side)).reshape(3, -1).T[:num_residues]
+    centers = np.repeat(grid * _SPACING, atoms_per_residue, axis=0)
+    positions = centers + rng.normal(scale=1.0, size=(num_atoms, 3))
+    box = side * _SPACING + 10.0
+    universe.dimensions = [box, box, box, 90, 90, 90]
+    universe.atoms.positions = positions
+
+    paths = {"topology": os.path.join(workdir, "bench.gro"),
+             "trajectory": []}
+    universe.atoms.write(paths["topology"])
+
+    bounds = np.linspace(0, config["frames"], config["sections"] + 1)
+    for section in range(config["sections"]):
+        name = os.path.join(workdir, "bench_%d.xtc" % section)
+        with MDAnalysis.Writer(name, num_atoms) as writer:
+            for _ in range(int(bounds[section]), int(bounds[section + 1])):
+                positions += rng.normal(scale=_DIFFUSION,
+                                        size=positions.shape)
+                universe.atoms.positions = positions
+                writer.write(universe.atoms)
+        paths["trajectory"].append(name)
+    return paths
+
+
+class _Stages(object):
+    """Accumulates wall time per named stage."""
+
+    def __init__(self):
+        """Create empty timers."""
+        self._seconds = {}
+
+    def time(self, stage, function, *args, **kwargs):
+        """Run function(*args, **kwargs) and add its wall time to stage."""
+        start = time.time()
+        result = function(*args, **kwargs)
+        self._seconds[stage] = self._seconds.get(stage, 0.0) + \
+            time.time() - start
+        return result
+
+    def report(self, num_frames):
+        """Returns: dict, seconds and frames/sec of every stage"""
+        return {stage: {"seconds": seconds,
+                        "frames_per_sec": num_frames / max(seconds, 1e-9)}
+                for (stage, seconds) in self._seconds.items()}
+
+
+def _queries(config):
+    """Returns: (group1, group2) selections of the configured sizes"""
+    return ("resid 1-%d" % config["group1"],
+            "resid %d-%d" % (config["group1"] + 1,
+                             config["group1"] + config["group2"]))
+
+
+def _bench_dist_histogram(config, paths, workdir):
+    """time dist_histogram end to end."""
+    import dist_histogram
+    from MDAnalysis import Universe
+
+    dist_histogram.log.setLevel("WARNING")
+    universe = Universe(paths["topology"], paths["trajectory"])
+    (group1, group2) = _queries(config)
+    stages = _Stages()
+
+    data = stages.time("analysis", dist_histogram.process_trajectory,
+                       universe, group1, group2, "residue", "residue",
+                       neighbor_search=config["neighbor_search"],
+                       workers=config["workers"], stream=True)
+    stages.time("plotting", dist_histogram.plot_data, data,
+                os.path.join(workdir, "bench.png"), 3,
+                per_page=config["per_page"], top_k=config["top_k"],
+                workers=config["workers"])
+    return (universe.trajectory.n_frames, stages)
+
+
+def _bench_dist_histogram_stages(config, paths, workdir):
+    """time the stages of dist_histogram one after the other."""
+    import dist_histogram
+    from accumulators import RIGHT_LIM, HistogramAccumulator
+    from MDAnalysis import Universe
+    from MDAnalysis.lib.distances import distance_array
+    from pair_index import PairIndex
+
+    dist_histogram.log.setLevel("WARNING")
+    universe = Universe(paths["topology"], paths["trajectory"])
+    (group1, group2) = _queries(config)
+    index = PairIndex.build(
+        universe, (group1, group2, "residue", "residue"))
+    ((indices_1, offsets_1), (indices_2, offsets_2)) = index.layouts
+    stages = _Stages()
+
+    def read_frames():
+        return [(time_step.positions[indices_1],
+                 time_step.positions[indices_2])
+                for time_step in universe.trajectory]
+
+    def distances(frames):
+        return [distance_array(positions_1, positions_2, backend="OpenMP")
+                for (positions_1, positions_2) in frames]
+
+    def reduce_minima(matrices):
+        return [np.minimum(np.minimum.reduceat(np.minimum.reduceat(
+            dist, offsets_1, axis=0), offsets_2, axis=1).ravel(),
+            RIGHT_LIM) for dist in matrices]
+
+    def bin_minima(minima):
+        histograms = HistogramAccumulator(index.num_pairs)
+        for (row, min_dist) in enumerate(minima):
+            histograms.add(row, min_dist)
+        return dict(zip(index.pair_labels(), histograms.result()))
+
+    frames = stages.time("io", read_frames)
+    matrices = stages.time("distance", distances, frames)
+    minima = stages.time("reduction", reduce_minima, matrices)
+    counts = stages.time("binning", bin_minima, minima)
+    stages.time("plotting", dist_histogram.plot_data, counts,
+                os.path.join(workdir, "bench_stages.png"), 3,
+                per_page=config["per_page"], top_k=config["top_k"])
+    return (len(frames), stages)
+
+
+def _bench_validate_pbc(config, paths, workdir):
+    """time validate_pbc end to end over all sections."""
+    import validate_pbc
+    from MDAnalysis import Universe
+
+    selection = Universe(paths["topology"]).select_atoms(
+        validate_pbc.SELECTION)
+    init_args = (selection.indices,
+                 selection.positions - selection.positions.mean(axis=0),
+                 {"mode": "full", "threshold": np.inf,
+                  "jump_threshold": validate_pbc.JUMP_THRESHOLD,
+                  "block_size": validate_pbc._BLOCK_SIZE,
+                  "stride": validate_pbc._STRIDE, "report_all": True,
+                  "cache_dir": None})
+    stages = _Stages()
+
+    def validate_all():
+        if config["workers"] > 1:
+            pool = multiprocessing.Pool(config["workers"],
+                                        validate_pbc._init_worker, init_args)
+            try:
+                return pool.map(validate_pbc.validate, paths["trajectory"])
+            finally:
+                pool.close()
+                pool.join()
+        validate_pbc._init_worker(*init_args)
+        return [validate_pbc.validate(name) for name in paths["trajectory"]]
+
+    reports = stages.time("validation", validate_all)
+    return (sum(report["frames"] for report in reports), stages)
+
+
+def _bench_validate_pbc_stages(config, paths, workdir):
+    """time the stages of validate_pbc one after the other."""
+    import validate_pbc
+    from MDAnalysis import Universe
+    from trajectory_cache import open_reader
+
+    selection = Universe(paths["topology"]).select_atoms(
+        validate_pbc.SELECTION)
+    reference = selection.positions - selection.positions.mean(axis=0)
+    stages = _Stages()
+
+    def read_blocks():
+        blocks = []
+        for name in paths["trajectory"]:
+            trajectory = open_reader(name, None)
+            blocks.append(np.array([
+                time_step.positions[selection.indices]
+                for time_step in trajectory]))
+            trajectory.close()
+        return blocks
+
+    def superpose(blocks):
+        return [validate_pbc.superposed_rmsd(block, reference)
+                for block in blocks]
+
+    blocks = stages.time("io", read_blocks)
+    stages.time("superposition", superpose, blocks)
+    return (sum(len(block) for block in blocks), stages)
+
+
+_CASES = {"dist_histogram": _bench_dist_histogram,
+          "dist_histogram_stages": _bench_dist_histogram_stages,
+          "validate_pbc": _bench_validate_pbc,
+          "validate_pbc_stages": _bench_validate_pbc_stages}
+
+
+def _run_case(name, config, paths, workdir, results):
+    """Run one case in this (fresh) process and put its result in a queue.
+
+    Args:
+        name: string, key of _CASES
+        config: dict, benchmark configuration
+        paths: dict, see make_system
+        workdir: string, scratch directory
+        results: multiprocessing.Queue, receives the result dict
+    """
+    start = time.time()
+    (num_frames, stages) = _CASES[name](config, paths, workdir)
+    seconds = time.time() - start
+
+    # ru_maxrss is in KB on Linux.
+    num_frames = int(num_frames)
+    results.put({
+        "case": name,
+        "frames": num_frames,
+        "seconds": seconds,
+        "frames_per_sec": num_frames / max(seconds, 1e-9),
+        "peak_rss_mb": resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "children_peak_rss_mb": resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0,
+        "stages": stages.report(num_frames)})
+
+
+def run_case(name, config, paths, workdir):
+    """Run one case in a freshly spawned process.
+
+    Returns:
+        dict, the result of the case
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_case,
+                              args=(name, config, paths, workdir, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def compare(results, baseline_file):
+    """Print the speedup of every case over a baseline result file."""
+    with open(baseline_file, 'r') as baseline_input:
+        baseline = {result["case"]: result
+                    for result in json.load(baseline_input)["results"]}
+
+    for result in results:
+        old = baseline.get(result["case"])
+        if old is None:
+            continue
+        print("%-24s %8.3f s -> %8.3f s  x%.2f  rss %.0f -> %.0f MB" % (
+            result["case"], old["seconds"], result["seconds"],
+            old["seconds"] / max(result["seconds"], 1e-9),
+            old["peak_rss_mb"], result["peak_rss_mb"]))
+
+
+def main():
+    """Entry to benchmark.py"""
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument('--residues', default=200, type=int,
+                        help='number of residues in the system')
+    parser.add_argument('--atoms-per-residue', default=8, type=int,
+                        help='number of atoms per residue')
+    parser.add_argument('--group1', default=8, type=int,
+                        help='number of residues in group one')
+    parser.add_argument('--group2', default=16, type=int,
+                        help='number of residues in group two')
+    parser.add_argument('--frames', default=500, type=int,
+                        help='number of frames')
+    parser.add_argument('--sections', default=4, type=int,
+                        help='number of xtc files the frames are split into')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='worker processes of the benchmarked tools')
+    parser.add_argument('--neighbor-search', default=False,
+                        action='store_true',
+                        help='benchmark dist_histogram --neighbor-search')
+    parser.add_argument('--per-page', default=30, type=int,
+                        help='histograms per plotted page')
+    parser.add_argument('--top-k', type=int,
+                        help='only plot the top k pairs, all by default')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='seed of the synthetic system')
+    parser.add_argument('--cases', nargs='+', default=sorted(_CASES),
+                        choices=sorted(_CASES), help='cases to run')
+    parser.add_argument('--workdir',
+                        help='directory for the synthetic files, a '
+                             'temporary one by default')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='json file to write the results to')
+    parser.add_argument('--compare',
+                        help='earlier result file to compare against')
+    args = parser.parse_args()
+    if args.group1 + args.group2 > args.residues:
+        parser.error("--group1 + --group2 exceeds --residues")
+
+    config = {"residues": args.residues,
+              "atoms_per_residue": args.atoms_per_residue,
+              "group1": args.group1, "group2": args.group2,
+              "frames": args.frames, "sections": args.sections,
+              "workers": args.workers,
+              "neighbor_search": args.neighbor_search,
+              "per_page": args.per_page, "top_k": args.top_k,
+              "seed": args.seed}
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fiesta3_bench_")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        paths = make_system(workdir, config)
+        results = []
+        for name in args.cases:
+            result = run_case(name, config, paths, workdir)
+            print("%-24s %8.3f s  %10.1f frames/s  %8.1f MB" % (
+                name, result["seconds"], result["frames_per_sec"],
+                result["peak_rss_mb"]))
+            for (stage, timing) in sorted(result["stages"].items()):
+                print("    %-20s %8.3f s  %10.1f frames/s" % (
+                    stage, timing["seconds"], timing["frames_per_sec"]))
+            results.append(result)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as output:
+        json.dump({"config": config,
+                   "host": {"python": platform.python_version(),
+                            "machine": platform.machine(),
+                            "cpus": multiprocessing.cpu_count()},
+                   "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "results": results}, output, indent=4)
+    print("results written to %s" % args.output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Checkpoints of an analysis pass over a trajectory.
+
+A Checkpoint saves the partial results of the accumulators every few
+frames, so an interrupted run resumes from the last save instead of
+starting over:
+
+    checkpoint = Checkpoint("run.ckpt", (n_frames, n_pairs, start, step))
+    next_frame = checkpoint.restore(accumulators)
+    ...
+    checkpoint.maybe_save(row + 1, accumulators)
+"""
+
+import os
+
+import glog as log
+import numpy as np
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# Default number of frames between two checkpoints.
+CHECKPOINT_EVERY = 1000
+
+
+class Checkpoint(object):
+    """Persists the progress of a run so that it can be resumed.
+
+    A checkpoint is a directory holding state.npz: the row of the next
+    analyzed frame to process plus the partial results of every accumulator.
+    Raw rows are not copied into it, they live in a DistanceStore that is
+    flushed before each save.
+    """
+
+    STATE_FILE = "state.npz"
+
+    def __init__(self, path, signature, every=CHECKPOINT_EVERY):
+        """Create a checkpoint handler.
+
+        Args:
+            path: string, the checkpoint directory, created if missing
+            signature: tuple of int, identifies the analyzed frames and
+                pairs of the run, e.g. (n_frames, n_pairs, start, step)
+            every: int, number of frames between two saves
+        """
+        self._path = path
+        self._signature = signature
+        self._every = every
+        self._last_saved = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @property
+    def path(self):
+        """Returns: string, the checkpoint directory"""
+        return self._path
+
+    @property
+    def every(self):
+        """Returns: int, number of frames between two saves"""
+        return self._every
+
+    def maybe_save(self, next_frame, accumulators):
+        """Save if at least `every` frames were processed since last save."""
+        if next_frame - self._last_saved >= self._every:
+            self.save(next_frame, accumulators)
+
+    def save(self, next_frame, accumulators):
+        """Atomically replace the state with the current progress.
+
+        Args:
+            next_frame: int, every frame before it has been processed
+            accumulators: list of accumulators of the run
+        """
+        state = {"next_frame": next_frame, "signature": self._signature}
+        for (index, accumulator) in enumerate(accumulators):
+            partial = accumulator.partial()
+            if partial is not None:
+                state["partial_%d" % index] = partial
+
+        state_file = os.path.join(self._path, Checkpoint.STATE_FILE)
+        with open(state_file + ".tmp", 'wb') as output:
+            np.savez(output, **state)
+        os.rename(state_file + ".tmp", state_file)
+
+        self._last_saved = next_frame
+        log.info("checkpoint saved at frame %d.", next_frame)
+
+    def restore(self, accumulators):
+        """Load the partial results back into freshly created accumulators.
+
+        Args:
+            accumulators: list of accumulators of the run, empty
+
+        Returns:
+            int, the frame to continue from (0 if there is no checkpoint)
+        """
+        state_file = os.path.join(self._path, Checkpoint.STATE_FILE)
+        if not os.path.exists(state_file):
+            log.warning("no checkpoint in %s, starting from frame 0.",
+                        self._path)
+            return 0
+
+        state = np.load(state_file)
+        if tuple(state["signature"]) != tuple(self._signature):
+            raise ValueError("checkpoint %s was written for a different "
+                             "selection or trajectory" % self._path)
+
+        for (index, accumulator) in enumerate(accumulators):
+            key = "partial_%d" % index
+            if key in state:
+                accumulator.merge(state[key])
+
+        self._last_saved = int(state["next_frame"])
+        log.info("resume from checkpoint at frame %d.", self._last_saved)
+        return self._last_saved
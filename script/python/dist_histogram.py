@@ -14,22 +14,66 @@ Then the program will calculate the minimun contact distances for every pair
 of residues defined in the product space of group1 and group2. The program will
 plot the distance with a banch of histograms and will calculate a fitting curve
 for each histograms.
+
+Many selections over the same trajectory can be analyzed in a single pass with
+--jobs, a json file like
+
+{
+  "queries": [
+    { "name": "interface",
+      "group1": "protein and resid 1 2 3",
+      "group2": "protein and resid 4 5 6",
+      "unit1": "residue",
+      "unit2": "atom",
+      "png": "interface.png",
+      "dump": "interface.dist",
+      "contact_map": "interface_contacts.npy",
+      "stats": "interface_stats.tsv"
+    }
+  ]
+}
+
+where unit1/unit2 default to "residue", png defaults to NAME.png and dump,
+contact_map and stats are optional.
+
+Besides the histograms, the same pass can write the contact frequency and the
+mean/min/std of every pair (--stats) and a per frame contact map packed with
+np.packbits (--contact-map), both using the contact --cutoff.
+
+The time spent decoding frames, computing distances, reducing them per unit
+pair, accumulating and plotting is logged with the progress and written to
+NAME_profile.json next to the figure (or the job file); --profile also
+writes the cProfile stats of the main process to NAME.prof.
 """
 
 import argparse
-import itertools
-import pickle
+import cProfile
+import json
+import multiprocessing
+import os
 
 import glog as log
 import numpy as np
-from MDAnalysis import Universe
 from MDAnalysis.lib.distances import distance_array
 
 from scipy.interpolate import interp1d
+from scipy.spatial import cKDTree
+
+from accumulators import (BIN_EDGES, CONTACT_CUTOFF, LEFT_LIM, NUM_BINS,
+                          RIGHT_LIM, ContactMapAccumulator,
+                          HistogramAccumulator, RawAccumulator,
+                          StatsAccumulator, bin_data, open_contact_map,
+                          write_stats)
+from checkpoint import CHECKPOINT_EVERY, Checkpoint
+from distance_store import DTYPES, DistanceStore
+from pair_index import file_digest, load_pair_index
+from stage_profile import Progress, StageProfile
+from trajectory_cache import DEFAULT_CACHE_DIR, frame_sizes, open_universe
 
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
 
 
 __author__ = 'davislong198833@gmail.com (Yunlong Liu)'
@@ -40,74 +84,889 @@ log.setLevel("INFO")
 
 # Global constants for plotting data.
 _COLUMN_WIDTH = 4
-_NUM_BINS = 50
-
-_LEFT_LIM = 0
-_RIGHT_LIM = 10
 
 # Used for plotting fitting curve. The more samples, the smoother.
 _NUM_SAMPLE = 200
+_FITTING_X = np.linspace(LEFT_LIM, RIGHT_LIM, _NUM_SAMPLE, endpoint=True)
+
+# Each worker process gets this many frame chunks for load balancing.
+_CHUNKS_PER_WORKER = 4
+
+
+def fit_histograms(counts):
+    """normalize histograms and fit a cubic spline to all of them at once.
+
+    Args:
+        counts: numpy-array [n_pairs, NUM_BINS] of bin counts
+
+    Returns:
+        (num_frames, frequency, curves), numpy-arrays [n_pairs] of frames
+        per histogram, [n_pairs, NUM_BINS] of frequencies and
+        [n_pairs, _NUM_SAMPLE] of the fitting curves sampled at _FITTING_X
+    """
+    counts = np.asarray(counts, dtype=float).reshape(-1, NUM_BINS)
+    # every frame contributes exactly one count to a pair's histogram.
+    num_frames = counts.sum(axis=1)
+    frequency = counts / np.maximum(num_frames, 1)[:, np.newaxis]
+
+    knots = np.hstack([frequency, np.zeros((len(frequency), 1))])
+    curves = interp1d(BIN_EDGES, knots, kind='cubic', axis=1)(_FITTING_X)
+    return (num_frames.astype(int), frequency, curves)
 
-# index used for refering elements in _UNIT
-_TYPE = 0
-_POSITION = 1
-_LABEL = 2
 
-# define AtomGroup-type specific properties.
-_UNIT = {"residue": ("residues",
-                     lambda grp: grp.positions,
-                     lambda grp, i: "%s_%d_%d" % (grp.resname,
-                                                  grp.resid, i)),
-         "atom": ("atoms",
-                  lambda atom: np.array([atom.position]),
-                  lambda atom, i: "%s_%d_%s_%d" % (
-                      atom.resname, atom.resid, atom.name, i))}
+def contact_bins(cutoff):
+    """number of histogram bins below a contact cutoff.
 
+    Args:
+        cutoff: float, contact cutoff (A)
+
+    Returns:
+        int, the bins below cutoff
+
+    Raises:
+        ValueError: cutoff is not a bin edge, so the counts cannot tell
+            contacts from non-contacts
+    """
+    edge = (cutoff - LEFT_LIM) * NUM_BINS / (RIGHT_LIM - LEFT_LIM)
+    bins = int(round(edge))
+    if abs(edge - bins) > 1e-6 or not 0 <= bins <= NUM_BINS:
+        raise ValueError("cutoff %g A is not a histogram bin edge, a "
+                         "multiple of %g A in [%g, %g]" %
+                         (cutoff, BIN_EDGES[1] - BIN_EDGES[0],
+                          LEFT_LIM, RIGHT_LIM))
+    return bins
+
+
+def contact_frequency(counts, cutoff=CONTACT_CUTOFF):
+    """fraction of frames with the min distance below cutoff.
+
+    Args:
+        counts: numpy-array [n_pairs, NUM_BINS] of bin counts
+        cutoff: float, contact cutoff (A), see contact_bins
+
+    Returns:
+        numpy-array [n_pairs] of frequencies
+    """
+    counts = np.asarray(counts, dtype=float).reshape(-1, NUM_BINS)
+    return counts[:, :contact_bins(cutoff)].sum(axis=1) / \
+        np.maximum(counts.sum(axis=1), 1)
 
-def plot_data(data, file_name, num_columns):
-    """plot data to histograms.
+
+def _page_files(file_name, num_pages):
+    """name the figure file of every page.
 
     Args:
-        data: dict type, (name, numpy-array [float32])
         file_name: figure file name
-        num_columns: int, number of columns in the plot
+        num_pages: int, number of pages
+
+    Returns:
+        list of string, file_name itself for a single page, otherwise
+        NAME_001.EXT, NAME_002.EXT, ...
     """
-    num_rows = int(np.ceil(float(len(data)) / num_columns))
+    if num_pages == 1:
+        return [file_name]
+    (root, ext) = os.path.splitext(file_name)
+    return ["%s_%03d%s" % (root, page + 1, ext) for page in range(num_pages)]
+
+
+def _render_page(task):
+    """lay out the histograms of one page.
+
+    Args:
+        task: tuple, (file_name, num_columns, names, num_frames, frequency,
+            curves) with the rows of fit_histograms for the page. The
+            figure is saved to file_name, or returned if it is None.
+
+    Returns:
+        the matplotlib Figure if file_name is None
+    """
+    (file_name, num_columns, names, num_frames, frequency, curves) = task
+    num_rows = int(np.ceil(float(len(names)) / num_columns))
 
     # create figure handle
-    plt.figure(figsize=(num_columns * _COLUMN_WIDTH,
-                        num_rows * _COLUMN_WIDTH))
+    figure = plt.figure(figsize=(num_columns * _COLUMN_WIDTH,
+                                 num_rows * _COLUMN_WIDTH))
 
-    for (plt_index, (name, dist_data)) in enumerate(data.iteritems()):
-        row_index = plt_index / num_columns
+    for (plt_index, name) in enumerate(names):
+        row_index = plt_index // num_columns
         col_index = plt_index % num_columns
 
         axe = plt.subplot2grid((num_rows, num_columns),
                                (row_index, col_index))
 
-        weights = np.ones_like(dist_data) / len(dist_data)
-        counts, bins, _ = axe.hist(dist_data, _NUM_BINS, weights=weights,
-                                   range=(_LEFT_LIM, _RIGHT_LIM),
-                                   facecolor='green', alpha=0.25)
-
-        fitting_curve = interp1d(bins, np.append(counts, 0.0), kind='cubic')
-        fitting_x = np.linspace(_LEFT_LIM, _RIGHT_LIM,
-                                _NUM_SAMPLE, endpoint=True)
-        axe.plot(fitting_x, fitting_curve(fitting_x), 'r-', linewidth=2.0)
+        axe.bar(BIN_EDGES[:-1], frequency[plt_index], np.diff(BIN_EDGES),
+                align='edge', facecolor='green', alpha=0.25)
+        axe.plot(_FITTING_X, curves[plt_index], 'r-', linewidth=2.0)
 
         axe.set_xlabel("%s vs. %s (A)" % (name[0][:-2], name[1][:-2]),
                        fontsize=10, color='blue', variant='small-caps')
-        axe.set_ylabel(r"Frequency in %d frames" % len(dist_data),
+        axe.set_ylabel(r"Frequency in %d frames" % num_frames[plt_index],
                        fontsize=10, color='blue', variant='small-caps')
-        axe.set_xlim(left=_LEFT_LIM, right=_RIGHT_LIM)
+        axe.set_xlim(left=LEFT_LIM, right=RIGHT_LIM)
 
-    plt.tight_layout()
-    plt.savefig(file_name)
+    figure.tight_layout()
+    if file_name is None:
+        return figure
+
+    figure.savefig(file_name)
+    plt.close(figure)
     log.info("save figure to file %s", file_name)
-    plt.close()
+    return None
+
+
+def plot_data(data, file_name, num_columns, per_page=None, top_k=None,
+              workers=1, cutoff=CONTACT_CUTOFF):
+    """plot pre-binned data to histograms.
+
+    All histograms are normalized and fitted in one batch, then the pages
+    are laid out in a process pool. A .pdf file_name gets one pdf page per
+    page, other formats get one file per page.
+
+    Args:
+        data: dict type, (name, numpy-array [NUM_BINS] of bin counts)
+        file_name: figure file name
+        num_columns: int, number of columns in the plot
+        per_page: int, max number of histograms on a page, None for a
+            single page
+        top_k: int, only plot the top_k pairs by contact frequency, in
+            decreasing order
+        workers: int, number of processes rendering pages
+        cutoff: float, contact cutoff of the top_k ranking (A), see
+            contact_bins
+    """
+    names = list(data.keys())
+    if not names:
+        log.warning("no histogram to plot")
+        return
+    counts = np.array([data[name] for name in names])
+
+    if top_k is not None:
+        order = np.argsort(-contact_frequency(counts, cutoff),
+                           kind='stable')[:top_k]
+        names = [names[index] for index in order]
+        counts = counts[order]
+
+    (num_frames, frequency, curves) = fit_histograms(counts)
+
+    per_page = per_page or len(names)
+    pages = [slice(first, first + per_page)
+             for first in range(0, len(names), per_page)]
+    pdf = file_name.lower().endswith(".pdf")
+    page_files = [None] * len(pages) if pdf else \
+        _page_files(file_name, len(pages))
+    tasks = [(page_file, num_columns, names[page], num_frames[page],
+              frequency[page], curves[page])
+             for (page_file, page) in zip(page_files, pages)]
+
+    workers = min(workers, len(tasks))
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        figures = pool.imap(_render_page, tasks) if pool is not None else \
+            (_render_page(task) for task in tasks)
+        if pdf:
+            # pages come back laid out and in order, the parent only draws
+            # them into the single pdf.
+            with PdfPages(file_name) as pdf_pages:
+                for figure in figures:
+                    pdf_pages.savefig(figure)
+                    plt.close(figure)
+            log.info("save %d pages to file %s", len(tasks), file_name)
+        else:
+            # drain the pool, the workers save their pages themselves.
+            for _ in figures:
+                pass
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _unit_owners(offsets, num_atoms):
+    """map every atom of a flattened group back to its unit.
+
+    Args:
+        offsets: numpy-array [int], unit boundaries from _unit_layout
+        num_atoms: int, total number of atoms in the flattened group
+
+    Returns:
+        numpy-array [num_atoms], unit index of every atom
+    """
+    return np.repeat(np.arange(len(offsets)),
+                     np.diff(np.append(offsets, num_atoms)))
+
+
+def _frame_min_distances(positions_1, positions_2, offsets_1, offsets_2,
+                         profile):
+    """calculate the min distances of all unit pairs in a single frame.
+
+    One distance matrix is computed between all atoms of group1 and all
+    atoms of group2. It is then reduced segment-wise over the unit
+    boundaries, first along the rows and then along the columns.
+
+    Args:
+        positions_1: numpy-array [n_atoms_1, 3], atom positions of group1
+        positions_2: numpy-array [n_atoms_2, 3], atom positions of group2
+        offsets_1: numpy-array [int], unit boundaries inside positions_1
+        offsets_2: numpy-array [int], unit boundaries inside positions_2
+        profile: StageProfile, times the distance and reduction stages
+
+    Returns:
+        numpy-array [n_units_1 * n_units_2], min distances clamped to
+        RIGHT_LIM, ordered as itertools.product(units_1, units_2).
+    """
+    start = profile.clock()
+    dist = distance_array(positions_1, positions_2, backend="OpenMP")
+    start = profile.time("distance", start)
+    profile.count("atom_pairs", dist.size)
+
+    dist = np.minimum.reduceat(dist, offsets_1, axis=0)
+    dist = np.minimum.reduceat(dist, offsets_2, axis=1)
+    min_dist = np.minimum(dist.ravel(), RIGHT_LIM)
+    profile.time("reduction", start)
+    return min_dist
+
+
+def _frame_min_contacts(positions_1, positions_2, owners_1, owners_2,
+                        profile):
+    """calculate the min distances of all unit pairs within RIGHT_LIM.
+
+    Instead of the full distance matrix, a KD-tree neighbor search only
+    evaluates the atom pairs closer than RIGHT_LIM. Unit pairs without any
+    atom pair in range are filled with RIGHT_LIM directly, which is what
+    _frame_min_distances clamps them to anyway.
+
+    Args:
+        positions_1: numpy-array [n_atoms_1, 3], atom positions of group1
+        positions_2: numpy-array [n_atoms_2, 3], atom positions of group2
+        owners_1: numpy-array [n_atoms_1], unit index of every group1 atom
+        owners_2: numpy-array [n_atoms_2], unit index of every group2 atom
+        profile: StageProfile, times the distance and reduction stages, only
+            the atom pairs in range are counted
+
+    Returns:
+        numpy-array [n_units_1 * n_units_2], same as _frame_min_distances
+        up to the rounding of single precision coordinates.
+    """
+    num_units_2 = owners_2[-1] + 1
+    start = profile.clock()
+    contacts = cKDTree(positions_1).sparse_distance_matrix(
+        cKDTree(positions_2), RIGHT_LIM, output_type='ndarray')
+    start = profile.time("distance", start)
+    profile.count("atom_pairs", len(contacts))
+
+    min_dist = np.full((owners_1[-1] + 1) * num_units_2, float(RIGHT_LIM))
+    np.minimum.at(min_dist,
+                  owners_1[contacts['i']] * num_units_2 +
+                  owners_2[contacts['j']], contacts['v'])
+    profile.time("reduction", start)
+    return min_dist
+
+
+def _pair_kernel(layout_1, layout_2, neighbor_search=False, profile=None):
+    """build the per-frame min distance function of two flattened groups.
+
+    Args:
+        layout_1: tuple, (indices, offsets) of group1, see PairIndex.layouts
+        layout_2: tuple, (indices, offsets) of group2, see PairIndex.layouts
+        neighbor_search: boolean, only evaluate atom pairs within RIGHT_LIM
+        profile: StageProfile the kernel reports to, None for none
+
+    Returns:
+        function, positions -> numpy-array [n_pairs], where positions is
+        indexed by the atom indices of the layouts
+    """
+    (indices_1, offsets_1) = layout_1
+    (indices_2, offsets_2) = layout_2
+    if profile is None:
+        profile = StageProfile()
+
+    if neighbor_search:
+        owners_1 = _unit_owners(offsets_1, len(indices_1))
+        owners_2 = _unit_owners(offsets_2, len(indices_2))
+        return lambda positions: _frame_min_contacts(
+            positions[indices_1], positions[indices_2], owners_1, owners_2,
+            profile)
+
+    return lambda positions: _frame_min_distances(
+        positions[indices_1], positions[indices_2], offsets_1, offsets_2,
+        profile)
+
+
+def _resolve_queries(universe, queries, cache_dir=None):
+    """resolve the selections of all queries.
+
+    Args:
+        universe: Universe Object
+        queries: list of tuple, (group1, group2, unit1, unit2)
+        cache_dir: string, PairIndex cache directory, None disables it
+
+    Returns:
+        list of PairIndex, one per query
+    """
+    topology_hash = None
+    if cache_dir is not None:
+        topology_hash = file_digest(universe.filename)
+    return [load_pair_index(universe, query, cache_dir, topology_hash)
+            for query in queries]
+
+
+def _query_kernels(layouts, neighbor_search=False, profile=None):
+    """build the kernels of all queries against a shared atom union.
+
+    Every atom used by any query is gathered once per frame; the kernels
+    index into that union instead of into the whole system.
+
+    Args:
+        layouts: list of tuple, PairIndex.layouts of every query
+        neighbor_search: boolean, only evaluate atom pairs within RIGHT_LIM
+        profile: StageProfile the kernels report to, None for none
+
+    Returns:
+        (numpy-array [int], list), the atom indices of the union and the
+        kernel of every query
+    """
+    union = np.unique(np.concatenate(
+        [layout[0] for pair in layouts for layout in pair]))
+
+    kernels = [_pair_kernel((np.searchsorted(union, layout_1[0]), layout_1[1]),
+                            (np.searchsorted(union, layout_2[0]), layout_2[1]),
+                            neighbor_search, profile)
+               for (layout_1, layout_2) in layouts]
+
+    return (union, kernels)
+
+
+def _trajectory_sources(universe):
+    """list the trajectory files of a universe with their frame counts.
+
+    Returns:
+        list of (path, n_frames) in frame order
+    """
+    readers = getattr(universe.trajectory, "readers", [universe.trajectory])
+    return [(reader.filename, reader.n_frames) for reader in readers]
+
+
+def _attach_raw_data(raw_source, shape):
+    """map the raw [n_frames, n_pairs] result of a query into this process.
+
+    Args:
+        raw_source: multiprocessing.RawArray, a (store directory, row of
+            frame 0, total rows) tuple, or None when only histograms are kept
+        shape: tuple, (n_frames, n_pairs)
+
+    Returns:
+        numpy-array or BlockRows [n_frames, n_pairs], or None
+    """
+    if raw_source is None:
+        return None
+    if isinstance(raw_source, tuple):
+        (store, first_row, num_rows) = raw_source
+        return DistanceStore(store, 'r+', num_rows).rows(first_row)
+    return np.ctypeslib.as_array(raw_source).reshape(shape)
+
+
+def _new_accumulators(raw_data, num_pairs, histogram, stats=False,
+                      contact_map=None, cutoff=CONTACT_CUTOFF):
+    """create the accumulators of a query.
+
+    Args:
+        raw_data: numpy-array [n_frames, n_pairs] for the raw rows, or None
+        num_pairs: int, number of unit pairs
+        histogram: boolean, bin frames into histograms on the fly
+        stats: boolean, keep per pair statistics
+        contact_map: numpy-array, packed contact map, or None
+        cutoff: float, contact cutoff of the statistics and contact map
+
+    Returns:
+        list of accumulators in this order: histogram, raw, statistics and
+        contact map, each one only if requested
+    """
+    accumulators = []
+    if histogram:
+        accumulators.append(HistogramAccumulator(num_pairs))
+    if raw_data is not None:
+        accumulators.append(RawAccumulator(raw_data))
+    if stats:
+        accumulators.append(StatsAccumulator(num_pairs, cutoff))
+    if contact_map is not None:
+        accumulators.append(ContactMapAccumulator(contact_map, cutoff))
+    return accumulators
+
+
+def _find(accumulators, kind):
+    """Returns: the accumulator of the given class in a query's list"""
+    return next(accumulator for accumulator in accumulators
+                if isinstance(accumulator, kind))
+
 
+def _flatten(query_accumulators):
+    """Returns: list, the accumulators of all queries in one list"""
+    return [accumulator for accumulators in query_accumulators
+            for accumulator in accumulators]
 
-def process_trajectory(universe, group1, group2, unit1, unit2):
+
+def _frame_range(universe, frames=None):
+    """resolve a frame slice against the trajectory.
+
+    Args:
+        universe: Universe Object
+        frames: slice of frame indices, None for the whole trajectory
+
+    Returns:
+        range, the indices of the analyzed frames
+    """
+    return range(universe.trajectory.n_frames)[frames or slice(None)]
+
+
+def _iter_frames(trajectory, frame_range, first_row=0, stop_row=None):
+    """iterate over a block of the analyzed frames.
+
+    The trajectory is sliced instead of iterated and filtered, so readers
+    with a frame offsets index (xtc/trr) seek straight to every frame.
+
+    Args:
+        trajectory: the trajectory reader
+        frame_range: range, the indices of the analyzed frames
+        first_row: int, first analyzed frame of the block
+        stop_row: int, end of the block, None for the end of frame_range
+
+    Returns:
+        iterator of (row, Timestep)
+    """
+    rows = frame_range[first_row:stop_row]
+    return enumerate(trajectory[rows.start:rows.stop:rows.step], first_row)
+
+
+def _profiled_frames(frames, profile, sizes):
+    """time the decoding of the frames of an _iter_frames() iterator.
+
+    The time until the reader yields the next frame goes to the decode
+    stage; the frames and their bytes on disk are counted.
+
+    Args:
+        frames: iterator of (row, Timestep)
+        profile: StageProfile
+        sizes: numpy-array [int], bytes of every frame, see frame_sizes
+
+    Returns:
+        iterator of (row, Timestep), the same frames
+    """
+    start = profile.clock()
+    for (row, time_step) in frames:
+        profile.time("decode", start)
+        profile.count("frames")
+        profile.count("bytes_read", sizes[time_step.frame])
+        yield (row, time_step)
+        start = profile.clock()
+
+
+def time_window(universe, begin_ps=None, end_ps=None):
+    """convert a time window into a slice of frame indices.
+
+    Args:
+        universe: Universe Object
+        begin_ps: float, time of the first frame to analyze (ps)
+        end_ps: float, time of the last frame to analyze (ps)
+
+    Returns:
+        slice of the frames with begin_ps <= time <= end_ps
+
+    Raises:
+        ValueError: the frames have no positive time step, e.g. their
+            times were not written
+    """
+    trajectory = universe.trajectory
+    if trajectory.dt <= 0:
+        raise ValueError("the trajectory has a time step of %g ps, select "
+                         "frames by --start/--stop instead of by time" %
+                         trajectory.dt)
+    first_time = trajectory[0].time
+    # tolerate the rounding of times stored in single precision.
+    tolerance = 1e-3 * trajectory.dt
+
+    start = None
+    if begin_ps is not None:
+        start = max(0, int(np.ceil((begin_ps - first_time - tolerance) /
+                                   trajectory.dt)))
+    stop = None
+    if end_ps is not None:
+        stop = max(0, int(np.floor((end_ps - first_time + tolerance) /
+                                   trajectory.dt)) + 1)
+    return slice(start, stop)
+
+
+def _accumulate_frame(time_step, row, union, kernels, query_accumulators,
+                      profile):
+    """feed one frame to the accumulators of every query.
+
+    Args:
+        time_step: Timestep of the frame
+        row: int, index of the frame among the analyzed frames
+        union: numpy-array [int], atom indices shared by all queries
+        kernels: list of functions, see _pair_kernel
+        query_accumulators: list of list of accumulators, per query
+        profile: StageProfile, gathering the coordinates counts as decoding
+    """
+    start = profile.clock()
+    positions = time_step.positions[union]
+    profile.time("decode", start)
+    for (kernel, accumulators) in zip(kernels, query_accumulators):
+        min_dist = kernel(positions)
+        start = profile.clock()
+        for accumulator in accumulators:
+            accumulator.add(row, min_dist)
+        profile.time("accumulate", start)
+
+
+# Per-process state of a frame-parallel run, set up by _init_worker.
+_WORKER = {}
+
+
+def _init_worker(topology, trajectory, cache_dir, frame_range, layouts,
+                 options, raw_sources, contact_maps, shapes, counter):
+    """open an independent Universe in a worker process.
+
+    Args:
+        topology: topology file name
+        trajectory: trajectory file name(s)
+        cache_dir: string, reader cache directory, see trajectory_cache
+        frame_range: range, the indices of the analyzed frames
+        layouts: list of tuple, PairIndex.layouts of every query
+        options: tuple, (neighbor_search, list of boolean whether every
+            query keeps histograms, list of boolean whether every query
+            keeps statistics, contact cutoff)
+        raw_sources: list, where raw rows of every query go, see
+            _attach_raw_data
+        contact_maps: list of string or None, contact map file per query
+        shapes: list of tuple, (n_rows, n_pairs) of every query
+        counter: multiprocessing.Value, frames processed by all workers
+    """
+    (neighbor_search, histograms, stats, cutoff) = options
+    universe = open_universe(topology, trajectory, cache_dir)
+
+    _WORKER["universe"] = universe
+    _WORKER["frame_sizes"] = frame_sizes(universe.trajectory)
+    _WORKER["frame_range"] = frame_range
+    _WORKER["layouts"] = layouts
+    _WORKER["neighbor_search"] = neighbor_search
+    _WORKER["raw_data"] = [_attach_raw_data(raw_source, shape) for
+                           (raw_source, shape) in zip(raw_sources, shapes)]
+    _WORKER["contact_maps"] = [
+        None if contact_map is None else np.load(contact_map, mmap_mode='r+')
+        for contact_map in contact_maps]
+    _WORKER["histograms"] = histograms
+    _WORKER["stats"] = stats
+    _WORKER["cutoff"] = cutoff
+    _WORKER["shapes"] = shapes
+    _WORKER["counter"] = counter
+    _WORKER["progress"] = Progress(shapes[0][0], counter.value)
+
+
+def _process_chunk(chunk):
+    """worker task: process the analyzed frames in rows [start, stop).
+
+    Args:
+        chunk: tuple, (start, stop) rows of the analyzed frames
+
+    Returns:
+        (list, tuple), the partial results of the chunk's accumulators, all
+        queries flattened, and the partial StageProfile of the chunk
+    """
+    counter = _WORKER["counter"]
+    profile = StageProfile()
+    (union, kernels) = _query_kernels(_WORKER["layouts"],
+                                      _WORKER["neighbor_search"], profile)
+    query_accumulators = [
+        _new_accumulators(raw_data, shape[1], histogram, stats=stats,
+                          contact_map=contact_map, cutoff=_WORKER["cutoff"])
+        for (raw_data, shape, histogram, stats, contact_map) in zip(
+            _WORKER["raw_data"], _WORKER["shapes"], _WORKER["histograms"],
+            _WORKER["stats"], _WORKER["contact_maps"])]
+
+    frames = _iter_frames(_WORKER["universe"].trajectory,
+                          _WORKER["frame_range"], chunk[0], chunk[1])
+    for (row, time_step) in _profiled_frames(frames, profile,
+                                             _WORKER["frame_sizes"]):
+        _accumulate_frame(time_step, row, union, kernels, query_accumulators,
+                          profile)
+
+        with counter.get_lock():
+            counter.value += 1
+            num_done = counter.value
+        _WORKER["progress"].update(num_done, profile)
+
+    return ([accumulator.partial()
+             for accumulator in _flatten(query_accumulators)],
+            profile.partial())
+
+
+def _frame_chunks(start, stop, num_chunks, max_size=None):
+    """split the rows [start, stop) of the analyzed frames into chunks.
+
+    Args:
+        start: int, first row
+        stop: int, end of the rows
+        num_chunks: int, minimal number of chunks
+        max_size: int, optional upper bound of the chunk size
+
+    Returns:
+        list of tuple, (start, stop) of every chunk in order
+    """
+    if max_size:
+        num_chunks = max(num_chunks, int(np.ceil((stop - start) /
+                                                 float(max_size))))
+    bounds = np.unique(np.linspace(start, stop, num_chunks + 1).astype(int))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _process_parallel(universe, frame_range, worker_args, accumulators,
+                      workers, start=0, checkpoint=None, cache_dir=None,
+                      profile=None):
+    """process the trajectory with frame-parallel worker processes.
+
+    The frame range is split into contiguous chunks. Every worker opens its
+    own Universe, raw rows are written into shared memory or the store and
+    histogram counts are merged back in frame order, so the result does not
+    depend on which worker finishes first.
+
+    Args:
+        universe: Universe Object, only used for its file names
+        frame_range: range, the indices of the analyzed frames
+        worker_args: tuple, (layouts, options, raw_sources, contact_maps,
+            shapes), see _init_worker
+        accumulators: list, accumulators of all queries of the main
+            process to merge into, flattened
+        workers: int, number of worker processes
+        start: int, row of the first analyzed frame to process
+        checkpoint: Checkpoint, saved whenever a chunk is merged
+        cache_dir: string, reader cache directory the workers open the
+            trajectory through
+        profile: StageProfile, the stage times of all workers are added to
+            it
+    """
+    counter = multiprocessing.Value('l', start)
+
+    chunks = _frame_chunks(start, len(frame_range),
+                           workers * _CHUNKS_PER_WORKER,
+                           checkpoint.every if checkpoint else None)
+
+    trajectory = [path for (path, _) in _trajectory_sources(universe)]
+
+    pool = multiprocessing.Pool(
+        workers, _init_worker,
+        (universe.filename, trajectory, cache_dir, frame_range) +
+        tuple(worker_args) + (counter,))
+    try:
+        # chunks come back in order, so every frame before the end of the
+        # merged chunk is done when the checkpoint is written.
+        for (chunk, (partials, stages)) in zip(
+                chunks, pool.imap(_process_chunk, chunks)):
+            for (accumulator, partial) in zip(accumulators, partials):
+                accumulator.merge(partial)
+            if profile is not None:
+                profile.merge(stages)
+            if checkpoint is not None:
+                checkpoint.maybe_save(chunk[1], accumulators)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _open_store(store, labels, shape, frames=None, resume=False,
+                first_frame=None, dtype="float64"):
+    """open or create the DistanceStore of a query.
+
+    Args:
+        store: string, the store directory
+        labels: list of tuple, pair labels of the query
+        shape: tuple, (n_rows, n_pairs) of the analyzed frames
+        frames: range, the analyzed frames if not the whole trajectory
+        resume: boolean, reuse the store of an interrupted run
+        first_frame: int, append mode, see process_trajectory
+        dtype: string, encoding of a new store, appends and resumed runs
+            keep the one of the existing store
+
+    Returns:
+        (DistanceStore, tuple), the store and its raw source for
+        _attach_raw_data
+    """
+    first_row = 0
+    if first_frame is not None:
+        distance_store = DistanceStore(store, 'r+')
+        if distance_store.labels != labels:
+            raise ValueError("store %s holds a different selection" % store)
+        first_row = distance_store.extend(shape[0] - first_frame) - \
+            first_frame
+    elif resume and os.path.isdir(store):
+        distance_store = DistanceStore(store, 'r+')
+    else:
+        distance_store = DistanceStore.create(store, labels, shape[0],
+                                              dtype, frames)
+
+    return (distance_store, (store, first_row, distance_store.num_frames))
+
+
+def process_queries(universe, queries, neighbor_search=False, workers=1,
+                    stream=False, stores=None, checkpoint=None,
+                    checkpoint_every=CHECKPOINT_EVERY, resume=False,
+                    first_frame=None, frames=None, contact_maps=None,
+                    stats=None, cutoff=CONTACT_CUTOFF, dtype="float64",
+                    index_cache=None, cache_dir=None, profile=None):
+    """process the trajectory once for several group1 x group2 queries.
+
+    Frames are decoded once and the coordinates of the union of all
+    selected atoms are gathered once per frame, then every query computes
+    its own pair-wise min distances from them.
+
+    Args:
+        universe: Universe Object
+        queries: list of tuple, (group1, group2, unit1, unit2)
+        stores: list of string or None, DistanceStore directory per query
+        contact_maps: list of string or None, contact map file per query
+        stats: list of string or None, statistics file per query
+        profile: StageProfile to add the stage times and counters to, see
+            process_trajectory
+        others: see process_trajectory
+
+    Returns:
+        list of dict, the data of every query, see process_trajectory
+    """
+    if profile is None:
+        profile = StageProfile()
+    indices = _resolve_queries(universe, queries, index_cache)
+    layouts = [index.layouts for index in indices]
+    (union, kernels) = _query_kernels(layouts, neighbor_search, profile)
+    frame_range = _frame_range(universe, frames)
+    num_rows = len(frame_range)
+    subsampled = num_rows != universe.trajectory.n_frames
+    stores = list(stores or [None] * len(queries))
+    contact_maps = list(contact_maps or [None] * len(queries))
+    stats = list(stats or [None] * len(queries))
+    if first_frame is not None and (subsampled or any(contact_maps) or
+                                    any(stats)):
+        raise ValueError("appending is not supported for subsampled runs, "
+                         "contact maps or statistics")
+    shapes = [(num_rows, index.num_pairs) for index in indices]
+    labels = [index.pair_labels() for index in indices]
+
+    for index in indices:
+        for group in (0, 1):
+            log.info("%d residues [%d atoms] selected in group %d.",
+                     index.num_units[group], index.num_atoms[group],
+                     group + 1)
+    if len(queries) > 1:
+        log.info("%d atoms read per frame for %d queries.", len(union),
+                 len(queries))
+    if subsampled:
+        log.info("analyzing %d of %d frames [%d:%d:%d].", num_rows,
+                 universe.trajectory.n_frames, frame_range.start,
+                 frame_range.stop, frame_range.step)
+
+    progress = None
+    if checkpoint is not None:
+        progress = Checkpoint(
+            checkpoint, (num_rows, sum(shape[1] for shape in shapes),
+                         frame_range.start, frame_range.step),
+            checkpoint_every)
+        if not stream:
+            stores = [os.path.join(checkpoint, "minima_%d" % index)
+                      if store is None else store
+                      for (index, store) in enumerate(stores)]
+
+    start = first_frame or 0
+    distance_stores = []
+    raw_sources = []
+    histograms = []
+    query_accumulators = []
+    for (store, contact_map, stats_file, query_labels, shape) in zip(
+            stores, contact_maps, stats, labels, shapes):
+        distance_store = None
+        raw_source = None
+        if store is not None:
+            (distance_store, raw_source) = _open_store(
+                store, query_labels, shape,
+                frames=frame_range if subsampled else None, resume=resume,
+                first_frame=first_frame, dtype=dtype)
+        elif not stream and workers > 1:
+            raw_source = multiprocessing.RawArray(
+                np.ctypeslib.as_ctypes_type(np.dtype(dtype)),
+                int(shape[0] * shape[1]))
+
+        # stored runs always keep histograms, so that appends can merge them.
+        histogram = stream or distance_store is not None
+        raw_data = _attach_raw_data(raw_source, shape)
+        if raw_data is None and not stream:
+            raw_data = np.empty(shape, dtype=dtype)
+        accumulators = _new_accumulators(
+            raw_data, shape[1], histogram, stats=stats_file is not None,
+            contact_map=None if contact_map is None else
+            open_contact_map(contact_map, shape, resume), cutoff=cutoff)
+
+        if first_frame is not None and distance_store.counts is not None:
+            accumulators[0].merge(distance_store.counts)
+
+        distance_stores.append(distance_store)
+        raw_sources.append(raw_source)
+        histograms.append(histogram)
+        query_accumulators.append(accumulators)
+
+    if resume and progress is not None:
+        start = progress.restore(_flatten(query_accumulators))
+
+    if workers > 1:
+        log.info("processing frames with %d workers.", workers)
+        _process_parallel(
+            universe, frame_range,
+            (layouts, (neighbor_search, histograms,
+                       [stats_file is not None for stats_file in stats],
+                       cutoff),
+             raw_sources, contact_maps, shapes),
+            _flatten(query_accumulators), workers, start=start,
+            checkpoint=progress, cache_dir=cache_dir, profile=profile)
+    else:
+        reporter = Progress(num_rows, start)
+        frames = _iter_frames(universe.trajectory, frame_range, start)
+        for (row, time_step) in _profiled_frames(
+                frames, profile, frame_sizes(universe.trajectory)):
+            _accumulate_frame(time_step, row, union, kernels,
+                              query_accumulators, profile)
+
+            if progress is not None:
+                progress.maybe_save(row + 1, _flatten(query_accumulators))
+            reporter.update(row + 1, profile)
+
+    if progress is not None:
+        progress.save(num_rows, _flatten(query_accumulators))
+
+    results = []
+    for (distance_store, accumulators, contact_map, stats_file,
+         query_labels) in zip(distance_stores, query_accumulators,
+                              contact_maps, stats, labels):
+        if distance_store is not None:
+            distance_store.commit(_trajectory_sources(universe),
+                                  accumulators[0].result())
+            log.info("min distances stored in %s", distance_store.path)
+        if stats_file is not None:
+            write_stats(stats_file, query_labels,
+                        _find(accumulators, StatsAccumulator).result())
+        if contact_map is not None:
+            _find(accumulators, ContactMapAccumulator).partial()
+            log.info("contact map written to %s", contact_map)
+
+        result = _find(accumulators, HistogramAccumulator if stream else
+                       RawAccumulator)
+        results.append(dict(zip(query_labels, result.result())))
+
+    return results
+
+
+def process_trajectory(universe, group1, group2, unit1, unit2,
+                       neighbor_search=False, workers=1, stream=False,
+                       store=None, checkpoint=None,
+                       checkpoint_every=CHECKPOINT_EVERY, resume=False,
+                       first_frame=None, frames=None, contact_map=None,
+                       stats=None, cutoff=CONTACT_CUTOFF, dtype="float64",
+                       index_cache=None, cache_dir=None, profile=None):
     """process the trajectory and calculate the pair-wise min distances
 
     Args:
@@ -116,50 +975,114 @@ def process_trajectory(universe, group1, group2, unit1, unit2):
         group2: selection group2
         unit1: string, unit for group1 ("residues/atoms")
         unit2: string, unit for group2 ("residues/atoms")
+        neighbor_search: boolean, only evaluate atom pairs within RIGHT_LIM
+        workers: int, number of frame-parallel worker processes
+        stream: boolean, bin every frame into histograms instead of
+            keeping the full time series
+        store: string, DistanceStore directory the min distances are
+            written to frame by frame
+        checkpoint: string, directory to save the progress to. Raw rows go
+            to a store inside it unless `store` is given.
+        checkpoint_every: int, number of frames between two checkpoints
+        resume: boolean, continue from the last checkpoint
+        first_frame: int, append mode. The frames of the universe before
+            it are already in `store`; the remaining ones are appended and
+            their histograms merged with the stored counts.
+        frames: slice of the frame indices to analyze (start:stop:step),
+            None for the whole trajectory
+        contact_map: string, .npy file to write the per frame contacts to,
+            packed with np.packbits, see ContactMapAccumulator
+        stats: string, file to write the contact frequency and the mean,
+            min and std of the min distance of every pair to
+        cutoff: float, a pair is in contact below this min distance (A)
+        dtype: string, one of distance_store.DTYPES, how the raw min
+            distances are kept in memory and in `store`. float32 halves and
+            uint16 (quantized to 0.001 A) quarters their size.
+        index_cache: string, directory caching the PairIndex of selections,
+            see load_pair_index
+        cache_dir: string, reader cache directory worker processes reopen
+            the trajectory through, see trajectory_cache
+        profile: StageProfile to add the decode, distance, reduction and
+            accumulate times, the frames, bytes read and atom pairs
+            evaluated to, also those of worker processes
 
     Returns:
-        data: dict type, (name, numpy-array [float32])
+        data: dict type, (name, numpy-array [float] of min distances), or
+            (name, numpy-array [NUM_BINS] of bin counts) when streaming
 
     """
-    data = {}
-    group_one = getattr(universe.select_atoms(group1), _UNIT[unit1][_TYPE])
-    group_two = getattr(universe.select_atoms(group2), _UNIT[unit2][_TYPE])
+    return process_queries(
+        universe, [(group1, group2, unit1, unit2)],
+        neighbor_search=neighbor_search, workers=workers, stream=stream,
+        stores=[store], checkpoint=checkpoint,
+        checkpoint_every=checkpoint_every, resume=resume,
+        first_frame=first_frame, frames=frames, contact_maps=[contact_map],
+        stats=[stats], cutoff=cutoff, dtype=dtype, index_cache=index_cache,
+        cache_dir=cache_dir, profile=profile)[0]
+
 
-    raw_data = np.empty([universe.trajectory.n_frames,
-                         len(group_one) * len(group_two)], dtype=float)
+def _frame_selection(universe, args):
+    """build the frame slice requested on the command line.
+
+    Args:
+        universe: Universe Object
+        args: parsed command line args
 
-    log.info("%d residues [%d atoms] selected in group 1.", len(group_one),
-             len(group_one.atoms))
-    log.info("%d residues [%d atoms] selected in group 2.", len(group_two),
-             len(group_two.atoms))
+    Returns:
+        slice of frame indices, None for the whole trajectory
 
-    fetch_position_1 = _UNIT[unit1][_POSITION]
-    fetch_position_2 = _UNIT[unit2][_POSITION]
+    Raises:
+        ValueError: see time_window
+    """
+    if args.begin_ps is not None or args.end_ps is not None:
+        window = time_window(universe, args.begin_ps, args.end_ps)
+        return slice(window.start, window.stop, args.step)
+    if args.start is None and args.stop is None and args.step == 1:
+        return None
+    return slice(args.start, args.stop, args.step)
 
-    for time_step in universe.trajectory:
-        if time_step.frame % 100 == 0:
-            log.info("processing frame %d.", time_step.frame)
 
-        for (index, (res_one, res_two)) in enumerate(
-                itertools.product(group_one, group_two)):
-            min_dist = np.amin(
-                distance_array(fetch_position_1(res_one),
-                               fetch_position_2(res_two),
-                               backend="OpenMP"))
-            raw_data[time_step.frame][index] = \
-                min_dist if min_dist < _RIGHT_LIM else _RIGHT_LIM
+def run_jobs(universe, job_file, args, profile=None):
+    """analyze all queries of a job file in a single trajectory pass.
 
-    raw_data = np.transpose(raw_data)
+    Args:
+        universe: Universe Object
+        job_file: opened json file, see the module docstring
+        args: parsed command line args, for the options shared by all jobs
+        profile: StageProfile of the pass and the plotting, see
+            process_trajectory
+    """
+    if profile is None:
+        profile = StageProfile()
+    try:
+        jobs = json.load(job_file)["queries"]
+    finally:
+        job_file.close()
 
-    labeling_1 = _UNIT[unit1][_LABEL]
-    labeling_2 = _UNIT[unit2][_LABEL]
+    queries = [(job["group1"], job["group2"], job.get("unit1", "residue"),
+                job.get("unit2", "residue")) for job in jobs]
+    log.info("%d queries read from %s", len(queries), job_file.name)
 
-    for (index, (res_one, res_two)) in enumerate(itertools.product(group_one,
-                                                                   group_two)):
-        key = (labeling_1(res_one, 1), (labeling_2(res_two, 2)))
-        data[key] = raw_data[index]
+    results = process_queries(
+        universe, queries, neighbor_search=args.neighbor_search,
+        workers=args.workers, stream=args.stream,
+        stores=[job.get("dump") for job in jobs],
+        checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every,
+        resume=args.resume, frames=_frame_selection(universe, args),
+        contact_maps=[job.get("contact_map") for job in jobs],
+        stats=[job.get("stats") for job in jobs], cutoff=args.cutoff,
+        dtype=args.dtype, index_cache=args.index_cache,
+        cache_dir=args.cache_dir, profile=profile)
 
-    return data
+    log.info("start to plot histogram")
+    for (job, data) in zip(jobs, results):
+        start = profile.clock()
+        counts = data if args.stream else bin_data(data)
+        start = profile.time("binning", start)
+        plot_data(counts, job.get("png", job["name"] + ".png"), args.width,
+                  per_page=args.per_page, top_k=args.top_k,
+                  workers=args.workers, cutoff=args.cutoff)
+        profile.time("plotting", start)
 
 
 def main():
@@ -171,15 +1094,20 @@ def main():
 
     parser.add_argument('topology', metavar='TOPOLOGY', nargs='?',
                         help='input topology file (.gro)')
-    parser.add_argument('trajectory', metavar='TRAJECTORY', nargs='?',
-                        help='input trajectory file (.xtc/.trr)')
+    parser.add_argument('trajectory', metavar='TRAJECTORY', nargs='*',
+                        help='input trajectory files (.xtc/.trr), sections '
+                             'in frame order')
 
-    parser.add_argument('--png', required=True,
-                        help='output figure file (.png)')
-    parser.add_argument('--group1', required=True,
+    parser.add_argument('--png',
+                        help='output figure file (.png, or .pdf for a '
+                             'multi-page document)')
+    parser.add_argument('--group1',
                         help='selection string for group one')
-    parser.add_argument('--group2', required=True,
+    parser.add_argument('--group2',
                         help='selection string for group two')
+    parser.add_argument('--jobs', type=argparse.FileType('r'),
+                        help='json file listing many selection pairs to '
+                             'analyze in one pass over the trajectory')
     parser.add_argument('--unit1', default="residue",
                         choices=["residue", "atom"],
                         help='unit for group one [residue/atom]')
@@ -188,31 +1116,174 @@ def main():
                         help='unit for group two [residue/atom]')
     parser.add_argument('--width', default=3, type=int,
                         help='column width for the output plot')
-    parser.add_argument('--dump', help='binary data file to dump')
+    parser.add_argument('--per-page', type=int,
+                        help='max number of histograms per page, pages of '
+                             'a png go to NAME_001.png, NAME_002.png, ...')
+    parser.add_argument('--top-k', type=int,
+                        help='only plot the top k pairs by contact '
+                             'frequency')
+    parser.add_argument('--dump',
+                        help='directory of the on-disk distance store to '
+                             'write the min distances to')
+    parser.add_argument('--dtype', default="float64", choices=DTYPES,
+                        help='how min distances are kept in memory and in '
+                             'the --dump store, uint16 is quantized to '
+                             '0.001 A')
+    parser.add_argument('--append', default=False, action='store_true',
+                        help='only analyze frames not in the --dump store '
+                             'yet and merge them into it')
+    parser.add_argument('--index-cache',
+                        help='directory to cache the atom indices and labels '
+                             'of selections in, keyed by topology and '
+                             'selection')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory caching trajectory frame offsets '
+                             'and parsed topologies')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const',
+                        const=None, help='do not use the reader cache')
+    parser.add_argument('--neighbor-search', default=False,
+                        action='store_true',
+                        help='only evaluate atom pairs within the cutoff '
+                             'using a KD-tree neighbor search')
+    parser.add_argument('--checkpoint',
+                        help='directory to periodically save the progress to')
+    parser.add_argument('--checkpoint-every', default=CHECKPOINT_EVERY,
+                        type=int, help='number of frames between checkpoints')
+    parser.add_argument('--resume', default=False, action='store_true',
+                        help='continue from the last checkpoint')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='number of frame-parallel worker processes')
+    parser.add_argument('--stream', default=False, action='store_true',
+                        help='bin frames into histograms on the fly instead '
+                             'of keeping every distance in memory')
+    parser.add_argument('--stats',
+                        help='file to write the contact frequency and the '
+                             'mean/min/std distance of every pair to')
+    parser.add_argument('--contact-map',
+                        help='.npy file to write the per frame contacts to, '
+                             'packed with np.packbits')
+    parser.add_argument('--cutoff', default=CONTACT_CUTOFF, type=float,
+                        help='contact cutoff for --stats, --contact-map '
+                             'and --top-k (A), a histogram bin edge with '
+                             '--top-k')
+    parser.add_argument('--start', type=int,
+                        help='index of the first frame to analyze')
+    parser.add_argument('--stop', type=int,
+                        help='index of the frame to stop before')
+    parser.add_argument('--step', default=1, type=int,
+                        help='analyze every step-th frame')
+    parser.add_argument('--begin-ps', type=float,
+                        help='time of the first frame to analyze (ps)')
+    parser.add_argument('--end-ps', type=float,
+                        help='time of the last frame to analyze (ps)')
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help='write the cProfile stats of the main process '
+                             'next to the figure (NAME.prof)')
 
     args = parser.parse_args()
+    if args.jobs is None and not (args.png and args.group1 and args.group2):
+        parser.error("--png, --group1 and --group2 are required without "
+                     "--jobs")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    if args.append and (not args.dump or args.checkpoint or args.jobs or
+                        args.stats or args.contact_map):
+        parser.error("--append requires --dump and excludes --checkpoint, "
+                     "--jobs, --stats and --contact-map")
+    if args.step < 1:
+        parser.error("--step must be positive")
+    if args.top_k is not None:
+        try:
+            contact_bins(args.cutoff)
+        except ValueError as err:
+            parser.error("--top-k: %s" % err)
+    windowed = args.begin_ps is not None or args.end_ps is not None
+    if windowed and (args.start is not None or args.stop is not None):
+        parser.error("--begin-ps/--end-ps exclude --start/--stop")
+    if args.append and (windowed or args.start is not None or
+                        args.stop is not None or args.step != 1):
+        parser.error("--append analyzes whole trajectory sections and "
+                     "excludes frame selections")
 
     log.info("dist_histogram inits")
+    prefix = os.path.splitext(args.png or args.jobs.name)[0]
+    profile = StageProfile()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        _run(parser, args, profile)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(prefix + ".prof")
+            log.info("cProfile stats written to %s.prof", prefix)
+        profile.dump(prefix + "_profile.json")
+    log.info("dist_histogram terminates")
+
+
+def _run(parser, args, profile):
+    """analyze and plot as requested on the command line.
+
+    Args:
+        parser: ArgumentParser, reports invalid args
+        args: parsed command line args
+        profile: StageProfile of the whole run
+    """
+    trajectory = args.trajectory
+    first_frame = None
+    if args.append and not DistanceStore.exists(args.dump):
+        # the first section of a chain creates the store.
+        log.info("store %s does not exist yet, analyzing all frames",
+                 args.dump)
+    elif args.append:
+        store = DistanceStore(args.dump)
+        trajectory, first_frame = store.pending_sources(args.trajectory)
+        if not trajectory:
+            log.info("no new frames for store %s", args.dump)
+            start = profile.clock()
+            plot_data(dict(zip(store.labels, store.counts)), args.png,
+                      args.width, per_page=args.per_page, top_k=args.top_k,
+                      workers=args.workers, cutoff=args.cutoff)
+            profile.time("plotting", start)
+            return
+
     # I/O, read in the trajectory
     try:
-        universe = Universe(args.topology, args.trajectory)
+        universe = open_universe(args.topology, trajectory, args.cache_dir)
     except IOError:
         log.error("Cannot open input file. [topology: %s, trajectory: %s]",
-                  args.topology, args.trajectory)
+                  args.topology, trajectory)
         exit()
 
-    log.info("read trajectory %s", args.trajectory)
-    data = process_trajectory(universe, args.group1, args.group2,
-                              args.unit1, args.unit2)
+    log.info("read trajectory %s", trajectory)
+    stream = args.stream or args.append
+    try:
+        frames = _frame_selection(universe, args)
+    except ValueError as err:
+        parser.error(str(err))
 
-    if args.dump:
-        with open(args.dump, 'wb') as output:
-            pickle.dump(data, output, pickle.HIGHEST_PROTOCOL)
+    if args.jobs is not None:
+        run_jobs(universe, args.jobs, args, profile)
+        return
 
-    log.info("start to plot histogram")
+    data = process_trajectory(
+        universe, args.group1, args.group2, args.unit1, args.unit2,
+        neighbor_search=args.neighbor_search, workers=args.workers,
+        stream=stream, store=args.dump, checkpoint=args.checkpoint,
+        checkpoint_every=args.checkpoint_every, resume=args.resume,
+        first_frame=first_frame, frames=frames,
+        contact_map=args.contact_map, stats=args.stats, cutoff=args.cutoff,
+        dtype=args.dtype, index_cache=args.index_cache,
+        cache_dir=args.cache_dir, profile=profile)
 
-    plot_data(data, args.png, args.width)
-    log.info("dist_histogram terminates")
+    log.info("start to plot histogram")
+    start = profile.clock()
+    counts = data if stream else bin_data(data)
+    start = profile.time("binning", start)
+    plot_data(counts, args.png, args.width, per_page=args.per_page,
+              top_k=args.top_k, workers=args.workers, cutoff=args.cutoff)
+    profile.time("plotting", start)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Chunked on-disk store for pair-wise min distance time series.
+
+A store is a directory with these files:
+
+    index.json   the pair labels, the number of frames, the block size, the
+                 dtype, the trajectory files (sources) the frames were read
+                 from and, for a subsampled run, the analyzed frames
+                 (start/stop/step)
+    minima.dat   a raw [n_blocks, n_pairs, block_frames] array: the frames
+                 are cut into blocks of block_frames (BLOCK_FRAMES by
+                 default), each block stored pair by pair
+    counts_N.npy the [n_pairs, n_bins] histogram counts over the first N
+                 frames, referenced from the index
+
+Analysis reads whole series of a few pairs, which take one contiguous run
+of block_frames values per block instead of one value per frame scattered
+over the file. Appending frames only adds blocks, and fills up the last
+one, so stores grow section by section without being rewritten.
+
+dist_histogram writes the frames one by one through rows(), a frame-major
+view of the memory-mapped blocks, so the whole matrix never has to be held
+in memory. Downstream tools open the same file read-only, e.g.
+
+    store = DistanceStore("run.dist")
+    series = store.pair(("LYS_12_1", "ASP_40_2"))    # one pair, all frames
+    window = store.frames(1000, 2000)                 # all pairs, 1000 frames
+
+Distances are clamped to [0, 10] A, so besides float64 they can be stored
+as float32 or quantized to uint16 at UINT16_RESOLUTION (max error 0.0005 A),
+cutting the size by 2x or 4x.
+"""
+
+import json
+import os
+
+import numpy as np
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+INDEX_FILE = "index.json"
+MINIMA_FILE = "minima.dat"
+COUNTS_FILE = "counts_%d.npy"
+
+# Supported encodings of the min distances.
+DTYPES = ("float64", "float32", "uint16")
+
+# Resolution (A) of the quantized uint16 encoding.
+UINT16_RESOLUTION = 0.001
+
+# Default number of frames per block of minima.dat.
+BLOCK_FRAMES = 1024
+
+
+def encode_distances(min_dist, dtype):
+    """Convert min distances to the values stored for the given dtype.
+
+    Args:
+        min_dist: numpy-array of min distances (A)
+        dtype: string or numpy dtype, one of DTYPES
+
+    Returns:
+        numpy-array, min_dist itself for float dtypes, which numpy casts on
+        assignment, or the rounded uint16 steps
+    """
+    if np.dtype(dtype) == np.uint16:
+        return np.rint(np.asarray(min_dist) /
+                       UINT16_RESOLUTION).astype(np.uint16)
+    return min_dist
+
+
+def _num_blocks(num_frames, block_frames):
+    """Returns: int, number of blocks holding num_frames frames"""
+    return -(-int(num_frames) // int(block_frames))
+
+
+def decode_distances(values, dtype=None):
+    """Convert stored values back to min distances.
+
+    Args:
+        values: numpy-array of stored values
+        dtype: string or numpy dtype of the values, values.dtype if None
+
+    Returns:
+        numpy-array of min distances (A), values itself for float dtypes or
+        a float32 copy for uint16
+    """
+    if np.dtype(dtype or values.dtype) == np.uint16:
+        return values.astype(np.float32) * np.float32(UINT16_RESOLUTION)
+    return values
+
+
+class BlockRows(object):
+    """Frame-major [n_rows, n_pairs] view of some frames of a store.
+
+    Writers add one frame at a time, the view scatters it into the pair
+    rows of its block.
+    """
+
+    def __init__(self, blocks, first_row, num_rows):
+        """Create the view.
+
+        Args:
+            blocks: np.memmap [n_blocks, n_pairs, block_frames], minima.dat
+            first_row: int, the store frame behind row 0 of the view
+            num_rows: int, number of frames in the view
+        """
+        self._blocks = blocks
+        self._first_row = first_row
+        self._num_rows = num_rows
+
+    @property
+    def shape(self):
+        """Returns: tuple, (n_rows, n_pairs)"""
+        return (self._num_rows, self._blocks.shape[1])
+
+    @property
+    def dtype(self):
+        """Returns: numpy dtype, the stored encoding"""
+        return self._blocks.dtype
+
+    def __len__(self):
+        """Returns: int, number of frames in the view"""
+        return self._num_rows
+
+    def __setitem__(self, row, values):
+        """Store the encoded values of all pairs in one frame."""
+        if not 0 <= row < self._num_rows:
+            raise IndexError("row %d out of %d" % (row, self._num_rows))
+        (block, offset) = divmod(self._first_row + row,
+                                 self._blocks.shape[2])
+        self._blocks[block, :, offset] = values
+
+    def __getitem__(self, row):
+        """Returns: numpy-array [n_pairs], the stored values of a frame"""
+        if not 0 <= row < self._num_rows:
+            raise IndexError("row %d out of %d" % (row, self._num_rows))
+        (block, offset) = divmod(self._first_row + row,
+                                 self._blocks.shape[2])
+        return self._blocks[block, :, offset]
+
+    def pairs(self):
+        """Returns: numpy-array [n_pairs, n_rows], the stored values of
+        every pair, read block by block"""
+        return _pair_major(self._blocks, self._first_row,
+                           self._first_row + self._num_rows)
+
+    def flush(self):
+        """Write pending frames to disk."""
+        if self._blocks.mode != 'r':
+            self._blocks.flush()
+
+
+def _pair_major(blocks, start, stop):
+    """Copy frames [start, stop) of all pairs out of the blocks.
+
+    Args:
+        blocks: numpy-array [n_blocks, n_pairs, block_frames]
+        start: int, first frame
+        stop: int, end of the frames
+
+    Returns:
+        numpy-array [n_pairs, stop - start]
+    """
+    block_frames = blocks.shape[2]
+    (first, last) = (start // block_frames, -(-stop // block_frames))
+    series = np.transpose(blocks[first:last], (1, 0, 2)).reshape(
+        blocks.shape[1], -1)
+    offset = first * block_frames
+    return series[:, start - offset:stop - offset]
+
+
+class DistanceStore(object):
+    """Memory-mapped min distance series of pairs, with labels, in blocks
+    of frames.
+    """
+
+    def __init__(self, path, mode='r', num_frames=None):
+        """Open an existing store.
+
+        Args:
+            path: string, the store directory
+            mode: string, 'r' for read-only or 'r+' for writing in place
+            num_frames: int, frames to map instead of the indexed number of
+                frames, used by writers while an append is in progress
+        """
+        self._path = path
+        with open(os.path.join(path, INDEX_FILE), 'r') as index_file:
+            self._index = json.load(index_file)
+
+        self._labels = [tuple(label) for label in self._index["labels"]]
+        self._columns = {label: i for (i, label) in enumerate(self._labels)}
+        self._mode = mode
+        self._num_frames = self._index["numFrames"] if num_frames is None \
+            else num_frames
+        self._blocks = self.__map_blocks(self._num_frames)
+
+    def __map_blocks(self, num_frames):
+        """Memory-map the blocks holding the first num_frames frames."""
+        block_frames = self._index["blockFrames"]
+        return np.memmap(os.path.join(self._path, MINIMA_FILE),
+                         dtype=self._index["dtype"], mode=self._mode,
+                         shape=(_num_blocks(num_frames, block_frames),
+                                len(self._labels), block_frames))
+
+    @staticmethod
+    def exists(path):
+        """Returns: Boolean, a store has been created in path"""
+        return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+    @staticmethod
+    def create(path, labels, num_frames, dtype="float64", frames=None,
+               block_frames=BLOCK_FRAMES):
+        """Create an empty store sized for num_frames frames.
+
+        Args:
+            path: string, the store directory, created if missing
+            labels: list of tuple, (label1, label2) of every pair
+            num_frames: int, number of frames to be written
+            dtype: string, encoding of the stored distances, one of DTYPES
+            frames: range, the trajectory frames behind the rows if the
+                run was subsampled, None if row i is frame i
+            block_frames: int, number of frames per block
+
+        Returns:
+            DistanceStore opened in 'r+' mode
+        """
+        if dtype not in DTYPES:
+            raise ValueError("unsupported store dtype %s" % dtype)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        index = {"labels": [list(label) for label in labels],
+                 "numFrames": int(num_frames),
+                 "blockFrames": int(block_frames),
+                 "dtype": dtype,
+                 "sources": []}
+        if frames is not None:
+            index["frames"] = {"start": frames.start, "stop": frames.stop,
+                               "step": frames.step}
+        with open(os.path.join(path, INDEX_FILE), 'w') as index_file:
+            json.dump(index, index_file, indent=4)
+
+        blocks = np.memmap(os.path.join(path, MINIMA_FILE), dtype=dtype,
+                           mode='w+',
+                           shape=(_num_blocks(num_frames, block_frames),
+                                  len(labels), int(block_frames)))
+        del blocks
+
+        return DistanceStore(path, 'r+')
+
+    @property
+    def path(self):
+        """Returns: string, the store directory"""
+        return self._path
+
+    @property
+    def labels(self):
+        """Returns: list of tuple, (label1, label2) of every pair"""
+        return self._labels
+
+    @property
+    def num_frames(self):
+        """Returns: int, number of frames in the store"""
+        return self._num_frames
+
+    @property
+    def block_frames(self):
+        """Returns: int, number of frames per block"""
+        return self._index["blockFrames"]
+
+    @property
+    def frame_indices(self):
+        """Returns: range, the trajectory frame behind every row"""
+        frames = self._index.get("frames")
+        if frames is None:
+            return range(self.num_frames)
+        return range(frames["start"], frames["stop"], frames["step"])
+
+    @property
+    def sources(self):
+        """Returns: list of dict, path/size/numFrames of every trajectory"""
+        return self._index.get("sources", [])
+
+    @property
+    def counts(self):
+        """Returns: numpy-array [n_pairs, n_bins] or None if never saved"""
+        if "countsFile" not in self._index:
+            return None
+        return np.load(os.path.join(self._path, self._index["countsFile"]))
+
+    @property
+    def dtype(self):
+        """Returns: string, encoding of the stored distances"""
+        return self._index["dtype"]
+
+    @property
+    def blocks(self):
+        """Returns: np.memmap [n_blocks, n_pairs, block_frames], the whole
+        file as stored, see decode_distances(). Frames past num_frames in
+        the last block are unused."""
+        return self._blocks
+
+    def rows(self, first_row=0):
+        """Frame-major view of the frames from first_row on, for writing.
+
+        Returns:
+            BlockRows [num_frames - first_row, n_pairs] of stored values
+        """
+        return BlockRows(self._blocks, first_row,
+                         self._num_frames - first_row)
+
+    def pair(self, label):
+        """Time series of a single pair, read as one contiguous run per
+        block.
+
+        Args:
+            label: tuple, (label1, label2)
+
+        Returns:
+            numpy-array [n_frames] of min distances (A)
+        """
+        series = self._blocks[:, self._columns[label], :].reshape(-1)
+        return decode_distances(series[:self._num_frames])
+
+    def frames(self, start, stop):
+        """Window of all pairs over frames [start, stop).
+
+        Returns:
+            numpy-array [stop - start, n_pairs] of min distances (A)
+        """
+        (start, stop, _) = slice(start, stop).indices(self._num_frames)
+        return decode_distances(np.transpose(
+            _pair_major(self._blocks, start, max(start, stop))))
+
+    def flush(self):
+        """Write pending frames to disk."""
+        if self._blocks.mode != 'r':
+            self._blocks.flush()
+
+    def pending_sources(self, paths):
+        """Find the trajectory files with frames not in the store yet.
+
+        A file is new if the store has never seen it. A known file whose
+        size changed has grown since it was stored; this is only allowed
+        for the last stored file, as trajectory sections are appended in
+        order.
+
+        Args:
+            paths: list of string, trajectory files in frame order
+
+        Returns:
+            (list of string, int), the files to read and the first new
+            frame inside the first of them
+        """
+        if "frames" in self._index:
+            raise ValueError("cannot append to the subsampled store %s" %
+                             self._path)
+
+        known = {src["path"]: src for src in self.sources}
+        last = self.sources[-1]["path"] if self.sources else None
+
+        pending = []
+        first_frame = 0
+        for path in [os.path.abspath(path) for path in paths]:
+            source = known.get(path)
+            if source is None:
+                pending.append(path)
+            elif os.path.getsize(path) != source["size"]:
+                if path != last or pending:
+                    raise ValueError("only the last stored trajectory may "
+                                     "grow: %s" % path)
+                pending.append(path)
+                first_frame = source["numFrames"]
+
+        return (pending, first_frame)
+
+    def extend(self, num_frames):
+        """Grow minima.dat by num_frames frames for appending.
+
+        The last block is filled up first, then whole blocks are added;
+        the stored frames stay where they are. The index is left untouched
+        until commit(), so an interrupted append is simply redone.
+
+        Returns:
+            int, the row of the first appended frame
+        """
+        first_row = self._index["numFrames"]
+        total = first_row + int(num_frames)
+        block_bytes = len(self._labels) * self.block_frames * \
+            np.dtype(self._index["dtype"]).itemsize
+
+        self.flush()
+        with open(os.path.join(self._path, MINIMA_FILE), 'r+b') as minima:
+            minima.truncate(_num_blocks(total, self.block_frames) *
+                            block_bytes)
+        self._num_frames = total
+        self._blocks = self.__map_blocks(total)
+        return first_row
+
+    def commit(self, sources, counts=None):
+        """Record newly stored trajectory files and histogram counts.
+
+        Args:
+            sources: list of (path, n_frames), trajectory files whose frames
+                are now in the store. A file already known is updated.
+            counts: numpy-array [n_pairs, n_bins], counts over all frames
+        """
+        self.flush()
+        old_counts = self._index.get("countsFile")
+        if counts is not None:
+            # a new file per frame count, so the index never refers to
+            # counts that do not match its frames.
+            self._index["countsFile"] = COUNTS_FILE % self._num_frames
+            np.save(os.path.join(self._path, self._index["countsFile"]),
+                    counts)
+
+        stored = self._index.setdefault("sources", [])
+        known = {src["path"]: src for src in stored}
+        for (path, num_frames) in sources:
+            path = os.path.abspath(path)
+            if path not in known:
+                known[path] = {"path": path}
+                stored.append(known[path])
+            known[path]["size"] = os.path.getsize(path)
+            known[path]["numFrames"] = int(num_frames)
+
+        self._index["numFrames"] = self._num_frames
+        index_file = os.path.join(self._path, INDEX_FILE)
+        with open(index_file + ".tmp", 'w') as output:
+            json.dump(self._index, output, indent=4)
+        os.rename(index_file + ".tmp", index_file)
+
+        if old_counts and old_counts != self._index.get("countsFile"):
+            os.remove(os.path.join(self._path, old_counts))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Atom indices, unit boundaries and labels of a selection pair.
+
+A PairIndex is everything the min distance analysis needs from two
+selections of units (residues or atoms): the atom indices of every unit,
+flattened group by group, and the label of every unit. load_pair_index()
+keeps them in an on-disk cache, keyed by the topology and the selections,
+so large selections are not parsed again on every run:
+
+    index = load_pair_index(universe, ("resid 1-10", "resid 11-20",
+                                       "residue", "residue"), "index.cache")
+    ((indices_1, offsets_1), (indices_2, offsets_2)) = index.layouts
+"""
+
+import hashlib
+import itertools
+import os
+
+import glog as log
+import numpy as np
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# Bumped whenever the PairIndex format or labels change, so stale cache
+# entries are not reused.
+_INDEX_VERSION = 1
+
+# index used for refering elements in _UNIT
+_TYPE = 0
+_INDICES = 1
+_LABEL = 2
+
+# define AtomGroup-type specific properties.
+_UNIT = {"residue": ("residues",
+                     lambda grp: grp.atoms.indices,
+                     lambda grp, i: "%s_%d_%d" % (grp.resname,
+                                                  grp.resid, i)),
+         "atom": ("atoms",
+                  lambda atom: np.array([atom.index]),
+                  lambda atom, i: "%s_%d_%s_%d" % (
+                      atom.resname, atom.resid, atom.name, i))}
+
+
+def _unit_layout(units, unit):
+    """flatten the atoms of a group of units into one index array.
+
+    Args:
+        units: ResidueGroup or AtomGroup of the selected units
+        unit: string, unit of the group ("residue/atom")
+
+    Returns:
+        indices: numpy-array [int], atom indices of all units, unit by unit
+        offsets: numpy-array [int], start of every unit inside indices
+    """
+    fetch_indices = _UNIT[unit][_INDICES]
+    unit_indices = [fetch_indices(grp) for grp in units]
+
+    offsets = np.cumsum([0] + [len(idx) for idx in unit_indices[:-1]])
+    return np.concatenate(unit_indices), offsets
+
+
+def _select_units(universe, group, unit):
+    """select a group of units (residues or atoms) from the universe."""
+    return getattr(universe.select_atoms(group), _UNIT[unit][_TYPE])
+
+
+def file_digest(file_name):
+    """Returns: string, sha1 hex digest of a file's content"""
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PairIndex(object):
+    """Flattened atom indices, unit boundaries and labels of one query.
+
+    Everything the analysis needs from a selection, so it is built once and
+    can be cached on disk instead of parsing the selection again.
+    """
+
+    def __init__(self, layout_1, layout_2, labels_1, labels_2):
+        """Create the index of group1 x group2.
+
+        Args:
+            layout_1: tuple, (indices, offsets) of group1, see _unit_layout
+            layout_2: tuple, (indices, offsets) of group2, see _unit_layout
+            labels_1: list of string, label of every unit of group1
+            labels_2: list of string, label of every unit of group2
+        """
+        self._layouts = (layout_1, layout_2)
+        self._labels = (list(labels_1), list(labels_2))
+
+    @staticmethod
+    def build(universe, query):
+        """Resolve a query against a universe.
+
+        Args:
+            universe: Universe Object
+            query: tuple, (group1, group2, unit1, unit2)
+
+        Returns:
+            PairIndex
+        """
+        (group1, group2, unit1, unit2) = query
+        units_1 = _select_units(universe, group1, unit1)
+        units_2 = _select_units(universe, group2, unit2)
+        labeling_1 = _UNIT[unit1][_LABEL]
+        labeling_2 = _UNIT[unit2][_LABEL]
+        return PairIndex(_unit_layout(units_1, unit1),
+                         _unit_layout(units_2, unit2),
+                         [labeling_1(grp, 1) for grp in units_1],
+                         [labeling_2(grp, 2) for grp in units_2])
+
+    @staticmethod
+    def load(file_name):
+        """Load an index saved by save()."""
+        arrays = np.load(file_name)
+        return PairIndex((arrays["indices_1"], arrays["offsets_1"]),
+                         (arrays["indices_2"], arrays["offsets_2"]),
+                         arrays["labels_1"].tolist(),
+                         arrays["labels_2"].tolist())
+
+    def save(self, file_name):
+        """Atomically write the index to a .npz file."""
+        ((indices_1, offsets_1), (indices_2, offsets_2)) = self._layouts
+        with open(file_name + ".tmp", 'wb') as output:
+            np.savez(output, indices_1=indices_1, offsets_1=offsets_1,
+                     indices_2=indices_2, offsets_2=offsets_2,
+                     labels_1=np.array(self._labels[0], dtype=str),
+                     labels_2=np.array(self._labels[1], dtype=str))
+        os.rename(file_name + ".tmp", file_name)
+
+    @property
+    def layouts(self):
+        """Returns: tuple, (layout_1, layout_2), see _unit_layout"""
+        return self._layouts
+
+    @property
+    def num_units(self):
+        """Returns: tuple, number of units in group1 and group2"""
+        return (len(self._labels[0]), len(self._labels[1]))
+
+    @property
+    def num_atoms(self):
+        """Returns: tuple, number of atoms in group1 and group2"""
+        return (len(self._layouts[0][0]), len(self._layouts[1][0]))
+
+    @property
+    def num_pairs(self):
+        """Returns: int, number of unit pairs"""
+        return len(self._labels[0]) * len(self._labels[1])
+
+    def pair_labels(self):
+        """label every unit pair in the order of itertools.product.
+
+        Returns:
+            list of tuple, (label1, label2)
+        """
+        return list(itertools.product(*self._labels))
+
+
+def load_pair_index(universe, query, cache_dir=None, topology_hash=None):
+    """get the PairIndex of a query, from the on-disk cache if possible.
+
+    Cached indices are keyed by the content of the topology file and the
+    query, so any change of either builds a new index.
+
+    Args:
+        universe: Universe Object
+        query: tuple, (group1, group2, unit1, unit2)
+        cache_dir: string, cache directory, None disables the cache
+        topology_hash: string, digest of the topology file, computed if
+            not given
+
+    Returns:
+        PairIndex
+    """
+    if cache_dir is None:
+        return PairIndex.build(universe, query)
+
+    topology_hash = topology_hash or file_digest(universe.filename)
+    key = "%d\n%s\n%s" % (_INDEX_VERSION, topology_hash, "\n".join(query))
+    cache_file = os.path.join(
+        cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npz")
+    if os.path.exists(cache_file):
+        log.info("pair index of %s vs. %s loaded from %s", query[0],
+                 query[1], cache_file)
+        return PairIndex.load(cache_file)
+
+    index = PairIndex.build(universe, query)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    index.save(cache_file)
+    return index
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Stage timers, counters and progress reports of the analysis loops.
+
+A StageProfile adds up the wall time spent in named stages and named
+counters, e.g.
+
+    profile = StageProfile()
+    start = profile.clock()
+    dist = distance_array(positions_1, positions_2)
+    start = profile.time("distance", start)
+    profile.count("atom_pairs", dist.size)
+
+Profiles of worker processes are sent back with partial() and added up with
+merge(), like the per frame accumulators of accumulators.py. result() is
+the machine readable summary that dump() writes as json.
+
+Progress logs the number of processed frames with the throughput, the ETA
+and the share of every stage at most every few seconds.
+"""
+
+import json
+import time
+
+import glog as log
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# Default number of seconds between two progress reports.
+PROGRESS_SECONDS = 30.0
+
+
+def _format_seconds(seconds):
+    """Returns: string, seconds as H:MM:SS"""
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                             seconds % 60)
+
+
+class StageProfile(object):
+    """Accumulated wall time per stage and counts per counter."""
+
+    def __init__(self):
+        """Create an empty profile."""
+        self._started = time.time()
+        self._seconds = {}
+        self._counts = {}
+
+    @staticmethod
+    def clock():
+        """Returns: float, the current time to pass to time()"""
+        return time.perf_counter()
+
+    def time(self, stage, start):
+        """Add the time elapsed since start to a stage.
+
+        Args:
+            stage: string, the stage name
+            start: float, an earlier clock()
+
+        Returns:
+            float, the current clock(), the start of the next stage
+        """
+        now = time.perf_counter()
+        self._seconds[stage] = self._seconds.get(stage, 0.0) + now - start
+        return now
+
+    def count(self, counter, amount=1):
+        """Add amount to a counter."""
+        self._counts[counter] = self._counts.get(counter, 0) + int(amount)
+
+    def stage_seconds(self):
+        """Returns: dict, stage -> seconds"""
+        return dict(self._seconds)
+
+    def partial(self):
+        """Returns: tuple, the stage times and counts to merge()"""
+        return (dict(self._seconds), dict(self._counts))
+
+    def merge(self, partial):
+        """Add the partial() of another profile to this one."""
+        (seconds, counts) = partial
+        for (stage, value) in seconds.items():
+            self._seconds[stage] = self._seconds.get(stage, 0.0) + value
+        for (counter, value) in counts.items():
+            self._counts[counter] = self._counts.get(counter, 0) + value
+
+    def result(self):
+        """Summarize the profile.
+
+        Stage times of worker processes add up, so with several workers the
+        stages can sum up to more than the wall time.
+
+        Returns:
+            dict, the wall time, every stage's seconds and share of the
+            staged time, every counter with its rate per wall second
+        """
+        wall = time.time() - self._started
+        staged = sum(self._seconds.values()) or 1.0
+        return {
+            "wallSeconds": wall,
+            "stages": {stage: {"seconds": seconds,
+                               "fraction": seconds / staged}
+                       for (stage, seconds) in self._seconds.items()},
+            "counters": {counter: {"count": count,
+                                   "perSecond": count / max(wall, 1e-9)}
+                         for (counter, count) in self._counts.items()}}
+
+    def dump(self, file_name):
+        """Write result() as json."""
+        with open(file_name, 'w') as output:
+            json.dump(self.result(), output, indent=4, sort_keys=True)
+        log.info("stage profile written to %s", file_name)
+
+
+class Progress(object):
+    """Logs progress, throughput and ETA at most every few seconds."""
+
+    def __init__(self, total, done=0, every=PROGRESS_SECONDS):
+        """Start measuring.
+
+        Args:
+            total: int, number of frames of the run
+            done: int, frames already done when measuring starts, e.g. by
+                an earlier run that is resumed
+            every: float, minimal number of seconds between two reports
+        """
+        self._total = total
+        self._first = done
+        self._every = every
+        self._started = time.time()
+        self._reported = self._started
+
+    def update(self, done, profile=None):
+        """Report if the last report is long enough ago.
+
+        Args:
+            done: int, frames done so far
+            profile: StageProfile, its stage shares are reported too
+        """
+        now = time.time()
+        if now - self._reported < self._every:
+            return
+        self._reported = now
+
+        rate = (done - self._first) / max(now - self._started, 1e-9)
+        eta = (self._total - done) / rate if rate > 0 else float("nan")
+        stages = ""
+        if profile is not None:
+            seconds = profile.stage_seconds()
+            staged = sum(seconds.values()) or 1.0
+            stages = ", " + " ".join(
+                "%s %.0f%%" % (stage, 100.0 * value / staged)
+                for (stage, value) in sorted(seconds.items()))
+        log.info("processed %d of %d frames, %.1f frames/s, ETA %s%s.",
+                 done, self._total, rate,
+                 _format_seconds(eta) if rate > 0 else "unknown", stages)
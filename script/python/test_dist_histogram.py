@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Equivalence tests of the dist_histogram analysis paths.
+
+Every way of running the analysis (serial or frame-parallel, dense or
+neighbor search, streamed, subsampled, resumed from a checkpoint or
+appended section by section) must give the min distances of the original
+per-pair loop on a small synthetic system.
+
+Run with: python -m pytest test_dist_histogram.py
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import numpy as np
+from MDAnalysis import Universe
+from MDAnalysis.lib.distances import distance_array
+
+import dist_histogram
+
+from accumulators import RIGHT_LIM, bin_data
+from benchmark import make_system
+from distance_store import DistanceStore
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# A small system, split into trajectory sections like a chained run.
+_SYSTEM = {"residues": 27, "atoms_per_residue": 4, "frames": 40,
+           "sections": 4, "seed": 0}
+
+_GROUP1 = "resid 1-5"
+_GROUP2 = "resid 6-20"
+
+
+def _per_pair_loop(universe, group1, group2):
+    """The original analysis: one distance_array per residue pair.
+
+    Returns:
+        dict type, (name, numpy-array [n_frames] of min distances)
+    """
+    residues_1 = universe.select_atoms(group1).residues
+    residues_2 = universe.select_atoms(group2).residues
+    pairs = list(itertools.product(residues_1, residues_2))
+    raw_data = np.empty((universe.trajectory.n_frames, len(pairs)))
+    for time_step in universe.trajectory:
+        for (index, (res_one, res_two)) in enumerate(pairs):
+            min_dist = np.amin(distance_array(res_one.atoms.positions,
+                                              res_two.atoms.positions))
+            raw_data[time_step.frame][index] = min(min_dist, RIGHT_LIM)
+
+    labels = [("%s_%d_1" % (res_one.resname, res_one.resid),
+               "%s_%d_2" % (res_two.resname, res_two.resid))
+              for (res_one, res_two) in pairs]
+    return dict(zip(labels, raw_data.T))
+
+
+class DistHistogramTest(unittest.TestCase):
+    """All analysis paths agree with the per-pair loop."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix="dist_histogram_")
+        cls.paths = make_system(cls.directory, _SYSTEM)
+        cls.expected = _per_pair_loop(cls.universe(), _GROUP1, _GROUP2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    @classmethod
+    def universe(cls, trajectory=None):
+        """Returns: a new Universe of the system or of some sections"""
+        return Universe(cls.paths["topology"],
+                        trajectory or cls.paths["trajectory"])
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp(dir=self.directory)
+
+    def run_analysis(self, trajectory=None, **options):
+        """Run process_trajectory on the pairs of _GROUP1 x _GROUP2."""
+        return dist_histogram.process_trajectory(
+            self.universe(trajectory), _GROUP1, _GROUP2, "residue",
+            "residue", **options)
+
+    def assert_same_data(self, data, expected):
+        """Both dicts hold the same series or histograms."""
+        self.assertEqual(sorted(data), sorted(expected))
+        for (name, series) in expected.items():
+            np.testing.assert_array_equal(data[name], series)
+
+    def test_serial(self):
+        self.assert_same_data(self.run_analysis(), self.expected)
+
+    def test_parallel(self):
+        self.assert_same_data(self.run_analysis(workers=3), self.expected)
+
+    def test_neighbor_search(self):
+        data = self.run_analysis(neighbor_search=True, workers=2)
+        for (name, series) in self.expected.items():
+            np.testing.assert_allclose(data[name], series, atol=1e-5)
+
+    def test_stream(self):
+        counts = bin_data(self.expected)
+        self.assert_same_data(self.run_analysis(stream=True), counts)
+        self.assert_same_data(self.run_analysis(stream=True, workers=2),
+                              counts)
+
+    def test_subsampled(self):
+        store = os.path.join(self.output, "run.dist")
+        data = self.run_analysis(frames=slice(3, 35, 4), store=store)
+        self.assert_same_data(data, {name: series[3:35:4] for
+                                     (name, series) in self.expected.items()})
+        self.assertEqual(DistanceStore(store).frame_indices, range(3, 35, 4))
+
+    def test_resume(self):
+        checkpoint = os.path.join(self.output, "run.ckpt")
+        accumulate_frame = dist_histogram._accumulate_frame
+
+        def interrupted(time_step, row, *args):
+            if row == 23:
+                raise KeyboardInterrupt()
+            accumulate_frame(time_step, row, *args)
+
+        for stream in (False, True):
+            with mock.patch.object(dist_histogram, "_accumulate_frame",
+                                   interrupted):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.run_analysis(stream=stream, checkpoint=checkpoint,
+                                      checkpoint_every=5)
+            data = self.run_analysis(stream=stream, checkpoint=checkpoint,
+                                     checkpoint_every=5, resume=True)
+            self.assert_same_data(data, self.expected if not stream else
+                                  bin_data(self.expected))
+            shutil.rmtree(checkpoint)
+
+    def test_append(self):
+        full = os.path.join(self.output, "full.dist")
+        self.run_analysis(stream=True, store=full)
+
+        appended = os.path.join(self.output, "appended.dist")
+        sections = self.paths["trajectory"]
+        self.run_analysis(sections[:1], stream=True, store=appended)
+        for section in range(2, len(sections) + 1):
+            (trajectory, first_frame) = DistanceStore(
+                appended).pending_sources(sections[:section])
+            self.run_analysis(trajectory, stream=True, store=appended,
+                              first_frame=first_frame, workers=2)
+
+        (full, appended) = (DistanceStore(full), DistanceStore(appended))
+        self.assertEqual(appended.num_frames, _SYSTEM["frames"])
+        np.testing.assert_array_equal(appended.counts, full.counts)
+        for label in full.labels:
+            np.testing.assert_array_equal(appended.pair(label),
+                                          full.pair(label))
+            np.testing.assert_array_equal(appended.pair(label),
+                                          self.expected[label])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Round-trip tests of the distance store encodings.
+
+Run with: python -m pytest test_distance_store.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from distance_store import (DTYPES, UINT16_RESOLUTION, DistanceStore,
+                            MINIMA_FILE, decode_distances, encode_distances)
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# Distances are clamped to [0, MAX_DISTANCE] A before they are stored.
+MAX_DISTANCE = 10.0
+
+
+def _clamped_distances(shape, seed=0):
+    """Random min distances in [0, MAX_DISTANCE] A, including both ends."""
+    distances = np.random.RandomState(seed).uniform(0.0, MAX_DISTANCE,
+                                                    shape)
+    distances.flat[0] = 0.0
+    distances.flat[-1] = MAX_DISTANCE
+    return distances
+
+
+def _round_trip(distances, dtype):
+    """Store distances as dtype and read them back as min distances."""
+    stored = np.empty(distances.shape, dtype=dtype)
+    stored[:] = encode_distances(distances, dtype)
+    return decode_distances(stored)
+
+
+class EncodingTest(unittest.TestCase):
+    """Precision lost by every encoding of DTYPES."""
+
+    def setUp(self):
+        self.distances = _clamped_distances((500, 40))
+
+    def test_float64_is_exact(self):
+        np.testing.assert_array_equal(
+            _round_trip(self.distances, "float64"), self.distances)
+
+    def test_float32_error(self):
+        error = np.abs(_round_trip(self.distances, "float32") -
+                       self.distances).max()
+        # float32 has a 24 bit mantissa, i.e. ~6e-7 A at 10 A.
+        self.assertLessEqual(error, MAX_DISTANCE * 2.0 ** -24)
+
+    def test_uint16_error(self):
+        decoded = _round_trip(self.distances, "uint16")
+        self.assertEqual(decoded.dtype, np.float32)
+        error = np.abs(decoded.astype(np.float64) - self.distances).max()
+        # half a quantization step, plus the float32 rounding of the
+        # decoded value.
+        self.assertLessEqual(error, 0.0005 + MAX_DISTANCE * 2.0 ** -24)
+        self.assertGreater(error, 0.0)
+
+    def test_uint16_keeps_the_range(self):
+        encoded = encode_distances(np.array([0.0, MAX_DISTANCE]), "uint16")
+        np.testing.assert_array_equal(
+            encoded, [0, round(MAX_DISTANCE / UINT16_RESOLUTION)])
+
+
+class StoreTest(unittest.TestCase):
+    """Round trips through DistanceStore files."""
+
+    NUM_FRAMES = 200
+    NUM_PAIRS = 30
+    # the last of the 4 blocks is partly used.
+    BLOCK_FRAMES = 64
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="distance_store_")
+        self.labels = [("RES_%d_1" % i, "RES_%d_2" % i)
+                       for i in range(StoreTest.NUM_PAIRS)]
+        self.distances = _clamped_distances(
+            (StoreTest.NUM_FRAMES, StoreTest.NUM_PAIRS))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, dtype, num_frames=NUM_FRAMES):
+        """Write the first frames to a new store, return its directory."""
+        path = os.path.join(self.directory, dtype)
+        store = DistanceStore.create(path, self.labels, num_frames, dtype,
+                                     block_frames=StoreTest.BLOCK_FRAMES)
+        self._fill(store, 0)
+        store.commit([])
+        return path
+
+    def _fill(self, store, first_row):
+        """Write the distances of the frames from first_row on."""
+        rows = store.rows(first_row)
+        for row in range(len(rows)):
+            rows[row] = encode_distances(self.distances[first_row + row],
+                                         store.dtype)
+        rows.flush()
+
+    def test_size_ratios(self):
+        sizes = {dtype: os.path.getsize(os.path.join(self._write(dtype),
+                                                     MINIMA_FILE))
+                 for dtype in DTYPES}
+        # whole blocks are allocated.
+        self.assertEqual(sizes["float64"], 4 * StoreTest.BLOCK_FRAMES *
+                         StoreTest.NUM_PAIRS * 8)
+        self.assertEqual(sizes["float64"], 2 * sizes["float32"])
+        self.assertEqual(sizes["float64"], 4 * sizes["uint16"])
+
+    def test_reopened_store(self):
+        store = DistanceStore(self._write("uint16"))
+        self.assertEqual(store.dtype, "uint16")
+        self.assertEqual(store.num_frames, StoreTest.NUM_FRAMES)
+        series = store.pair(self.labels[3])
+        self.assertLessEqual(
+            np.abs(series - self.distances[:, 3]).max(),
+            0.0005 + MAX_DISTANCE * 2.0 ** -24)
+        np.testing.assert_array_equal(store.frames(10, 20),
+                                      store.frames(0, 200)[10:20])
+
+    def test_pairs_and_windows_across_blocks(self):
+        store = DistanceStore(self._write("float64"))
+        for column in (0, 17, StoreTest.NUM_PAIRS - 1):
+            np.testing.assert_array_equal(store.pair(self.labels[column]),
+                                          self.distances[:, column])
+        np.testing.assert_array_equal(store.frames(60, 130),
+                                      self.distances[60:130])
+        np.testing.assert_array_equal(store.frames(0, 200), self.distances)
+        np.testing.assert_array_equal(store.rows(100).pairs(),
+                                      self.distances[100:].T)
+
+    def test_append_fills_the_last_block(self):
+        path = self._write("float32", num_frames=100)
+        size = os.path.getsize(os.path.join(path, MINIMA_FILE))
+        store = DistanceStore(path, 'r+')
+        self.assertEqual(store.extend(StoreTest.NUM_FRAMES - 100), 100)
+        self._fill(store, 100)
+        store.commit([])
+
+        store = DistanceStore(path)
+        self.assertEqual(store.num_frames, StoreTest.NUM_FRAMES)
+        # the 2 stored blocks are extended by 2, not rewritten.
+        self.assertEqual(os.path.getsize(os.path.join(path, MINIMA_FILE)),
+                         2 * size)
+        np.testing.assert_array_equal(
+            store.pair(self.labels[5]),
+            self.distances[:, 5].astype(np.float32))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,7 @@ import logging
 from time import strftime
 
 import batch
+from placement import POLICIES
 from submitter import AutoSubmitter
 from submitter import TestSubmitter
 
@@ -48,10 +49,23 @@ def main():
     parser.add_argument('--json', type=argparse.FileType('r'), nargs='?',
                         default='jobs.json',
                         help="A json file encoding all jobs' info")
-    parser.add_argument('--remote', type=str, nargs='?', default='marcc',
-                        action='store', help="The remote computing center.")
+    parser.add_argument('--remote', type=str, nargs='+', default=['marcc'],
+                        action='store',
+                        help="The remote computing centers, jobs are placed "
+                             "on them by the --placement policy.")
+    parser.add_argument('--placement', choices=sorted(POLICIES),
+                        default='shortest-queue',
+                        help="How a job is placed on one of several remotes")
+    parser.add_argument('--place-every-section', default=False,
+                        action='store_true',
+                        help="Place every section again rather than only the "
+                             "first, for working directories shared by all "
+                             "remotes")
     parser.add_argument('--test', default=False, action='store_true',
                         help="Run this program in test mode")
+    parser.add_argument('--state', type=str, default=AutoSubmitter.STATE_FILE,
+                        help="Database the job states are kept in and "
+                             "recovered from after a restart")
     args = parser.parse_args()
 
     jobs_data = None
@@ -61,9 +75,10 @@ def main():
         args.json.close()
 
     submitter = TestSubmitter(jobs_data, args.remote) if args.test else \
-        AutoSubmitter(jobs_data, args.remote)
+        AutoSubmitter(jobs_data, args.remote, args.state,
+                      POLICIES[args.placement](args.place_every_section))
     LOGGER.info("starting %s with remote: %s",
-                submitter.__class__.__name__, args.remote)
+                submitter.__class__.__name__, ", ".join(args.remote))
     submitter.run()
 
 
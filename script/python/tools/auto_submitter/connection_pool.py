@@ -0,0 +1,198 @@
+"""A pool of persistent, multiplexed ssh connections to a remote.
+
+Every ssh/scp call used to open its own connection and pay a full handshake.
+A ConnectionPool keeps a few OpenSSH ControlMaster connections open in the
+background instead; commands run over them through their control sockets,
+which costs a fork but no handshake. Masters are health checked with
+`ssh -O check` before use (at most every HEALTH_CHECK_EVERY seconds) and
+restarted when they died, e.g. after a network hiccup or an idle timeout.
+A master that fails to start is not tried again for HEALTH_CHECK_EVERY
+seconds; commands connect directly meanwhile instead of waiting for it.
+
+The ssh executable is a parameter, so the pool can be tested against a
+local sshd or a fake ssh script that understands -M/-O/-S.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from subprocess import call
+from subprocess import check_call
+from subprocess import CalledProcessError
+from subprocess import DEVNULL
+from subprocess import TimeoutExpired
+from threading import Lock
+from time import time
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+
+class ControlMaster(object):
+    """A single multiplexed ssh connection running in the background."""
+
+    # Seconds a master is allowed to authenticate.
+    CONNECT_TIMEOUT = 30
+
+    # Seconds an idle master stays open.
+    PERSIST = 600
+
+    def __init__(self, server, control_path, ssh="ssh"):
+        """Create a master handle, the connection is opened by start().
+
+        Args:
+            server: The remote server.
+            control_path: string, the control socket of the connection.
+            ssh: string, the ssh executable.
+        """
+        self.__logger = logging.getLogger(
+            'auto_submitter.connection_pool.ControlMaster')
+        self._server = server
+        self._control_path = control_path
+        self._ssh = ssh
+
+    @property
+    def control_path(self):
+        """Returns: string, the control socket of the connection"""
+        return self._control_path
+
+    def options(self):
+        """ssh/scp options that run a command over this connection.
+
+        Returns:
+            List of string, the options.
+        """
+        return ["-o", "ControlPath=%s" % self._control_path,
+                "-o", "ControlMaster=no"]
+
+    def __control(self, operation):
+        """Send a control command (check/exit) to the master.
+
+        Returns:
+            Boolean, the master accepted it.
+        """
+        try:
+            return call([self._ssh, "-o",
+                         "ControlPath=%s" % self._control_path,
+                         "-O", operation, self._server],
+                        stdout=DEVNULL, stderr=DEVNULL,
+                        timeout=ControlMaster.CONNECT_TIMEOUT) == 0
+        except TimeoutExpired:
+            return False
+
+    def is_alive(self):
+        """Returns: Boolean, the master accepts new sessions"""
+        return self.__control("check")
+
+    def start(self):
+        """Open the connection, it forks to the background once it is
+        authenticated.
+
+        Returns:
+            Boolean, the connection is up.
+        """
+        if os.path.exists(self._control_path):
+            # a socket left behind by a master that died.
+            os.remove(self._control_path)
+
+        self.__logger.info("opening connection [%s] to %s",
+                           self._control_path, self._server)
+        try:
+            check_call([self._ssh, "-M", "-N", "-f",
+                        "-o", "ControlPath=%s" % self._control_path,
+                        "-o", "ControlPersist=%d" % ControlMaster.PERSIST,
+                        "-o", "ServerAliveInterval=30",
+                        "-o", "BatchMode=yes", self._server],
+                       stdout=DEVNULL, stderr=DEVNULL,
+                       timeout=ControlMaster.CONNECT_TIMEOUT)
+        except (CalledProcessError, TimeoutExpired, OSError) as err:
+            self.__logger.error("failed to connect to %s: %s",
+                                self._server, err)
+            return False
+        return True
+
+    def stop(self):
+        """Close the connection if it is open."""
+        if os.path.exists(self._control_path):
+            self.__control("exit")
+
+
+class ConnectionPool(object):
+    """Round-robin pool of ControlMaster connections to one server."""
+
+    # Seconds between two health checks of a master.
+    HEALTH_CHECK_EVERY = 60
+
+    # Default number of masters; sshd allows 10 sessions per connection.
+    SIZE = 2
+
+    def __init__(self, server, size=SIZE, ssh="ssh", control_dir=None):
+        """Create a pool, connections are opened when first used.
+
+        Args:
+            server: The remote server.
+            size: int, number of connections.
+            ssh: string, the ssh executable.
+            control_dir: string, directory of the control sockets, a new
+                private temporary directory if None.
+        """
+        self.__logger = logging.getLogger(
+            'auto_submitter.connection_pool.ConnectionPool')
+        self._owns_dir = control_dir is None
+        # keep socket paths short, unix sockets are limited to ~100 bytes.
+        self._control_dir = control_dir or tempfile.mkdtemp(prefix="ssh_")
+        self._masters = [
+            ControlMaster(server, os.path.join(self._control_dir,
+                                               "%d.sock" % index), ssh)
+            for index in range(size)]
+        self._checked = [None] * size
+        self._failed = [None] * size
+        self._locks = [Lock() for _ in range(size)]
+        self._lock = Lock()
+        self._next = 0
+
+    def options(self):
+        """Pick the next connection and make sure it is up.
+
+        Returns:
+            List of string, ssh/scp options to run over the connection, or
+            an empty list if it cannot be opened or failed to open less
+            than HEALTH_CHECK_EVERY seconds ago, so the caller falls back to
+            a direct connection.
+        """
+        with self._lock:
+            index = self._next
+            self._next = (index + 1) % len(self._masters)
+
+        master = self._masters[index]
+        with self._locks[index]:
+            failed = self._failed[index]
+            if failed is not None and time() - failed < \
+                    ConnectionPool.HEALTH_CHECK_EVERY:
+                return []
+            checked = self._checked[index]
+            if checked is None or time() - checked > \
+                    ConnectionPool.HEALTH_CHECK_EVERY:
+                if not master.is_alive() and not master.start():
+                    self._checked[index] = None
+                    self._failed[index] = time()
+                    return []
+                self._checked[index] = time()
+                self._failed[index] = None
+        return master.options()
+
+    def invalidate(self):
+        """Check every connection again before its next use, e.g. after a
+        command failed to connect."""
+        self.__logger.info("connections will be checked before next use")
+        for index in range(len(self._masters)):
+            with self._locks[index]:
+                self._checked[index] = None
+
+    def close(self):
+        """Close all connections."""
+        for master in self._masters:
+            master.stop()
+        if self._owns_dir:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
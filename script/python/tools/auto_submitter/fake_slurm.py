@@ -0,0 +1,235 @@
+"""Local stand-ins of ssh, scp and SLURM for the auto submitter tests.
+
+FakeSlurm writes executables into a directory that behave like ssh and scp
+to several servers, each server being a local home directory with its own
+squeue, sbatch and scancel:
+
+    slurm = FakeSlurm(tempfile.mkdtemp())
+    slurm.set_queue("alpha", ["101 gpu wt me R 1:00 1 node7"])
+    remote = SlurmRemote("alpha", ssh=slurm.ssh, scp=slurm.scp)
+
+The fake ssh understands the ControlMaster options of connection_pool,
+runs commands with bash in the home of the server and expands "~" there;
+squeue prints the jobs set by set_queue(), or with "-t PD" the partitions
+set by set_pending(); sbatch and scancel are recorded, see submitted() and
+cancelled(). sbatch adds the job to the queue as pending, unless the server
+loses its jobs, see set_lost(). fail_squeue() lets squeue time out like an
+overloaded slurmctld.
+"""
+
+import os
+import stat
+import sys
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+_SSH = """#!%(python)s
+import os, subprocess, sys
+root = %(root)r
+args = sys.argv[1:]
+options = {}
+flags = set()
+operation = None
+while args and args[0].startswith("-"):
+    arg = args.pop(0)
+    if arg == "-o":
+        (key, value) = args.pop(0).split("=", 1)
+        options[key] = value
+    elif arg == "-O":
+        operation = args.pop(0)
+    else:
+        flags.add(arg)
+server = args.pop(0)
+control_path = options.get("ControlPath")
+with open(os.path.join(root, "ssh.log"), "a") as log:
+    log.write(" ".join([server, "master" if "-M" in flags
+                        else operation or "command"]) + "\\n")
+if os.path.exists(os.path.join(root, server + ".down")):
+    sys.exit(255)
+if "-M" in flags:
+    open(control_path, "w").close()
+    sys.exit(0)
+if operation == "check":
+    sys.exit(0 if os.path.exists(control_path) else 255)
+if operation == "exit":
+    os.remove(control_path)
+    sys.exit(0)
+home = os.path.join(root, server, "home")
+env = dict(os.environ, HOME=home, FAKE_SLURM_SERVER=server,
+           FAKE_SLURM_ROOT=root,
+           PATH=os.path.join(root, "slurm") + os.pathsep + os.environ["PATH"])
+sys.exit(subprocess.call(["bash", "-c", " ".join(args)], cwd=home, env=env))
+"""
+
+_SCP = """#!%(python)s
+import os, shutil, sys
+root = %(root)r
+args = [arg for arg in sys.argv[1:] if not arg.startswith("-")
+        and "=" not in arg]
+(server, path) = args[-1].split(":", 1)
+if os.path.exists(os.path.join(root, server + ".down")):
+    sys.exit(255)
+home = os.path.join(root, server, "home")
+if path == "~" or path.startswith("~/"):
+    path = home + path[1:]
+shutil.copy(args[-2], os.path.join(home, path))
+"""
+
+_SQUEUE = """#!/bin/sh
+queue="$FAKE_SLURM_ROOT/$FAKE_SLURM_SERVER"
+failures="$queue/squeue_failures"
+case "$*" in
+    *PD*) [ -e "$queue/pending_failures" ] && \
+              failures="$queue/pending_failures" ;;
+esac
+if [ -s "$failures" ] && [ "$(cat "$failures")" -gt 0 ]; then
+    echo $(( $(cat "$failures") - 1 )) > "$failures"
+    echo "slurm_load_jobs error: Socket timed out on send/recv" >&2
+    exit 1
+fi
+case "$*" in
+    *PD*) cat "$queue/pending" 2>/dev/null || true ;;
+    *) echo "JOBID PARTITION NAME USER ST TIME NODES NODELIST"
+       cat "$queue/jobs" 2>/dev/null || true ;;
+esac
+"""
+
+_SBATCH = """#!/bin/sh
+queue="$FAKE_SLURM_ROOT/$FAKE_SLURM_SERVER"
+echo "$FAKE_SLURM_SERVER $PWD/$1" >> "$FAKE_SLURM_ROOT/submitted"
+if [ -e "$queue/squeue_failures_after_sbatch" ]; then
+    mv "$queue/squeue_failures_after_sbatch" "$queue/squeue_failures"
+fi
+id=$(( $(wc -l < "$FAKE_SLURM_ROOT/submitted") ))
+if [ ! -e "$queue/lost" ]; then
+    name=$(sed -n 's/^#SBATCH --job-name=//p' "$1")
+    partition=$(sed -n 's/^#SBATCH --partition=//p' "$1")
+    echo "$id $partition $name me PD 0:00 1 (Priority)" >> "$queue/jobs"
+fi
+echo "Submitted batch job $id"
+"""
+
+_SCANCEL = """#!/bin/sh
+echo "$FAKE_SLURM_SERVER $1" >> "$FAKE_SLURM_ROOT/cancelled"
+"""
+
+
+class FakeSlurm(object):
+    """Fake ssh/scp to local SLURM stand-ins of several servers."""
+
+    def __init__(self, root):
+        """Write the executables.
+
+        Args:
+            root: string, an empty directory the fakes live in.
+        """
+        self._root = root
+        os.makedirs(os.path.join(root, "slurm"))
+        self.ssh = self.__executable("ssh", _SSH)
+        self.scp = self.__executable("scp", _SCP)
+        for (name, script) in (("squeue", _SQUEUE), ("sbatch", _SBATCH),
+                               ("scancel", _SCANCEL)):
+            self.__executable(os.path.join("slurm", name), script)
+
+    def __executable(self, name, script):
+        """Write a script, returns its path."""
+        path = os.path.join(self._root, name)
+        with open(path, "w") as output:
+            output.write(script % {"python": sys.executable,
+                                   "root": self._root})
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        return path
+
+    def home(self, server):
+        """Returns: string, the home directory of a server, created"""
+        path = os.path.join(self._root, server, "home")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def __write(self, server, name, lines):
+        """Write the lines of a queue file of a server."""
+        self.home(server)
+        with open(os.path.join(self._root, server, name), "w") as output:
+            output.write("".join(line + "\n" for line in lines))
+
+    def set_queue(self, server, jobs):
+        """Set the jobs squeue lists, list of squeue lines."""
+        self.__write(server, "jobs", jobs)
+
+    def set_pending(self, server, partitions):
+        """Set the partition of every pending job of all users."""
+        self.__write(server, "pending", partitions)
+
+    def set_lost(self, server):
+        """Let sbatch on a server accept jobs that never show up in the
+        queue, like jobs failing right away."""
+        self.__write(server, "lost", [])
+
+    def fail_squeue(self, server, times, after_sbatch=False, pending=False):
+        """Let the next squeue calls on a server fail.
+
+        Args:
+            server: the server.
+            times: int, number of failing squeue calls, a poll makes two.
+            after_sbatch: Boolean, start failing after the next sbatch.
+            pending: Boolean, only fail the squeue of the pending jobs of
+                all users.
+        """
+        if pending:
+            name = "pending_failures"
+        elif after_sbatch:
+            name = "squeue_failures_after_sbatch"
+        else:
+            name = "squeue_failures"
+        self.__write(server, name, [str(times)])
+
+    def set_down(self, server, down=True):
+        """Make a server refuse or accept connections."""
+        path = os.path.join(self._root, server + ".down")
+        if down:
+            open(path, "w").close()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def __records(self, name):
+        """Returns: list of (server, string), a log of the stand-ins"""
+        path = os.path.join(self._root, name)
+        if not os.path.exists(path):
+            return []
+        with open(path) as records:
+            return [tuple(line.split(" ", 1)) for line in
+                    records.read().splitlines()]
+
+    def queue(self, server):
+        """Returns: list of string, the squeue lines of a server"""
+        return self.__lines(server, "jobs")
+
+    def __lines(self, server, name):
+        """Returns: list of string, a queue file of a server"""
+        path = os.path.join(self._root, server, name)
+        if not os.path.exists(path):
+            return []
+        with open(path) as lines:
+            return lines.read().splitlines()
+
+    def ssh_calls(self, server, kind):
+        """Count the ssh calls of a kind to a server.
+
+        Args:
+            server: the server.
+            kind: string, "master" (-M), "check", "exit" (-O) or
+                "command".
+
+        Returns:
+            Int type, the number of calls, successful or not.
+        """
+        return self.__records("ssh.log").count((server, kind))
+
+    def submitted(self):
+        """Returns: list of (server, batch file), every sbatch call"""
+        return self.__records("submitted")
+
+    def cancelled(self):
+        """Returns: list of (server, job id), every scancel call"""
+        return self.__records("cancelled")
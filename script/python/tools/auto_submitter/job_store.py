@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Durable job state of the auto submitter.
+
+The state lives in a SQLite database in WAL mode:
+
+    jobs          one row per job, the latest state of the job as json
+    transitions   a journal of every recorded change (job, event, state)
+
+A change of one job writes one row of each table, however many jobs are
+managed. WAL mode lets other processes read the database while the
+submitter writes it, e.g. to print the current state:
+
+    python3 job_store.py auto_submitter.db
+
+On startup the submitter recovers the progress of every job (RECOVERED)
+from the store, so a crash or restart does not lose job ids and sections.
+"""
+
+from json import dumps
+from json import loads
+import argparse
+import logging
+import sqlite3
+import sys
+from time import time
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# Fields of a job that are progress rather than configuration.
+RECOVERED = ("jobId", "sectionNum", "makeup", "exclusion", "exclusionList",
+             "remote")
+
+# Transitions kept per job when the journal is compacted.
+KEEP_TRANSITIONS = 1000
+
+# Seconds to wait for another writer.
+BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    event TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    event TEXT NOT NULL,
+    state TEXT NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_name ON transitions (name, id);
+"""
+
+
+class JobStore(object):
+    """Incremental, crash-safe store of the state of every job."""
+
+    def __init__(self, path, read_only=False):
+        """Open or create a store.
+
+        Args:
+            path: string, the database file.
+            read_only: Boolean, open for reading only, the store must
+                exist.
+        """
+        self.__logger = logging.getLogger('auto_submitter.job_store.JobStore')
+        self._path = path
+        if read_only:
+            self._connection = sqlite3.connect(
+                "file:%s?mode=ro" % path, uri=True, timeout=BUSY_TIMEOUT)
+        else:
+            self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # a transaction survives a crash of the process; syncing the
+            # WAL at checkpoints only is enough for that.
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+
+    @property
+    def path(self):
+        """Returns: string, the database file"""
+        return self._path
+
+    def record(self, job, event):
+        """Record the new state of a single job.
+
+        Args:
+            job: dict type, the job in the job table.
+            event: string, what happened to the job, e.g. "submitted".
+        """
+        state = dumps(job, sort_keys=True)
+        now = time()
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (name, state, event, updated) "
+                "VALUES (?, ?, ?, ?)", (job["name"], state, event, now))
+            self._connection.execute(
+                "INSERT INTO transitions (name, event, state, time) "
+                "VALUES (?, ?, ?, ?)", (job["name"], event, state, now))
+
+    def load(self):
+        """Read the latest state of every job.
+
+        Returns:
+            dict, job name -> (dict of the job state, string of the last
+            event).
+        """
+        rows = self._connection.execute(
+            "SELECT name, state, event FROM jobs")
+        return {name: (loads(state), event) for (name, state, event) in rows}
+
+    def transitions(self, name):
+        """Read the journal of a job.
+
+        Args:
+            name: the job name.
+
+        Returns:
+            List of (float, string, dict), time, event and state, oldest
+            first.
+        """
+        rows = self._connection.execute(
+            "SELECT time, event, state FROM transitions WHERE name = ? "
+            "ORDER BY id", (name,))
+        return [(when, event, loads(state)) for (when, event, state) in rows]
+
+    def recover(self, jobs):
+        """Restore the progress of jobs from the store.
+
+        Args:
+            jobs: list of dict, the job table, updated in place.
+
+        Returns:
+            List of string, the names of the jobs whose last recorded event
+            is "submitting", i.e. the submitter stopped while it was
+            submitting them and the remote may or may not have the job.
+        """
+        stored = self.load()
+        interrupted = []
+        for job in jobs:
+            if job["name"] not in stored:
+                continue
+            (state, event) = stored[job["name"]]
+            for field in RECOVERED:
+                if field in state:
+                    job[field] = state[field]
+            self.__logger.info("recovered job %s: section %s job id %s",
+                               job["name"], job.get("sectionNum"),
+                               job.get("jobId"))
+            if event == "submitting":
+                interrupted.append(job["name"])
+        return interrupted
+
+    def compact(self, keep=KEEP_TRANSITIONS):
+        """Drop all but the latest transitions of every job and checkpoint
+        the WAL into the database.
+
+        Args:
+            keep: int, number of transitions kept per job.
+        """
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM transitions WHERE id IN (SELECT id FROM ("
+                "SELECT id, ROW_NUMBER() OVER (PARTITION BY name ORDER BY "
+                "id DESC) AS age FROM transitions) WHERE age > ?)", (keep,))
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """Close the store."""
+        self._connection.close()
+
+
+def main():
+    """Print the current state of every job in a store as json."""
+    parser = argparse.ArgumentParser(
+        description="Print the job states of an auto submitter store")
+    parser.add_argument('store', help="the state database")
+    args = parser.parse_args()
+
+    store = JobStore(args.store, read_only=True)
+    try:
+        jobs = [state for (state, _) in store.load().values()]
+    finally:
+        store.close()
+    sys.stdout.write(dumps(sorted(jobs, key=lambda job: job["name"]),
+                           indent=4, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Placement policies of a submitter that manages several remotes.
+
+When jobs can run on more than one computing center, a PlacementPolicy
+picks the remote every job, or every new section of a job, is submitted to.
+It decides from the RemoteLoad of every remote, which the submitter builds
+from the latest poll of that remote.
+
+By default a job is placed once, when its first section is submitted, and
+then stays on its remote: the next section continues from the checkpoint
+files in the working directory, which only exist on that remote. A policy
+with per_section = True places every section again; use it only for jobs
+whose working directory is shared by the remotes.
+"""
+
+from abc import ABCMeta
+from abc import abstractmethod
+
+from collections import namedtuple
+
+import logging
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# The load of a remote seen by a placement policy:
+#   pending: dict, partition -> number of jobs of all users waiting in it,
+#       None if the remote could not be polled
+#   assigned: int, number of managed jobs placed on the remote
+#   capacity: float, relative throughput of the remote, e.g. 2.0 if it
+#       starts jobs twice as fast as a remote with capacity 1.0
+RemoteLoad = namedtuple("RemoteLoad", ["pending", "assigned", "capacity"])
+
+
+class PlacementPolicy(object):
+    """An interface to placement policies."""
+    __metaclass__ = ABCMeta
+
+    # Place every section again, not only the first one.
+    per_section = False
+
+    @abstractmethod
+    def place(self, job, loads):
+        """Pick the remote a job is submitted to.
+
+        Args:
+            job: dict type, the job in the job table.
+            loads: dict, remote server -> RemoteLoad, of every remote.
+
+        Returns:
+            The remote server.
+        """
+        pass
+
+
+class ShortestQueuePolicy(PlacementPolicy):
+    """Place a job on the remote with the shortest expected queue wait.
+
+    The expected wait is the number of jobs waiting ahead of the job in its
+    partition, divided by the capacity of the remote. Remotes that could
+    not be polled are only chosen if no remote could; ties go to the remote
+    with fewer managed jobs.
+    """
+
+    def __init__(self, per_section=False):
+        """Create the policy.
+
+        Args:
+            per_section: Boolean, place every section again.
+        """
+        self.__logger = logging.getLogger(
+            'auto_submitter.placement.ShortestQueuePolicy')
+        self.per_section = per_section
+
+    @staticmethod
+    def expected_wait(job, load):
+        """Estimate the queue wait of a job on a remote.
+
+        Args:
+            job: dict type, the job in the job table.
+            load: RemoteLoad, of the remote.
+
+        Returns:
+            Float type, in units of "jobs started by a remote of capacity
+            1.0", infinity if the load is unknown.
+        """
+        if load.pending is None or load.capacity <= 0:
+            return float("inf")
+        return (load.pending.get(job["partition"], 0) + 1) / load.capacity
+
+    def place(self, job, loads):
+        """Pick the remote with the shortest expected queue wait.
+
+        Args:
+            job: dict type, the job in the job table.
+            loads: dict, remote server -> RemoteLoad, of every remote.
+
+        Returns:
+            The remote server.
+        """
+        server = min(sorted(loads), key=lambda name: (
+            self.expected_wait(job, loads[name]), loads[name].assigned))
+        self.__logger.info(
+            "place job %s on %s, expected wait %.1f", job["name"], server,
+            self.expected_wait(job, loads[server]))
+        return server
+
+
+class RoundRobinPolicy(PlacementPolicy):
+    """Place jobs on the remotes in turn, whatever their load."""
+
+    def __init__(self, per_section=False):
+        """Create the policy.
+
+        Args:
+            per_section: Boolean, place every section again.
+        """
+        self.per_section = per_section
+        self._next = 0
+
+    def place(self, job, loads):
+        """Pick the next remote.
+
+        Args:
+            job: dict type, the job in the job table.
+            loads: dict, remote server -> RemoteLoad, of every remote.
+
+        Returns:
+            The remote server.
+        """
+        servers = sorted(loads)
+        server = servers[self._next % len(servers)]
+        self._next += 1
+        return server
+
+
+# Policies by the name used on the command line.
+POLICIES = {
+    "shortest-queue": ShortestQueuePolicy,
+    "round-robin": RoundRobinPolicy,
+}
@@ -1,10 +1,25 @@
 """Some class functions on handling remote connections.
 
 Remote class is a class that handles the status of the remote server.
+Commands run over a ConnectionPool of persistent ssh connections, so only
+the first command to a server pays the ssh handshake. poll() gathers
+everything a polling cycle needs in a single command.
+
+The methods the scheduler uses have coroutine versions (poll_async,
+copy_to_remote_and_submit_async, cancel_job_async) that run the ssh/scp
+processes with asyncio instead of blocking a thread.
 """
 from abc import ABCMeta
 from abc import abstractmethod
 
+import asyncio
+import os
+import signal
+
+from collections import namedtuple
+from shlex import quote
+from uuid import uuid4
+
 from subprocess import check_output
 from subprocess import CalledProcessError
 from subprocess import STDOUT
@@ -14,8 +29,41 @@ from datetime import datetime
 
 import logging
 
+from connection_pool import ConnectionPool
+
 __author__ = 'davislong198833@gmail.com (Yunlong Liu)'
 
+# Format of the remote time returned by poll().
+REMOTE_TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+# The state of a remote after one polling cycle:
+#   job_status: list of list of string, see Remote.job_status
+#   remote_time: datetime, the remote time, datetime.min if unknown
+#   log_tails: dict, job name -> list of string, the last log lines of the
+#       running jobs that were asked for
+#   pending: dict, partition -> number of jobs of all users waiting in it,
+#       None if unknown. It is None whenever a squeue of the poll failed, so
+#       it tells a failed poll from an empty queue.
+PollResult = namedtuple("PollResult", ["job_status", "remote_time",
+                                       "log_tails", "pending"])
+
+
+def _quote_path(path):
+    """Quote a path for the remote shell but keep a leading "~" expanding
+    to the home directory, as the paths in jobs.json rely on it.
+
+    Args:
+        path: string, a remote path.
+
+    Returns:
+        String, the quoted path.
+    """
+    if path == "~":
+        return '"$HOME"'
+    if path.startswith("~/"):
+        return '"$HOME"/' + quote(path[2:])
+    return quote(path)
+
 
 class Remote(object):
     """An interface to remote proxy object.
@@ -24,42 +72,117 @@ class Remote(object):
 
     TIMEOUT = 60
 
-    def __init__(self, server):
+    # Exit status of ssh/scp when the connection itself failed.
+    CONNECTION_ERROR = 255
+
+    def __init__(self, server, pool=None):
         """Creating a remote handler.
 
         Args:
             server: The remote server.
+            pool: ConnectionPool to run commands over, None to connect for
+                every command.
         """
         self.__logger = logging.getLogger('auto_submitter.remote.Remote')
         self._server = server
+        self._pool = pool
 
         if self._server == "":
             raise ValueError(
                 "Remote object should have a non-empty server field.")
 
-    def _run_command(self, command):
+    def _run_command(self, command, copy=False):
         """A protected function to run this remote command.
 
+        A command that fails to connect is retried once after the pooled
+        connections are checked again.
+
         Args:
-            command: A string list, bash command run in remote
+            command: A string list, bash command run in remote, or the scp
+                arguments when copying.
+            copy: Boolean, is copying a file.
 
         Returns:
-            A string contains the output of the remote command.
+            (Boolean, string), succeeded and the output of the command.
         """
-        result = None
-        try:
-            result = check_output(
-                command, timeout=Remote.TIMEOUT, stderr=STDOUT)
-        except TimeoutExpired:
-            command_string = " ".join(command)
-            self.__logger.info("Remote command TIMEOUT: %s", command_string)
-            return (False, "")
-        except CalledProcessError as err:
-            self.__logger.error("CalledProcessError: " +
-                                err.output.decode("utf-8"))
+        attempts = 2 if self._pool is not None else 1
+        for attempt in range(attempts):
+            full_command = self._command_prefix(copy) + command
+            try:
+                result = check_output(
+                    full_command, timeout=Remote.TIMEOUT, stderr=STDOUT)
+            except TimeoutExpired:
+                command_string = " ".join(full_command)
+                self.__logger.info("Remote command TIMEOUT: %s",
+                                   command_string)
+                return (False, "")
+            except CalledProcessError as err:
+                if err.returncode == Remote.CONNECTION_ERROR and \
+                        attempt + 1 < attempts:
+                    self.__logger.warning("connection failed, retrying")
+                    self._pool.invalidate()
+                    continue
+                self.__logger.error("CalledProcessError: " +
+                                    err.output.decode("utf-8"))
+                return (False, "")
+
+            return (True, result.decode("utf-8").rstrip("\n"))
+
+    async def _run_command_async(self, command, copy=False):
+        """Coroutine version of _run_command.
+
+        Args:
+            command: A string list, bash command run in remote, or the scp
+                arguments when copying.
+            copy: Boolean, is copying a file.
+
+        Returns:
+            (Boolean, string), succeeded and the output of the command.
+        """
+        loop = asyncio.get_running_loop()
+        attempts = 2 if self._pool is not None else 1
+        for attempt in range(attempts):
+            # the pool may have to check or reopen a connection, which
+            # blocks, so the prefix is built off the event loop.
+            full_command = await loop.run_in_executor(
+                None, self._command_prefix, copy) + command
+            # a session of its own, so the command can be killed together
+            # with the processes it starts, e.g. a ProxyCommand.
+            process = await asyncio.create_subprocess_exec(
+                *full_command, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+            try:
+                (output, _) = await asyncio.wait_for(process.communicate(),
+                                                     Remote.TIMEOUT)
+            except (asyncio.CancelledError, asyncio.TimeoutError) as err:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                # the pipes close once every process of the group is gone.
+                await process.communicate()
+                if isinstance(err, asyncio.CancelledError):
+                    raise
+                command_string = " ".join(full_command)
+                self.__logger.info("Remote command TIMEOUT: %s",
+                                   command_string)
+                return (False, "")
+
+            if process.returncode == 0:
+                return (True, output.decode("utf-8").rstrip("\n"))
+            if process.returncode == Remote.CONNECTION_ERROR and \
+                    attempt + 1 < attempts:
+                self.__logger.warning("connection failed, retrying")
+                self._pool.invalidate()
+                continue
+            self.__logger.error("Remote command failed: " +
+                                output.decode("utf-8"))
             return (False, "")
 
-        return (True, result.decode("utf-8").rstrip("\n"))
+    def close(self):
+        """Close the pooled connections."""
+        if self._pool is not None:
+            self._pool.close()
 
     @abstractmethod
     def _command_prefix(self, copy=False):
@@ -85,8 +208,7 @@ class Remote(object):
     def current_remote_time(self):
         """Returns the current time of remote (datetime object)"""
         self.__logger.info("Querying current time on remote.")
-        command = self._command_prefix().extend([self._server, "date"])
-        result = self._run_command(command)
+        result = self._run_command(["date"])
         if result[0]:
             try:
                 return datetime.strptime(result[1], "%a %b %d %H:%M:%S EST %Y")
@@ -97,6 +219,27 @@ class Remote(object):
             self.__logger.error("Failed to query current remote time")
             return datetime.min
 
+    @abstractmethod
+    def poll(self, user, working_folders, num_lines=1):
+        """Query the job status, the remote time and the log tails of the
+        running jobs in a single remote command.
+
+        Args:
+            user: the user whose jobs are queried.
+            working_folders: dict, job name -> working folder of the jobs
+                whose log tail is wanted while they are running.
+            num_lines: number of lines of every tail.
+
+        Returns:
+            PollResult, empty if the command failed.
+        """
+        pass
+
+    @abstractmethod
+    async def poll_async(self, user, working_folders, num_lines=1):
+        """Coroutine version of poll."""
+        pass
+
     @abstractmethod
     def tail_log(self, job_id, working_folder, num_lines=1):
         """Returns the expect completion time of a job
@@ -123,6 +266,12 @@ class Remote(object):
         """
         pass
 
+    @abstractmethod
+    async def copy_to_remote_and_submit_async(self, file_name,
+                                              remote_folder):
+        """Coroutine version of copy_to_remote_and_submit."""
+        pass
+
     @abstractmethod
     def cancel_job(self, job_id):
         """Cancel a job on remote.
@@ -132,6 +281,11 @@ class Remote(object):
         """
         pass
 
+    @abstractmethod
+    async def cancel_job_async(self, job_id):
+        """Coroutine version of cancel_job."""
+        pass
+
 
 class SlurmRemote(Remote):
     """A Remote Proxy that specifically configured for SLURM system.
@@ -140,11 +294,27 @@ class SlurmRemote(Remote):
     will be sufficient in most of the cases.
     """
 
-    def __init__(self, server, shared=False):
-        super(SlurmRemote, self).__init__(server)
+    def __init__(self, server, shared=False, pool_size=ConnectionPool.SIZE,
+                 ssh="ssh", scp="scp"):
+        """Create a SLURM remote.
+
+        Args:
+            server: The remote server.
+            shared: Boolean, never let a direct (unpooled) connection become
+                a ControlMaster of the user's ssh config.
+            pool_size: int, number of pooled connections, 0 to connect for
+                every command.
+            ssh: string, the ssh executable.
+            scp: string, the scp executable.
+        """
+        super(SlurmRemote, self).__init__(
+            server, ConnectionPool(server, pool_size, ssh) if pool_size
+            else None)
         self.__logger = logging.getLogger("auto_submitter.remote.SlurmRemote")
 
         self.__shared = shared
+        self.__ssh = ssh
+        self.__scp = scp
 
     def _command_prefix(self, copy=False):
         """Get the command prefix to run remote commands (e.g. ssh)
@@ -155,13 +325,16 @@ class SlurmRemote(Remote):
         Returns:
             List of string, command prefix.
         """
-        prefix = "scp " if copy else "ssh "
-        if self.__shared:
-            prefix += "-o ControlMaster=no"
+        prefix = [self.__scp if copy else self.__ssh]
+        options = self._pool.options() if self._pool is not None else []
+        if options:
+            prefix += options
+        elif self.__shared:
+            prefix += ["-o", "ControlMaster=no"]
         if not copy:
-            prefix += " " + self._server
+            prefix.append(self._server)
 
-        return prefix.split()
+        return prefix
 
     def job_status(self, user):
         """Query job status through ssh.
@@ -170,16 +343,155 @@ class SlurmRemote(Remote):
             A string list contains the job status returned by remote
         """
         self.__logger.info("Querying job_status on remote.")
-        status = self._run_command(self._command_prefix().extend(
-            ["squeue", "-u", user]))
+        status = self._run_command(["squeue", "-u", user])
 
         if status[0]:
-            job_status = status[1].split("\n")[1:]
-            return [job.lstrip().split() for job in job_status]
+            return self._parse_job_status(status[1])
         else:
             self.__logger.error("Failed to query job status.")
             return []
 
+    @staticmethod
+    def _parse_job_status(output):
+        """Split squeue output, without its header, into fields."""
+        return [job.lstrip().split() for job in output.split("\n")[1:]
+                if job.strip()]
+
+    def poll(self, user, working_folders, num_lines=1):
+        """Query the job status, the remote time and the log tails of the
+        running jobs in a single remote command.
+
+        The remote script runs squeue once, picks the ids of the running
+        jobs out of its output and tails their logs; every section of the
+        output starts with a delimiter line that is unique to this poll.
+        It also counts the pending jobs of all users per partition, the
+        queue a new job would wait in.
+
+        Args:
+            user: the user whose jobs are queried.
+            working_folders: dict, job name -> working folder of the jobs
+                whose log tail is wanted while they are running.
+            num_lines: number of lines of every tail.
+
+        Returns:
+            PollResult, empty if the command failed.
+        """
+        (marker, script) = self.__poll_script(user, working_folders,
+                                              num_lines)
+        return self.__parse_poll(marker, self._run_command([script]))
+
+    async def poll_async(self, user, working_folders, num_lines=1):
+        """Coroutine version of poll."""
+        (marker, script) = self.__poll_script(user, working_folders,
+                                              num_lines)
+        return self.__parse_poll(
+            marker, await self._run_command_async([script]))
+
+    def __poll_script(self, user, working_folders, num_lines):
+        """Build the remote script of poll().
+
+        Returns:
+            (string, string), the delimiter and the script.
+        """
+        self.__logger.info("polling remote for %d jobs.",
+                           len(working_folders))
+        marker = "==== poll %s" % uuid4().hex
+        # the exit status of every squeue goes to a section of its own, a
+        # failed squeue must not look like an empty queue.
+        script = ['q=$(squeue -u %s 2>&1); s=$?' % quote(user),
+                  'echo %s' % quote(marker + " squeue"),
+                  'echo "$q"',
+                  'echo %s' % quote(marker + " squeue status"),
+                  'echo $s',
+                  'echo %s' % quote(marker + " date"),
+                  'date %s' % quote("+" + REMOTE_TIME_FORMAT),
+                  'p=$(squeue -h -t PD -o %P 2>&1); s=$?',
+                  'echo %s' % quote(marker + " pending"),
+                  'echo "$p"',
+                  'echo %s' % quote(marker + " pending status"),
+                  'echo $s']
+        for (name, folder) in sorted(working_folders.items()):
+            script.append(
+                'i=$(echo "$q" | awk -v n=%s \'NR > 1 && $3 == n && '
+                '$5 == "R" {print $1; exit}\')' % quote(name))
+            script.append(
+                '[ -n "$i" ] && echo %s && tail -n %d %s/slurm-$i.out '
+                '2>/dev/null' % (quote(marker + " tail " + name),
+                                 num_lines, _quote_path(folder)))
+
+        # only the tails may fail, e.g. for jobs that are not running.
+        script.append("true")
+        return (marker, "; ".join(script))
+
+    def __parse_poll(self, marker, result):
+        """Split the output of the poll() script into a PollResult.
+
+        Args:
+            marker: string, the delimiter of the script.
+            result: (Boolean, string), the result of the script.
+
+        Returns:
+            PollResult, empty if the command or the user's squeue failed.
+        """
+        if not result[0]:
+            self.__logger.error("Failed to poll remote.")
+            return PollResult([], datetime.min, {}, None)
+
+        sections = {}
+        lines = None
+        for line in result[1].split("\n"):
+            if line.startswith(marker + " "):
+                lines = sections.setdefault(line[len(marker) + 1:], [])
+            elif lines is not None:
+                lines.append(line)
+
+        remote_time = datetime.min
+        try:
+            remote_time = datetime.strptime(
+                "\n".join(sections.get("date", [])).strip(),
+                REMOTE_TIME_FORMAT)
+        except ValueError:
+            self.__logger.error("Failed to parse remote current time.")
+
+        log_tails = {key[len("tail "):]: [line for line in tail if line]
+                     for (key, tail) in sections.items()
+                     if key.startswith("tail ")}
+
+        if not self.__succeeded(sections, "squeue"):
+            return PollResult([], remote_time, {}, None)
+
+        pending = None
+        if self.__succeeded(sections, "pending"):
+            pending = {}
+            for line in sections["pending"]:
+                # a job submitted to several partitions waits in all of
+                # them.
+                for partition in line.strip().split(","):
+                    if partition:
+                        pending[partition] = pending.get(partition, 0) + 1
+
+        return PollResult(
+            self._parse_job_status("\n".join(sections["squeue"])),
+            remote_time, log_tails, pending)
+
+    def __succeeded(self, sections, name):
+        """Check the exit status of a command of the poll() script.
+
+        Args:
+            sections: dict, section name -> list of lines of the output.
+            name: string, the section of the command.
+
+        Returns:
+            Boolean, the command exited with 0.
+        """
+        status = "".join(sections.get(name + " status", [])).strip()
+        if status == "0":
+            return True
+        self.__logger.error("%s failed on remote (status %s): %s", name,
+                            status or "unknown",
+                            " ".join(sections.get(name, [])).strip())
+        return False
+
     def tail_log(self, job_id, working_folder, num_lines=1):
         """Returns the expect completion time of a job
 
@@ -191,10 +503,9 @@ class SlurmRemote(Remote):
             A string that contains the expect completion time of job_id.
         """
         self.__logger.info("query log tail on remote.")
-        command = self._command_prefix().extend(
-            ["tail", str(num_lines),
+        result = self._run_command(
+            ["tail", "-n", str(num_lines),
              "%s/slurm-%s.out" % (working_folder, job_id)])
-        result = self._run_command(command)
 
         if not result[0]:
             self.__logger.error("Failed to query ECT")
@@ -220,12 +531,9 @@ class SlurmRemote(Remote):
         """
         self.__logger.info("Copy and submit [%s] to remote.", file_name)
 
-        cp_command = self._command_prefix(True).extend(
-            [file_name, "%s:%s" % (self._server, remote_folder)])
-        submit_command = self._command_prefix().extend(
-            ["cd", remote_folder, "&&", "sbatch", file_name])
-
-        if not self._run_command(cp_command)[0]:
+        (cp_command, submit_command) = self.__submit_commands(
+            file_name, remote_folder)
+        if not self._run_command(cp_command, copy=True)[0]:
             self.__logger.error("copy to remote failed [%s]", file_name)
             return ""
 
@@ -236,12 +544,39 @@ class SlurmRemote(Remote):
 
         return submission[1]
 
+    async def copy_to_remote_and_submit_async(self, file_name,
+                                              remote_folder):
+        """Coroutine version of copy_to_remote_and_submit."""
+        self.__logger.info("Copy and submit [%s] to remote.", file_name)
+
+        (cp_command, submit_command) = self.__submit_commands(
+            file_name, remote_folder)
+        if not (await self._run_command_async(cp_command, copy=True))[0]:
+            self.__logger.error("copy to remote failed [%s]", file_name)
+            return ""
+
+        submission = await self._run_command_async(submit_command)
+        if not submission[0]:
+            self.__logger.error("submit to remote failed [%s]", file_name)
+            return ""
+
+        return submission[1]
+
+    def __submit_commands(self, file_name, remote_folder):
+        """Returns: the scp arguments and the remote sbatch command"""
+        return ([file_name, "%s:%s" % (self._server, remote_folder)],
+                ["cd", remote_folder, "&&", "sbatch", file_name])
+
     def cancel_job(self, job_id):
         """Cancel a job on remote.
 
         Args:
             job_id: the job id to cancel.
         """
-        command = self._command_prefix().extend(["scancel", job_id])
-        if not self._run_command(command)[0]:
+        if not self._run_command(["scancel", job_id])[0]:
+            self.__logger.error("Cancelling job [%s] failed.", job_id)
+
+    async def cancel_job_async(self, job_id):
+        """Coroutine version of cancel_job."""
+        if not (await self._run_command_async(["scancel", job_id]))[0]:
             self.__logger.error("Cancelling job [%s] failed.", job_id)
@@ -0,0 +1,75 @@
+"""Timer heap of per-job deadlines for the event-driven submitter.
+
+Every managed job has at most one deadline, the time its next section
+should be submitted at. Rescheduling a job replaces its deadline; the old
+heap entry is left in place and skipped when it surfaces, so both
+operations are O(log n) and thousands of jobs cost a heap, not a thread
+each.
+"""
+
+import heapq
+import itertools
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+
+class DeadlineHeap(object):
+    """Deadlines keyed by job name, earliest first."""
+
+    def __init__(self):
+        """Create an empty heap."""
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        """Returns: number of jobs with a deadline"""
+        return len(self._deadlines)
+
+    def __contains__(self, name):
+        """Returns: Boolean, the job has a deadline"""
+        return name in self._deadlines
+
+    def schedule(self, name, deadline):
+        """Set or replace the deadline of a job.
+
+        Args:
+            name: the job name.
+            deadline: float, loop time the job is due at.
+        """
+        entry = (deadline, next(self._counter), name)
+        self._deadlines[name] = entry
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, name):
+        """Remove the deadline of a job, if any."""
+        self._deadlines.pop(name, None)
+
+    def __drop_stale(self):
+        """Pop the replaced or cancelled entries off the top of the heap."""
+        while self._heap and \
+                self._deadlines.get(self._heap[0][2]) is not self._heap[0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """Returns: float, the earliest deadline, None if there is none"""
+        self.__drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove and return the jobs that are due.
+
+        Args:
+            now: float, the current loop time.
+
+        Returns:
+            List of job names, earliest deadline first.
+        """
+        due = []
+        self.__drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            (_, _, name) = heapq.heappop(self._heap)
+            del self._deadlines[name]
+            due.append(name)
+            self.__drop_stale()
+        return due
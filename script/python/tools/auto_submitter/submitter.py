@@ -4,20 +4,20 @@
 from abc import ABCMeta
 from abc import abstractmethod
 
-from json import dump
-
+from collections import Counter
+from collections import OrderedDict
 from datetime import datetime
+import asyncio
 import logging
 import sys
 
-from threading import Lock
-from time import sleep
-
-from concurrent.futures import ThreadPoolExecutor
-
 from batch import add_exclusion_node
 from batch import batch_file_factory
-from remote import Remote
+from job_store import JobStore
+from placement import RemoteLoad
+from placement import ShortestQueuePolicy
+from remote import SlurmRemote
+from scheduler import DeadlineHeap
 
 __author__ = 'davislong198833@gmail.com (Yunlong Liu)'
 
@@ -48,8 +48,12 @@ class SubmitterBase(object):
     """Jobs submitter implementation.
 
     This submitter automatically detect jobs' status, generates new batch
-    files and submits files to the remote server. In current design, a single
-    Submitter can only work with a single remote computing center.
+    files and submits files to the remote servers. Every remote computing
+    center has its own SlurmRemote, and so its own connection pool.
+
+    Settings of a single remote go to the optional "remotes" table of the
+    jobs data, e.g. {"remotes": {"bluecrab": {"userId": "x", "capacity": 2}}};
+    a remote without an entry uses the top level "userId".
     """
     __metaclass__ = ABCMeta
 
@@ -58,11 +62,26 @@ class SubmitterBase(object):
 
         Args:
             jobs_data: dict type, all information of the jobs to be managed
-            remote: string type, the remote machine
+            remote: string type, the remote machine, or a list of them
         """
         super(SubmitterBase, self).__init__()
         self._data = jobs_data
-        self._remote = Remote(remote)
+        servers = [remote] if isinstance(remote, str) else list(remote)
+        if not servers:
+            raise ValueError("Submitter needs at least one remote.")
+        self._remotes = OrderedDict(
+            (server, SlurmRemote(server)) for server in servers)
+        # the first remote, for the single remote code paths.
+        self._remote = self._remotes[servers[0]]
+
+    def _remote_settings(self, server):
+        """Returns: dict, the settings of a remote in the jobs data"""
+        return self._data.get("remotes", {}).get(server, {})
+
+    def _user(self, server):
+        """Returns: string, the user on a remote"""
+        return self._remote_settings(server).get("userId",
+                                                 self._data["userId"])
 
     @abstractmethod
     def _log_start(self):
@@ -101,13 +120,14 @@ class TestSubmitter(SubmitterBase):
         """
         super(TestSubmitter, self).run()
 
-        # Accessing remote
-        remote_time = self._remote.current_remote_time()
-        if remote_time != "":
-            self.__logger.info("Accessing remote success")
-            self.__logger.info("Remote time: %s", remote_time)
-        else:
-            self.__logger.error("Accessing remote failed.")
+        # Accessing remotes
+        for (server, remote) in self._remotes.items():
+            remote_time = remote.current_remote_time()
+            if remote_time != "":
+                self.__logger.info("Accessing remote %s success", server)
+                self.__logger.info("Remote time: %s", remote_time)
+            else:
+                self.__logger.error("Accessing remote %s failed.", server)
 
         # Generating Batch file (continuation and makeup both)
         self.__logger.info("Reading data title: %s",
@@ -125,29 +145,59 @@ class TestSubmitter(SubmitterBase):
 
 
 class AutoSubmitter(SubmitterBase):
-    """Auto Submitter implementation"""
+    """Auto Submitter implementation
+
+    The submitter runs on an asyncio event loop. The next submission of
+    every job is a deadline in a DeadlineHeap rather than a thread sleeping
+    until then, remote commands are asyncio subprocesses, and the remote is
+    polled more often when a deadline or an expected completion is near.
+
+    With several remotes, every remote is polled in each cycle and a
+    PlacementPolicy picks the remote a job is submitted to. The remote of a
+    job is kept in its "remote" field; a job may be pinned to a remote by
+    setting the field in the jobs data.
+    """
 
-    # Check status every half a hour.
+    # Longest time between two polls of the remote.
     CHECK_EVERY_N = 600
+    # Shortest time between two polls of the remote.
+    MIN_CHECK_EVERY_N = 60
     GAP_TIME = 30
-    NUM_THREADS = 8
+    # Max number of submissions and cancellations in flight.
+    NUM_REMOTE_COMMANDS = 8
+    # Default database of the job states, see job_store.
+    STATE_FILE = "auto_submitter.db"
 
-    def __init__(self, jobs_data, remote):
+    def __init__(self, jobs_data, remote, state_file=STATE_FILE,
+                 policy=None):
         """Create an auto submitter object
 
         Args:
             jobs_data: dict type, all information of the jobs to be managed
-            remote: string type, the remote machine
+            remote: string type, the remote machine, or a list of them
+            state_file: string type, the JobStore every change of a job is
+                recorded in and recovered from on startup
+            policy: PlacementPolicy, picks the remote of a job, a
+                ShortestQueuePolicy if None
         """
         super(AutoSubmitter, self).__init__(jobs_data, remote)
         self.__logger = logging.getLogger(
             "auto_submitter.submitter.AutoSubmitter")
-        self.__executor = ThreadPoolExecutor(
-            max_workers=AutoSubmitter.NUM_THREADS)
-        self.__lock = Lock()
 
         self.__job_table = self._data["data"]["items"]
         self.__ids = {}
+        self.__deadlines = DeadlineHeap()
+        self.__submitting = set()
+        # job name -> loop time of a submitted section not seen in the
+        # queue yet.
+        self.__unseen = {}
+        self.__policy = policy if policy is not None else \
+            ShortestQueuePolicy()
+        # remote server -> pending jobs per partition, from the last poll.
+        self.__pending = {}
+        # created on the event loop, see __schedule.
+        self.__remote_slots = None
+        self.__store = JobStore(state_file)
 
     def __checkin_items(self):
         """check the formats of input job tables"""
@@ -163,6 +213,11 @@ class AutoSubmitter(SubmitterBase):
                 self.__logger.critical("duplicate job name %s", item["name"])
                 return False
 
+            if "remote" in item and item["remote"] not in self._remotes:
+                self.__logger.critical("job %s is pinned to unknown remote "
+                                       "%s", item["name"], item["remote"])
+                return False
+
             self.__ids[item["name"]] = index
             item["jobId"] = ""
             item["expCompletion"] = 0
@@ -174,51 +229,120 @@ class AutoSubmitter(SubmitterBase):
 
         return True
 
-    def __time_to_completion(self, job_id, work_dir):
-        """Get the time to completion for specific job_id
+    def __time_to_completion(self, item, remote_time, log_tail):
+        """Get the time to completion of a running job from its log tail.
+
+        Gromacs ends its log with a line like
+        "imb F  0% step 100, will finish Mon Oct 17 12:00:00 2016".
 
         Args:
-            job_id: The remote sbatch's job id.
-            working_folder: The working folder for job_id
+            item: dict type, the job in the job table
+            remote_time: datetime, current remote time
+            log_tail: list of string, last lines of the job's log, None if
+                the log was not queried
 
         Returns:
-            Float type, time to completion in seconds.
+            Int type, time to completion in seconds.
         """
-        if work_dir == "":
+        if item["directory"] == "":
             self.__logger.warning("No work_directory is provided.")
             return sys.maxsize
 
-        # Initially jobs are not submitted so it is not assigned an id.
-        if job_id == "":
-            return 0
-
-        remote_current = self._remote.current_remote_time()
-        expt_completion = self._remote.expect_completion_time(job_id, work_dir)
-
         # If something wrong happens, we don't crash the script
         # but make this job pending forever.
-        if remote_current == "" or expt_completion == "":
+        if remote_time == datetime.min or not log_tail:
             self.__logger.info("failed to obtain completion time.")
             return sys.maxsize
 
-        remote_curr_date = datetime.strptime(
-            remote_current, "%a %b %d %H:%M:%S EST %Y")
-        expt_comp_date = datetime.strptime(
-            expt_completion, "%a %b %d %H:%M:%S %Y")
+        fields = log_tail[-1].split()
+        if not fields or fields[0] != "imb":
+            self.__logger.info("remote job may not be ready when querying"
+                               " expect completion time")
+            return sys.maxsize
+
+        try:
+            expt_comp_date = datetime.strptime(" ".join(fields[-5:]),
+                                               "%a %b %d %H:%M:%S %Y")
+        except ValueError:
+            self.__logger.info("failed to parse completion time.")
+            return sys.maxsize
+
+        return int((expt_comp_date - remote_time).total_seconds())
 
-        return int((expt_comp_date - remote_curr_date).total_seconds())
+    async def __get_job_stats(self):
+        """put remote job status onto the internal data structure
 
-    def __get_job_stats(self):
-        """put remote job status onto the internal data structure"""
-        job_stats = self._remote.job_status(self._data["userId"])
+        All remotes are polled at the same time. The polls do not wait for
+        a slot, so a burst of submissions cannot hold back the polling.
+
+        A section that was submitted before the polls started but is not
+        in the queue of its remote was rejected or failed right away; its
+        job is due again.
+        """
+        started = asyncio.get_running_loop().time()
+        # wait for every poll, also when the cycle is cancelled, so that
+        # none of them is left behind with a remote command in flight.
+        polls = await asyncio.gather(
+            *[self.__poll_remote(server, remote)
+              for (server, remote) in self._remotes.items()],
+            return_exceptions=True)
+        for poll in polls:
+            if isinstance(poll, BaseException):
+                raise poll
+        # only a poll whose squeue calls succeeded tells that a section
+        # is not queued; a failed one has no pending counts and says
+        # nothing, an empty queue may be a slurmctld timeout.
+        polled = {server for (server, poll) in zip(self._remotes, polls)
+                  if poll.pending is not None}
+
+        for (job_name, submitted) in list(self.__unseen.items()):
+            item = self.__job_table[self.__ids[job_name]]
+            if submitted < started and item.get("remote") in polled:
+                self.__logger.warning(
+                    "job %s [%s] is not in the queue of %s after its "
+                    "submission, submitting it again", job_name,
+                    item["jobId"], item["remote"])
+                del self.__unseen[job_name]
+                item["expCompletion"] = 0
+                self.__store.record(item, "not_queued")
+
+    async def __poll_remote(self, server, remote):
+        """put the job status of a single remote onto the internal data
+        structure
+
+        The status, the remote time and the log tails of all running jobs
+        on the remote come from a single remote poll. A job that is not
+        placed yet is placed on the remote it is found running on.
+
+        Args:
+            server: the remote server.
+            remote: Remote, the remote of the server.
 
-        for job in job_stats:
+        Returns:
+            PollResult, of the remote.
+        """
+        poll = await remote.poll_async(
+            self._user(server),
+            {item["name"]: item["directory"]
+             for item in self.__job_table if item.get("directory") and
+             not self.__placed_elsewhere(item, server)})
+        self.__pending[server] = poll.pending
+
+        for job in poll.job_status:
             if job[JOB_NAME] in self.__ids:
                 item = self.__job_table[self.__ids[job[JOB_NAME]]]
+                if self.__placed_elsewhere(item, server):
+                    # a job of the same name on another remote.
+                    continue
+                known = (item["jobId"], item["makeup"], item.get("remote"))
+                item["remote"] = server
+                self.__unseen.pop(job[JOB_NAME], None)
+                event = "polled"
                 item["jobId"] = job[JOB_ID]
                 if job[JOB_STAT] == "R":
                     item["expCompletion"] = self.__time_to_completion(
-                        job[JOB_ID], item["directory"])
+                        item, poll.remote_time,
+                        poll.log_tails.get(job[JOB_NAME]))
 
                     # If expectation time > job time limit, cancel it
                     time_limit = _parse_time_to_second(item["timeLimit"])
@@ -227,7 +351,8 @@ class AutoSubmitter(SubmitterBase):
                         self.__logger.error(
                             "cancel job [%s] due to slow node [%s].",
                             job[JOB_NAME], job[JOB_MACHINE])
-                        self._remote.cancel_job(item["jobId"])
+                        async with self.__remote_slots:
+                            await remote.cancel_job_async(item["jobId"])
 
                         self.__logger.info("update exclusion lists with %s",
                                            job[JOB_MACHINE])
@@ -235,7 +360,7 @@ class AutoSubmitter(SubmitterBase):
 
                         item["expCompletion"] = 0
                         item["makeup"] = True
-                        self.__dump_job_stats()
+                        event = "cancelled"
 
                     else:
                         item["makeup"] = False
@@ -243,12 +368,88 @@ class AutoSubmitter(SubmitterBase):
                 else:
                     item["expCompletion"] = sys.maxsize
 
-    def __maybe_order_job_submission(self):
-        """Scan the job table. Order a task if a job is ready to submit."""
+                # only changes are recorded, not every poll.
+                if event != "polled" or (item["jobId"], item["makeup"],
+                                         item["remote"]) != known:
+                    self.__store.record(item, event)
+
+        return poll
+
+    def __placed_elsewhere(self, item, server):
+        """Returns: Boolean, the job is placed on another managed remote"""
+        return item.get("remote") in self._remotes and \
+            item["remote"] != server
+
+    def __remote_loads(self):
+        """Returns: dict, remote server -> RemoteLoad, of every remote"""
+        assigned = Counter(item.get("remote") for item in self.__job_table)
+        return {server: RemoteLoad(
+            self.__pending.get(server), assigned[server],
+            float(self._remote_settings(server).get("capacity", 1.0)))
+            for server in self._remotes}
+
+    def __place(self, job):
+        """Pick the remote the next section of a job is submitted to.
+
+        Args:
+            job: dict type, the job in the job table.
+
+        Returns:
+            The remote server.
+        """
+        server = job.get("remote")
+        if server in self._remotes and not self.__policy.per_section:
+            return server
+        if len(self._remotes) == 1:
+            return next(iter(self._remotes))
+
+        server = self.__policy.place(job, self.__remote_loads())
+        pending = self.__pending.get(server)
+        if pending is not None:
+            # the job waits in the queue from now on, so the jobs placed
+            # before the next poll see it.
+            pending[job["partition"]] = pending.get(job["partition"], 0) + 1
+        return server
+
+    def __maybe_order_job_submission(self, now):
+        """Scan the job table. Give a job that is ready to submit a
+        deadline, take it away from a job that is not ready any more.
+
+        Args:
+            now: float, the current loop time.
+        """
         for job in self.__job_table:
+            if job["name"] in self.__submitting:
+                continue
             if job["expCompletion"] <= AutoSubmitter.CHECK_EVERY_N:
-                self.__executor.submit(self.__auto_resubmit_task, job,
-                                       self.__logger)
+                self.__deadlines.schedule(
+                    job["name"],
+                    now + job["expCompletion"] + AutoSubmitter.GAP_TIME)
+            else:
+                self.__deadlines.cancel(job["name"])
+
+    def __poll_interval(self, now):
+        """Seconds until the next poll, adapted to the nearest event.
+
+        Args:
+            now: float, the current loop time.
+
+        Returns:
+            Float type, between MIN_CHECK_EVERY_N and CHECK_EVERY_N.
+        """
+        interval = AutoSubmitter.CHECK_EVERY_N
+        next_deadline = self.__deadlines.next_deadline()
+        if next_deadline is not None:
+            # see the new section in the queue right after its submission.
+            interval = min(interval,
+                           next_deadline - now + AutoSubmitter.GAP_TIME)
+        for job in self.__job_table:
+            if AutoSubmitter.CHECK_EVERY_N < job["expCompletion"] < \
+                    sys.maxsize:
+                # poll when the job gets close enough to be scheduled.
+                interval = min(interval, job["expCompletion"] -
+                               AutoSubmitter.CHECK_EVERY_N)
+        return max(AutoSubmitter.MIN_CHECK_EVERY_N, interval)
 
     def __initialize(self):
         """Initialize the internal job table.
@@ -261,6 +462,21 @@ class AutoSubmitter(SubmitterBase):
 
         if not self.__checkin_items():
             return False
+
+        self.__logger.info("recovering job states from %s",
+                           self.__store.path)
+        for job_name in self.__store.recover(self.__job_table):
+            self.__logger.warning(
+                "stopped while submitting job %s, its section may already "
+                "be on remote %s", job_name,
+                self.__job_table[self.__ids[job_name]].get("remote"))
+        for job in self.__job_table:
+            if job.get("remote", next(iter(self._remotes))) not in \
+                    self._remotes:
+                self.__logger.warning(
+                    "job %s was placed on %s, which is not managed any more",
+                    job["name"], job["remote"])
+        self.__store.compact()
         return True
 
     def _log_start(self):
@@ -268,56 +484,105 @@ class AutoSubmitter(SubmitterBase):
         self.__logger.info("%s engine starts.", self.__class__.__name__)
         self.__logger.info("managing %s", self._data["context"])
         self.__logger.info("User: %s", self._data["userId"])
+        self.__logger.info("Remotes: %s", ", ".join(self._remotes))
 
-    def __update_job_stats_task(self):
-        """Update job stats by accessing remote machine every n seconds.
-
-        This function defines an async callback as a task.
-        """
-        self.__logger.info("update job status from remote")
-        self.__get_job_stats()
-        self.__maybe_order_job_submission()
-        sleep(AutoSubmitter.CHECK_EVERY_N)
-
-    def __dump_job_stats(self):
-        """Output the current job status as a json file."""
-
-        self.__lock.acquire()
-        with open("jobs_current.json", 'w') as dump_file:
-            dump(self._data, dump_file, indent=4, sort_keys=True)
-        self.__logger.info("dump current job stats to json")
-        self.__lock.release()
-
-    def __auto_resubmit_task(self, job, logger):
-        """Resubmit a new job after some delays
+    async def __auto_resubmit_task(self, job):
+        """Submit the next section of a job whose deadline has passed.
 
         Args:
-            job_name: the job we want to submit
+            job: the job we want to submit
         """
-        # make a local batch file
-        sleep(job["expCompletion"] + AutoSubmitter.GAP_TIME)
-
         job_name = job["name"]
-        logger.info("submitting job %s.", job_name)
-
-        file_name = job_name + '.sh'
-        batch_file_factory(job, file_name)
-
-        # the job id has index 3 after split
-        new_job_id = self._remote.copy_to_remote_and_submit(
-            file_name, job["directory"]).split()[3]
-        logger.info("remote returns new job id: %s", new_job_id)
-
-        if new_job_id == "":
-            logger.error("job submission failed [%s]", job_name)
-        else:
-            logger.info("job submitted: %s section_id: %d job_id: %s",
-                        job_name, job["sectionNum"], new_job_id)
-
-        job["jobId"] = new_job_id
-        job["sectionNum"] += 1
-
-        self.__dump_job_stats()
+        self.__submitting.add(job_name)
+        try:
+            self.__logger.info("submitting job %s.", job_name)
+
+            # make a local batch file
+            file_name = job_name + '.sh'
+            batch_file_factory(job, file_name)
+
+            previous = job.get("remote")
+            job["remote"] = self.__place(job)
+            self.__store.record(job, "submitting")
+            async with self.__remote_slots:
+                message = await self._remotes[
+                    job["remote"]].copy_to_remote_and_submit_async(
+                        file_name, job["directory"])
+
+            # "Submitted batch job ID", the job id has index 3 after split
+            fields = message.split()
+            new_job_id = fields[3] if len(fields) > 3 else ""
+            self.__logger.info("remote returns new job id: %s", new_job_id)
+
+            if new_job_id == "":
+                # the job stays due and is scheduled again after next poll.
+                self.__logger.error("job submission failed [%s] on %s",
+                                    job_name, job["remote"])
+                # the job may be placed again next time.
+                if previous is None:
+                    del job["remote"]
+                else:
+                    job["remote"] = previous
+                self.__store.record(job, "submit_failed")
+                return
+
+            self.__logger.info(
+                "job submitted: %s section_id: %d job_id: %s remote: %s",
+                job_name, job["sectionNum"], new_job_id, job["remote"])
+            job["jobId"] = new_job_id
+            job["sectionNum"] += 1
+            # queued now, the next poll tells when it completes.
+            job["expCompletion"] = sys.maxsize
+            self.__unseen[job_name] = asyncio.get_running_loop().time()
+
+            self.__store.record(job, "submitted")
+        except Exception:  # pylint: disable=broad-except
+            self.__logger.exception("submitting job %s failed", job_name)
+        finally:
+            self.__submitting.discard(job_name)
+
+    async def __schedule(self):
+        """The event loop of the submitter.
+
+        Polls the remote, starts a submission task for every job that is
+        due and sleeps until the next poll or deadline, whichever is first.
+        """
+        loop = asyncio.get_running_loop()
+        self.__remote_slots = asyncio.Semaphore(
+            AutoSubmitter.NUM_REMOTE_COMMANDS)
+        tasks = set()
+
+        next_poll = loop.time()
+        try:
+            while True:
+                now = loop.time()
+                if now >= next_poll:
+                    self.__logger.info("update job status from remote")
+                    await self.__get_job_stats()
+                    now = loop.time()
+                    self.__maybe_order_job_submission(now)
+                    next_poll = now + self.__poll_interval(now)
+                    self.__logger.info(
+                        "%d jobs scheduled, next poll in %d s",
+                        len(self.__deadlines), next_poll - now)
+
+                for job_name in self.__deadlines.pop_due(now):
+                    task = loop.create_task(self.__auto_resubmit_task(
+                        self.__job_table[self.__ids[job_name]]))
+                    # keep a reference until the task is done.
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                wake_up = next_poll
+                next_deadline = self.__deadlines.next_deadline()
+                if next_deadline is not None:
+                    wake_up = min(wake_up, next_deadline)
+                await asyncio.sleep(max(0.0, wake_up - loop.time()))
+        finally:
+            # stop the submissions in flight before the loop goes away.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     def run(self):
         """Run the scheduler to manage all jobs. The main thread
@@ -330,7 +595,11 @@ class AutoSubmitter(SubmitterBase):
             self.__logger.error("failed to initialize all jobs.")
             return
 
-        while True:
-            self.__update_job_stats_task()
+        try:
+            asyncio.run(self.__schedule())
+        finally:
+            for remote in self._remotes.values():
+                remote.close()
+            self.__store.close()
 
         self.__logger.info("terminating.")
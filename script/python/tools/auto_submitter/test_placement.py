@@ -0,0 +1,56 @@
+"""Tests of the placement policies.
+
+Run with: python -m pytest test_placement.py
+"""
+
+import unittest
+
+from placement import RemoteLoad
+from placement import RoundRobinPolicy
+from placement import ShortestQueuePolicy
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+JOB = {"name": "wt", "partition": "gpu"}
+
+
+class ShortestQueuePolicyTest(unittest.TestCase):
+    """The remote with the shortest expected wait is chosen."""
+
+    def setUp(self):
+        self.policy = ShortestQueuePolicy()
+
+    def test_shorter_queue(self):
+        self.assertEqual(self.policy.place(JOB, {
+            "alpha": RemoteLoad({"gpu": 5, "shared": 0}, 0, 1.0),
+            "beta": RemoteLoad({"gpu": 1, "shared": 9}, 4, 1.0)}), "beta")
+
+    def test_capacity(self):
+        self.assertEqual(self.policy.place(JOB, {
+            "alpha": RemoteLoad({"gpu": 5}, 0, 1.0),
+            "beta": RemoteLoad({"gpu": 9}, 0, 2.0)}), "beta")
+
+    def test_unknown_load(self):
+        self.assertEqual(self.policy.place(JOB, {
+            "alpha": RemoteLoad(None, 0, 1.0),
+            "beta": RemoteLoad({"gpu": 50}, 3, 1.0)}), "beta")
+
+    def test_tie_goes_to_fewer_jobs(self):
+        self.assertEqual(self.policy.place(JOB, {
+            "alpha": RemoteLoad({}, 2, 1.0),
+            "beta": RemoteLoad({}, 1, 1.0)}), "beta")
+
+
+class RoundRobinPolicyTest(unittest.TestCase):
+    """Remotes are chosen in turn."""
+
+    def test_in_turn(self):
+        policy = RoundRobinPolicy()
+        loads = {"beta": RemoteLoad({}, 0, 1.0),
+                 "alpha": RemoteLoad({}, 0, 1.0)}
+        self.assertEqual([policy.place(JOB, loads) for _ in range(3)],
+                         ["alpha", "beta", "alpha"])
+
+
+if __name__ == "__main__":
+    unittest.main()
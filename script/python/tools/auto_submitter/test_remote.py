@@ -0,0 +1,142 @@
+"""Tests of SlurmRemote polling against local SLURM stand-ins.
+
+Run with: python -m pytest test_remote.py
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from datetime import datetime
+from unittest import mock
+
+import connection_pool
+
+from connection_pool import ConnectionPool
+from fake_slurm import FakeSlurm
+from remote import SlurmRemote
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+FINISH_LINE = "imb F  0% step 100, will finish Mon Oct 17 12:00:00 2016"
+
+
+class PollTest(unittest.TestCase):
+    """A single poll returns the queue, the time and the log tails."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="fake_slurm_")
+        self.slurm = FakeSlurm(os.path.join(self.directory, "fake"))
+        self.slurm.set_queue("alpha", ["101 gpu wt me R 1:00 1 node7",
+                                       "102 gpu mut me PD 0:00 1 (None)"])
+        self.slurm.set_pending("alpha", ["gpu", "gpu,shared", "shared"])
+        self.write_log("scratch/wt/slurm-101.out")
+        self.remote = SlurmRemote("alpha", ssh=self.slurm.ssh,
+                                  scp=self.slurm.scp)
+
+    def tearDown(self):
+        self.remote.close()
+        shutil.rmtree(self.directory)
+
+    def write_log(self, path):
+        """Write a Gromacs log in the home of the remote."""
+        path = os.path.join(self.slurm.home("alpha"), path)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w") as log:
+            log.write("step 99\n" + FINISH_LINE + "\n")
+
+    def test_poll(self):
+        folder = os.path.join(self.slurm.home("alpha"), "scratch/wt")
+        poll = self.remote.poll("me", {"wt": folder, "mut": folder})
+        self.assertEqual([job[2] for job in poll.job_status], ["wt", "mut"])
+        self.assertNotEqual(poll.remote_time, datetime.min)
+        # only running jobs are tailed.
+        self.assertEqual(poll.log_tails, {"wt": [FINISH_LINE]})
+        self.assertEqual(poll.pending, {"gpu": 2, "shared": 2})
+
+    def test_poll_home_relative_folder(self):
+        poll = self.remote.poll("me", {"wt": "~/scratch/wt"})
+        self.assertEqual(poll.log_tails, {"wt": [FINISH_LINE]})
+
+    def test_poll_async(self):
+        poll = asyncio.run(self.remote.poll_async("me",
+                                                  {"wt": "~/scratch/wt"}))
+        self.assertEqual(poll.log_tails, {"wt": [FINISH_LINE]})
+
+    def test_squeue_failure(self):
+        self.slurm.fail_squeue("alpha", 1)
+        poll = self.remote.poll("me", {"wt": "~/scratch/wt"})
+        # a failed squeue is not an empty queue.
+        self.assertEqual(poll.job_status, [])
+        self.assertEqual(poll.log_tails, {})
+        self.assertIsNone(poll.pending)
+
+        poll = self.remote.poll("me", {"wt": "~/scratch/wt"})
+        self.assertEqual(len(poll.job_status), 2)
+        self.assertEqual(poll.pending, {"gpu": 2, "shared": 2})
+
+    def test_pending_failure(self):
+        self.slurm.fail_squeue("alpha", 1, pending=True)
+        poll = self.remote.poll("me", {"wt": "~/scratch/wt"})
+        self.assertEqual(len(poll.job_status), 2)
+        self.assertEqual(poll.log_tails, {"wt": [FINISH_LINE]})
+        self.assertIsNone(poll.pending)
+
+    def test_poll_failure(self):
+        self.slurm.set_down("alpha")
+        poll = self.remote.poll("me", {"wt": "~/scratch/wt"})
+        self.assertEqual(poll.job_status, [])
+        self.assertEqual(poll.remote_time, datetime.min)
+        self.assertIsNone(poll.pending)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """Masters are restarted when they die and backed off when they cannot
+    start."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="fake_slurm_")
+        self.slurm = FakeSlurm(os.path.join(self.directory, "fake"))
+        self.slurm.home("alpha")
+        self.pool = ConnectionPool("alpha", 1, ssh=self.slurm.ssh,
+                                   control_dir=self.directory)
+        self.socket = os.path.join(self.directory, "0.sock")
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def test_dead_master_is_restarted(self):
+        options = self.pool.options()
+        self.assertNotEqual(options, [])
+        self.assertTrue(os.path.exists(self.socket))
+
+        os.remove(self.socket)
+        # a command failed to connect.
+        self.pool.invalidate()
+        self.assertEqual(self.pool.options(), options)
+        self.assertTrue(os.path.exists(self.socket))
+        self.assertEqual(self.slurm.ssh_calls("alpha", "master"), 2)
+
+    def test_server_down_and_up(self):
+        self.slurm.set_down("alpha")
+        self.assertEqual(self.pool.options(), [])
+        # no new attempt before HEALTH_CHECK_EVERY, not even after a failed
+        # direct connection.
+        self.pool.invalidate()
+        self.assertEqual(self.pool.options(), [])
+        self.assertEqual(self.slurm.ssh_calls("alpha", "master"), 1)
+
+        self.slurm.set_down("alpha", False)
+        later = time.time() + ConnectionPool.HEALTH_CHECK_EVERY + 1
+        with mock.patch.object(connection_pool, "time", return_value=later):
+            self.assertNotEqual(self.pool.options(), [])
+        self.assertEqual(self.slurm.ssh_calls("alpha", "master"), 2)
+        self.assertTrue(os.path.exists(self.socket))
+
+
+if __name__ == "__main__":
+    unittest.main()
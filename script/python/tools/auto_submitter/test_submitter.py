@@ -0,0 +1,204 @@
+"""Tests of AutoSubmitter against local SLURM stand-ins.
+
+Run with: python -m pytest test_submitter.py
+"""
+
+import asyncio
+import functools
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import remote
+import submitter
+
+from fake_slurm import FakeSlurm
+from job_store import JobStore
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+# Seconds every scheduler run lasts.
+RUN_SECONDS = 4
+
+
+def _job(name, **fields):
+    """Returns: dict, a Gromacs job of the job table"""
+    job = {"name": name,
+           "kind": "Gromacs",
+           "binaryPath": "~/opt/bin",
+           "directory": "~/scratch/%s" % name,
+           "timeLimit": "24:0:0",
+           "numOfNodes": 1,
+           "numOfProcs": 4,
+           "numOfThrs": 6,
+           "partition": "shared",
+           "nameBase": "md",
+           "sectionNum": 1,
+           "mdp": "production.mdp",
+           "index": "index.ndx",
+           "continuation": True}
+    job.update(fields)
+    return job
+
+
+class AutoSubmitterTestBase(unittest.TestCase):
+    """Runs an AutoSubmitter for RUN_SECONDS against fake servers."""
+
+    SERVERS = ["alpha"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="fake_slurm_")
+        self.slurm = FakeSlurm(os.path.join(self.directory, "fake"))
+        for server in self.SERVERS:
+            self.slurm.set_queue(server, [])
+        self.cwd = os.getcwd()
+        # batch files and the state database go to the working directory.
+        os.chdir(self.directory)
+
+        patches = [
+            mock.patch.object(submitter, "SlurmRemote", functools.partial(
+                remote.SlurmRemote, ssh=self.slurm.ssh, scp=self.slurm.scp)),
+            mock.patch.multiple(submitter.AutoSubmitter, CHECK_EVERY_N=1,
+                                MIN_CHECK_EVERY_N=0.2, GAP_TIME=0.1)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def add_job_folder(self, server, job):
+        """Create the working directory of a job on a server."""
+        os.makedirs(os.path.join(self.slurm.home(server),
+                                 job["directory"][len("~/"):]))
+
+    def run_submitter(self, jobs, policy=None):
+        """Run an AutoSubmitter on the jobs for RUN_SECONDS.
+
+        Returns:
+            list of dict, the job table after the run.
+        """
+        jobs_data = {"context": "test", "userId": "me",
+                     "data": {"title": "test", "items": jobs}}
+        auto_submitter = submitter.AutoSubmitter(
+            jobs_data, self.SERVERS, "state.db", policy)
+        # run() never returns, so drive its steps for a limited time.
+        self.assertTrue(auto_submitter._AutoSubmitter__initialize())
+
+        async def schedule():
+            try:
+                await asyncio.wait_for(
+                    auto_submitter._AutoSubmitter__schedule(), RUN_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+        try:
+            asyncio.run(schedule())
+        finally:
+            for server_remote in auto_submitter._remotes.values():
+                server_remote.close()
+            auto_submitter._AutoSubmitter__store.close()
+        return jobs_data["data"]["items"]
+
+    def stored_state(self, name):
+        """Returns: dict, the recorded state of a job"""
+        store = JobStore("state.db", read_only=True)
+        try:
+            return store.load()[name][0]
+        finally:
+            store.close()
+
+
+class SubmissionTest(AutoSubmitterTestBase):
+    """Sections are submitted once, and again if they get lost."""
+
+    def setUp(self):
+        super(SubmissionTest, self).setUp()
+        self.job = _job("wt")
+        self.add_job_folder("alpha", self.job)
+
+    def test_submitted_once(self):
+        (job,) = self.run_submitter([self.job])
+        self.assertEqual(self.slurm.submitted(), [
+            ("alpha", os.path.join(self.slurm.home("alpha"),
+                                   "scratch/wt/wt.sh"))])
+        self.assertEqual(job["sectionNum"], 2)
+        self.assertEqual(job["jobId"], "1")
+
+    def test_lost_section_is_submitted_again(self):
+        self.slurm.set_lost("alpha")
+        with self.assertLogs("auto_submitter.submitter.AutoSubmitter",
+                             "WARNING") as logs:
+            (job,) = self.run_submitter([self.job])
+        self.assertGreaterEqual(len(self.slurm.submitted()), 2)
+        self.assertGreaterEqual(job["sectionNum"], 3)
+        self.assertTrue(any("not in the queue" in line
+                            for line in logs.output))
+
+    def test_squeue_failure_after_submission(self):
+        # two polls fail right after the first section is submitted.
+        self.slurm.fail_squeue("alpha", 4, after_sbatch=True)
+        (job,) = self.run_submitter([self.job])
+        self.assertEqual(len(self.slurm.submitted()), 1)
+        self.assertEqual(job["sectionNum"], 2)
+        self.assertEqual(len(self.slurm.queue("alpha")), 1)
+
+
+class PlacementTest(AutoSubmitterTestBase):
+    """Jobs are placed on one of several remotes."""
+
+    SERVERS = ["alpha", "beta"]
+
+    def setUp(self):
+        super(PlacementTest, self).setUp()
+        self.slurm.set_pending("alpha", ["shared"] * 5)
+        self.slurm.set_pending("beta", ["shared"])
+
+    def submitted_to(self, name):
+        """Returns: list of string, the servers a job was submitted to"""
+        return [server for (server, path) in self.slurm.submitted()
+                if os.path.basename(path) == name + ".sh"]
+
+    def test_shortest_queue(self):
+        job = _job("wt")
+        for server in self.SERVERS:
+            self.add_job_folder(server, job)
+        (job,) = self.run_submitter([job])
+        self.assertEqual(self.submitted_to("wt"), ["beta"])
+        self.assertEqual(job["remote"], "beta")
+        self.assertEqual(self.stored_state("wt")["remote"], "beta")
+
+    def test_pinned_remote(self):
+        job = _job("wt", remote="alpha")
+        self.add_job_folder("alpha", job)
+        (job,) = self.run_submitter([job])
+        self.assertEqual(self.submitted_to("wt"), ["alpha"])
+        self.assertEqual(job["remote"], "alpha")
+
+    def test_running_job_is_adopted(self):
+        job = _job("wt")
+        self.add_job_folder("alpha", job)
+        self.slurm.set_queue("alpha", ["101 shared wt me R 1:00 1 node7"])
+        # a section that runs for another hour.
+        finish = (datetime.now() + timedelta(hours=1)).strftime(
+            "%a %b %d %H:%M:%S %Y")
+        with open(os.path.join(self.slurm.home("alpha"),
+                               "scratch/wt/slurm-101.out"), "w") as log:
+            log.write("imb F  0%% step 100, will finish %s\n" % finish)
+
+        (job,) = self.run_submitter([job])
+        self.assertEqual(self.slurm.submitted(), [])
+        self.assertEqual(self.slurm.cancelled(), [])
+        self.assertEqual(job["remote"], "alpha")
+        self.assertEqual(job["jobId"], "101")
+        self.assertGreater(job["expCompletion"], 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shared trajectory reader layer of the analysis scripts.
+
+Opening a trajectory is dominated by work that only depends on the files:
+
+    xtc/trr frame offsets   found by scanning the whole file
+    topology                parsed from the .gro/.pdb file
+
+Both are kept in a local cache directory, under a key made of the absolute
+path, the mtime and the size of the file, so a file that changes gets new
+entries and stale ones are simply never looked up again. Pickled topologies
+are also keyed by the MDAnalysis version and TOPOLOGY_FORMAT, since they
+only load with the classes that wrote them; an entry that fails to load
+anyway is parsed again. Frame offsets live
+there instead of next to the trajectory, which also works for read-only
+campaign directories.
+
+    universe = open_universe("sys.gro", ["md_1.xtc", "md_2.xtc"])
+    reader = open_reader("md_1.xtc")
+
+FrameCache keeps an LRU of recently decoded coordinates for code that
+revisits frames. frame_sizes() tells how many bytes every frame takes on
+disk.
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+
+import MDAnalysis
+import numpy as np
+from MDAnalysis import Universe
+from MDAnalysis.coordinates.core import reader
+from MDAnalysis.coordinates.TRR import TRRReader
+from MDAnalysis.coordinates.XTC import XTCReader
+
+__author__ = 'davislong198833@gmail.com (Yunlong Liu)'
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fiesta3")
+
+OFFSETS_FILE = "%s.offsets.npy"
+TOPOLOGY_FILE = "%s.topology.pkl"
+
+# Version of the pickled topology entries, bump it when they change.
+TOPOLOGY_FORMAT = 1
+
+# Default memory budget of a FrameCache.
+_FRAME_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def file_key(path, *versions):
+    """Key of a file's current content.
+
+    Args:
+        path: string, file name
+        versions: strings the entry also depends on, e.g. library versions
+
+    Returns:
+        string, sha1 hex digest of the absolute path, mtime, size and
+        versions
+    """
+    stat = os.stat(path)
+    key = "\n".join(["%s\n%d\n%d" % (os.path.abspath(path),
+                                     stat.st_mtime_ns, stat.st_size)] +
+                    list(versions))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _atomic_save(file_name, save):
+    """Write a cache entry through a temporary file.
+
+    Args:
+        file_name: string, the entry
+        save: function, file object -> None, writes the content
+    """
+    directory = os.path.dirname(file_name)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_name = "%s.%d.tmp" % (file_name, os.getpid())
+    with open(temp_name, 'wb') as output:
+        save(output)
+    os.rename(temp_name, file_name)
+
+
+class _CachedOffsetsMixin(object):
+    """Loads xdr frame offsets from the cache instead of scanning the file."""
+
+    def __init__(self, filename, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+        """Open a trajectory.
+
+        Args:
+            filename: string, trajectory file name
+            cache_dir: string, the cache directory
+            kwargs: see the MDAnalysis reader
+        """
+        self._cache_dir = cache_dir
+        super(_CachedOffsetsMixin, self).__init__(filename, **kwargs)
+
+    def _load_offsets(self):
+        """Look the offsets up in the cache, scan and store them if absent."""
+        cache_file = os.path.join(self._cache_dir,
+                                  OFFSETS_FILE % file_key(self.filename))
+        if os.path.exists(cache_file):
+            self._xdr.set_offsets(np.load(cache_file))
+            return
+
+        offsets = self._xdr.offsets
+        _atomic_save(cache_file, lambda output: np.save(output, offsets))
+
+
+class CachedXTCReader(_CachedOffsetsMixin, XTCReader):
+    """XTCReader with cached frame offsets."""
+    pass
+
+
+class CachedTRRReader(_CachedOffsetsMixin, TRRReader):
+    """TRRReader with cached frame offsets."""
+    pass
+
+
+_CACHED_READERS = {".xtc": CachedXTCReader, ".trr": CachedTRRReader}
+
+
+def _reader_format(trajectory):
+    """Returns: the cached reader class of a file, None for other formats"""
+    return _CACHED_READERS.get(os.path.splitext(trajectory)[1].lower())
+
+
+def open_reader(trajectory, cache_dir=DEFAULT_CACHE_DIR):
+    """Open a single trajectory file without a topology.
+
+    Args:
+        trajectory: string, trajectory file name
+        cache_dir: string, the cache directory, None disables the cache
+
+    Returns:
+        the MDAnalysis reader
+    """
+    reader_format = _reader_format(trajectory)
+    if cache_dir is None or reader_format is None:
+        return reader(trajectory)
+    return reader_format(trajectory, cache_dir=cache_dir)
+
+
+def load_topology(topology, cache_dir=DEFAULT_CACHE_DIR):
+    """Parse a topology file, or load the result of an earlier parse.
+
+    Args:
+        topology: string, topology file name
+        cache_dir: string, the cache directory
+
+    Returns:
+        MDAnalysis Topology
+    """
+    cache_file = os.path.join(cache_dir, TOPOLOGY_FILE % file_key(
+        topology, MDAnalysis.__version__, str(TOPOLOGY_FORMAT)))
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as input_file:
+                return pickle.load(input_file)
+        except (pickle.UnpicklingError, EOFError, AttributeError,
+                ImportError, IndexError, TypeError, ValueError):
+            # truncated or written by other classes, parse again.
+            pass
+
+    # Universe does not expose the parsed Topology publicly.
+    parsed = Universe(topology)._topology
+    _atomic_save(cache_file, lambda output: pickle.dump(
+        parsed, output, pickle.HIGHEST_PROTOCOL))
+    return parsed
+
+
+def open_universe(topology, trajectory, cache_dir=DEFAULT_CACHE_DIR):
+    """Open a topology with its trajectory through the cache.
+
+    Args:
+        topology: string, topology file name
+        trajectory: string or list of string, trajectory file(s) in frame
+            order
+        cache_dir: string, the cache directory, None disables the cache
+
+    Returns:
+        Universe, its filename is the topology file name as usual
+    """
+    if cache_dir is None:
+        return Universe(topology, trajectory)
+
+    parsed = load_topology(topology, cache_dir)
+    trajectories = [trajectory] if isinstance(trajectory, str) else \
+        list(trajectory)
+    formats = [_reader_format(name) for name in trajectories]
+    if not all(formats):
+        # other formats get no cache_dir, only the topology is cached.
+        universe = Universe(parsed, trajectory)
+    elif len(trajectories) == 1:
+        universe = Universe(parsed, trajectories[0], format=formats[0],
+                            cache_dir=cache_dir)
+    else:
+        universe = Universe(parsed, list(zip(trajectories, formats)),
+                            cache_dir=cache_dir)
+    universe.filename = topology
+    return universe
+
+
+def frame_sizes(trajectory):
+    """Size of every frame in the trajectory files.
+
+    xtc/trr frames are measured through the frame offsets, other formats
+    get the mean frame size of their file.
+
+    Args:
+        trajectory: the trajectory reader, a chain of several files too
+
+    Returns:
+        numpy-array [n_frames] of int, bytes of every frame
+    """
+    sizes = []
+    for file_reader in getattr(trajectory, "readers", [trajectory]):
+        file_size = os.path.getsize(file_reader.filename)
+        xdr = getattr(file_reader, "_xdr", None)
+        if xdr is not None:
+            sizes.append(np.diff(np.append(xdr.offsets, file_size)))
+        else:
+            sizes.append(np.full(file_reader.n_frames,
+                                 file_size // max(file_reader.n_frames, 1)))
+    return np.concatenate(sizes).astype(np.int64)
+
+
+class FrameCache(object):
+    """An LRU of decoded coordinates of atom selections, frame by frame.
+
+    Frames are cached one by one rather than in fixed blocks, so a strided
+    read only decodes the frames it asks for, and overlapping reads decode
+    each frame once.
+    """
+
+    def __init__(self, max_bytes=_FRAME_CACHE_BYTES):
+        """Create an empty cache.
+
+        Args:
+            max_bytes: int, memory budget of the cached coordinates
+        """
+        self._frames = collections.OrderedDict()
+        self._max_bytes = max_bytes
+        self._bytes = 0
+
+    def positions(self, trajectory, frames, indices):
+        """Read the coordinates of a selection in some frames.
+
+        Args:
+            trajectory: the trajectory reader
+            frames: numpy-array [int], frame indices, increasing
+            indices: numpy-array [int], atom indices of the selection
+
+        Returns:
+            numpy-array [n_frames, n_atoms, 3]
+        """
+        source = (file_key(trajectory.filename),
+                  hashlib.sha1(np.ascontiguousarray(indices)).hexdigest())
+        block = np.empty((len(frames), len(indices), 3))
+
+        missing = []
+        for (row, frame) in enumerate(frames):
+            key = source + (int(frame),)
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                block[row] = self._frames[key]
+            else:
+                missing.append(row)
+
+        missing_frames = np.asarray(frames)[missing]
+        for (row, time_step) in zip(missing, trajectory[missing_frames]):
+            block[row] = time_step.positions[indices]
+            self._add(source + (int(frames[row]),), block[row].copy())
+        return block
+
+    def _add(self, key, positions):
+        """Insert one frame, evicting the least recently used ones."""
+        self._frames[key] = positions
+        self._bytes += positions.nbytes
+        while self._bytes > self._max_bytes and len(self._frames) > 1:
+            (_, evicted) = self._frames.popitem(last=False)
+            self._bytes -= evicted.nbytes
@@ -4,51 +4,365 @@
 """
 testing whether a gromacs traj file removes pbc successfully.
 Usage:
-    python test_pbc.py ref.gro *.xtc
+    python validate_pbc.py ref.gro *.xtc [--workers N] [--mode MODE]
+
+Every frame is superposed onto the CA atoms of the reference structure; a
+file is invalid as soon as one frame's RMSD exceeds the threshold, which is
+what a molecule broken across the periodic boundary looks like.
+
+The reference is parsed once. Trajectory files are read without a topology,
+with frame offsets from the shared reader cache, and checked concurrently in
+a process pool, the RMSD of a block of frames being computed at once with a
+batched Kabsch superposition.
+
+Modes:
+    full    the RMSD of every frame (default)
+    screen  the RMSD of every k-th frame plus the first and last one; only
+            the frames between a failing sample and its neighbours are then
+            scanned in full. Breaks that start and end between two passing
+            samples are not seen.
+    jumps   no superposition, a frame fails if any CA moved more than the
+            jump threshold since the previous frame
+
+Every file gets a report with pass/fail, the offending frame ranges and
+the time spent, optionally written to a json file with --report.
 """
 
-import sys
+import argparse
+import json
+import multiprocessing
+import time
 
+import numpy as np
 from MDAnalysis import Universe
-from MDAnalysis.analysis.align import alignto
+
+from trajectory_cache import DEFAULT_CACHE_DIR, FrameCache, open_reader
 
 __author__ = 'davislong198833@gmail.com (Yunlong Liu)'
 
+DESCRIPTION = 'check that trajectories do not break across the pbc'
+
 THRESHOLD = 10
 
+# Max displacement (A) of a CA between two consecutive frames.
+JUMP_THRESHOLD = 10
+
+SELECTION = 'protein and name CA'
+
+MODES = ("full", "screen", "jumps")
+
+# Number of frames superposed in one batch.
+_BLOCK_SIZE = 256
+
+# Default sampling stride of the screen mode.
+_STRIDE = 10
+
+
+def superposed_rmsd(mobile, reference):
+    """RMSD of a block of frames after optimal superposition.
+
+    Same value as MDAnalysis' alignto (unweighted), obtained from the
+    singular values of the covariance matrices of all frames at once
+    instead of rotating every frame.
+
+    Args:
+        mobile: numpy-array [n_frames, n_atoms, 3], coordinates
+        reference: numpy-array [n_atoms, 3], centered on its centroid
+
+    Returns:
+        numpy-array [n_frames] of RMSD values
+    """
+    mobile = mobile - mobile.mean(axis=1, keepdims=True)
+    covariance = np.einsum('fni,nj->fij', mobile, reference)
+    (left, singular, right) = np.linalg.svd(covariance)
+
+    # flip the smallest singular value for frames that would need a
+    # reflection rather than a rotation.
+    singular[:, 2] *= np.sign(np.linalg.det(left) * np.linalg.det(right))
+
+    squared = (np.sum(mobile ** 2, axis=(1, 2)) + np.sum(reference ** 2) -
+               2.0 * singular.sum(axis=1)) / len(reference)
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def _read_block(trajectory, indices, frames):
+    """read the selected coordinates of some frames.
+
+    Overlapping screening windows decode their shared frames only once
+    thanks to the worker's FrameCache.
+
+    Args:
+        trajectory: the trajectory reader
+        indices: numpy-array [int], atom indices of the selection
+        frames: numpy-array [int], frame indices, increasing
+
+    Returns:
+        numpy-array [n_frames, n_atoms, 3]
+    """
+    return _WORKER["frames"].positions(trajectory, frames, indices)
+
+
+def frame_ranges(frames):
+    """group frame indices into contiguous ranges.
+
+    Args:
+        frames: numpy-array [int], sorted frame indices
+
+    Returns:
+        list of [first, last] frame of every range
+    """
+    if len(frames) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(frames) > 1)
+    firsts = np.append(frames[0], frames[breaks + 1])
+    lasts = np.append(frames[breaks], frames[-1])
+    return [[int(first), int(last)] for (first, last) in zip(firsts, lasts)]
+
+
+# Per-process reference and options, set up by _init_worker.
+_WORKER = {}
+
+
+def _init_worker(indices, reference, options):
+    """Share the reference selection with a worker process.
+
+    Args:
+        indices: numpy-array [int], atom indices of the selection
+        reference: numpy-array [n_atoms, 3], centered reference coordinates
+        options: dict, threshold, jump_threshold, block_size, stride,
+            report_all and cache_dir, see main()
+    """
+    _WORKER["frames"] = FrameCache()
+    _WORKER["indices"] = indices
+    _WORKER["reference"] = reference
+    _WORKER.update(options)
+
+
+def _scan_rmsd(trajectory, frames, report_all=False):
+    """compute the RMSD of frames block by block.
+
+    Args:
+        trajectory: the trajectory reader
+        frames: numpy-array [int], frame indices, increasing
+        report_all: boolean, keep going after the first block with a
+            violation
+
+    Returns:
+        (numpy-array [int], numpy-array [float]), the frames scanned and
+        their RMSD; without report_all it stops after the first block with
+        a violation
+    """
+    scanned = []
+    rmsds = []
+    for first in range(0, len(frames), _WORKER["block_size"]):
+        block = frames[first:first + _WORKER["block_size"]]
+        rmsd = superposed_rmsd(
+            _read_block(trajectory, _WORKER["indices"], block),
+            _WORKER["reference"])
+        scanned.append(block)
+        rmsds.append(rmsd)
+        if not report_all and np.any(rmsd > _WORKER["threshold"]):
+            break
+    if not scanned:
+        return (np.zeros(0, dtype=int), np.zeros(0))
+    return (np.concatenate(scanned), np.concatenate(rmsds))
+
+
+def _check_full(trajectory):
+    """Returns: (bad frames, frames checked, RMSD of the good ones) of a
+    scan of every frame"""
+    (frames, rmsd) = _scan_rmsd(trajectory, np.arange(trajectory.n_frames),
+                                _WORKER["report_all"])
+    bad = rmsd > _WORKER["threshold"]
+    if not _WORKER["report_all"] and np.any(bad):
+        # the frames after the first violation were not looked at.
+        first = np.argmax(bad)
+        (frames, rmsd, bad) = (frames[:first + 1], rmsd[:first + 1],
+                               bad[:first + 1])
+    return (frames[bad], len(frames), rmsd[~bad])
+
+
+def _check_screen(trajectory):
+    """Returns: (bad frames, frames checked, RMSD of the good ones) of a
+    sampled scan, refined around failing samples"""
+    samples = np.unique(np.append(
+        np.arange(0, trajectory.n_frames, _WORKER["stride"]),
+        trajectory.n_frames - 1))
+    (samples, rmsd) = _scan_rmsd(trajectory, samples, True)
+
+    scanned = [samples]
+    rmsds = [rmsd]
+    for position in np.flatnonzero(rmsd > _WORKER["threshold"]):
+        # every frame strictly between the neighbouring samples; windows of
+        # adjacent failing samples overlap and share decoded frames.
+        first = samples[position - 1] + 1 if position > 0 else 0
+        last = samples[position + 1] - 1 if position + 1 < len(samples) \
+            else samples[position]
+        window = np.setdiff1d(np.arange(first, last + 1), samples)
+        (window, window_rmsd) = _scan_rmsd(trajectory, window, True)
+        scanned.append(window)
+        rmsds.append(window_rmsd)
+        if not _WORKER["report_all"]:
+            break
+
+    (frames, first_seen) = np.unique(np.concatenate(scanned),
+                                     return_index=True)
+    rmsd = np.concatenate(rmsds)[first_seen]
+    bad = rmsd > _WORKER["threshold"]
+    return (frames[bad], len(frames), rmsd[~bad])
+
+
+def _check_jumps(trajectory):
+    """Returns: (frames reached by a jump, frames checked, None) of a scan
+    of the CA displacement between consecutive frames"""
+    bad = []
+    previous = None
+    checked = 0
+    for first in range(0, trajectory.n_frames, _WORKER["block_size"]):
+        frames = np.arange(first, min(first + _WORKER["block_size"],
+                                      trajectory.n_frames))
+        block = _read_block(trajectory, _WORKER["indices"], frames)
+        if previous is not None:
+            block_with_previous = np.concatenate([previous, block])
+        else:
+            block_with_previous = block
+            frames = frames[1:]
+        displacement = np.sqrt(np.max(np.sum(
+            np.diff(block_with_previous, axis=0) ** 2, axis=2), axis=1))
+
+        checked += len(block)
+        bad.append(frames[displacement > _WORKER["jump_threshold"]])
+        if not _WORKER["report_all"] and len(bad[-1]) > 0:
+            bad[-1] = bad[-1][:1]
+            break
+        previous = block[-1:]
+
+    return (np.concatenate(bad) if bad else np.zeros(0, dtype=int), checked,
+            None)
+
+
+_CHECKS = {"full": _check_full, "screen": _check_screen,
+           "jumps": _check_jumps}
+
+
+def validate(xtc_name):
+    """Check a single trajectory file.
+
+    Args:
+        xtc_name: trajectory file name
+
+    Returns:
+        dict, the report of the file: file, mode, passed, ranges (list of
+        [first, last] offending frames), frames (number of frames),
+        checked (number of frames read), rmsd (average RMSD of the valid
+        frames checked, None in jumps mode) and seconds
+    """
+    start_time = time.time()
+    trajectory = open_reader(xtc_name, _WORKER["cache_dir"])
+    try:
+        (bad, checked, good_rmsd) = _CHECKS[_WORKER["mode"]](trajectory)
+        num_frames = trajectory.n_frames
+    finally:
+        trajectory.close()
+
+    average = None
+    if good_rmsd is not None and len(good_rmsd) > 0:
+        average = float(np.mean(good_rmsd))
+    return {"file": xtc_name,
+            "mode": _WORKER["mode"],
+            "passed": len(bad) == 0,
+            "ranges": frame_ranges(bad),
+            "frames": num_frames,
+            "checked": checked,
+            "rmsd": average,
+            "seconds": time.time() - start_time}
+
+
+def print_report(report):
+    """Print the result of one file."""
+    print("checking file " + report["file"])
+    summary = "%d of %d frames checked in %.2f s" % (
+        report["checked"], report["frames"], report["seconds"])
+    if report["passed"]:
+        if report["rmsd"] is None:
+            print("pass - " + summary)
+        else:
+            print("pass - average rmsd: %s (%s)" % (report["rmsd"], summary))
+        return
+
+    for (first, last) in report["ranges"]:
+        if first == last:
+            print("At " + str(first) + " violates the criterion.")
+        else:
+            print("From %d to %d violate the criterion." % (first, last))
+    print("trajectory file %s is invalid (%s)." % (report["file"], summary))
+
 
 def main():
     """Entry to validate_pbc.py"""
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument('reference', metavar='REFERENCE',
+                        help='reference structure (.gro)')
+    parser.add_argument('trajectory', metavar='TRAJECTORY', nargs='+',
+                        help='trajectory files to validate (.xtc/.trr)')
+    parser.add_argument('--mode', default="full", choices=MODES,
+                        help='full scan, sampled screening or jump detection')
+    parser.add_argument('--threshold', default=THRESHOLD, type=float,
+                        help='max RMSD (A) of a valid frame')
+    parser.add_argument('--jump-threshold', default=JUMP_THRESHOLD,
+                        type=float,
+                        help='max CA displacement (A) between two frames')
+    parser.add_argument('--stride', default=_STRIDE, type=int,
+                        help='sample every k-th frame in screen mode')
+    parser.add_argument('--report-all', default=False, action='store_true',
+                        help='find every offending frame range instead of '
+                             'stopping at the first one')
+    parser.add_argument('--report',
+                        help='json file to write the per file reports to')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='number of files validated concurrently')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory caching trajectory frame offsets')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const',
+                        const=None, help='do not use the reader cache')
+    parser.add_argument('--block-size', default=_BLOCK_SIZE, type=int,
+                        help='number of frames superposed in one batch')
+    args = parser.parse_args()
+    if args.stride < 1:
+        parser.error("--stride must be positive")
+
+    ref = Universe(args.reference)
+    selection = ref.select_atoms(SELECTION)
+    reference = selection.positions - selection.positions.mean(axis=0)
+    init_args = (selection.indices, reference,
+                 {"mode": args.mode, "threshold": args.threshold,
+                  "jump_threshold": args.jump_threshold,
+                  "block_size": args.block_size, "stride": args.stride,
+                  "report_all": args.report_all,
+                  "cache_dir": args.cache_dir})
+
+    pool = None
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, _init_worker, init_args)
+        results = pool.imap(validate, args.trajectory)
+    else:
+        _init_worker(*init_args)
+        results = (validate(xtc_name) for xtc_name in args.trajectory)
+
+    reports = []
+    try:
+        for report in results:
+            print_report(report)
+            reports.append(report)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if args.report:
+        with open(args.report, 'w') as output:
+            json.dump(reports, output, indent=4)
 
-    if len(sys.argv) < 3:
-        print "Please provide at least a reference file and a trajectory" \
-              " for validation"
-        sys.exit(1)
-
-    argv = sys.argv[1:]
-    ref_name = argv.pop(0)
-
-    for xtc_name in argv:
-        print "checking file " + xtc_name
-        judger = True
-        ref = Universe(ref_name)
-        xtc = Universe(ref_name, xtc_name)
-
-        total = 0.0
-        count = 0
-
-        for frame in xtc.trajectory:
-            rmsd = alignto(xtc, ref, select='protein and name CA')
-            if rmsd[1] > THRESHOLD:
-                print "At " + str(frame.frame) + " violates the criterion."
-                print "trajectory file " + xtc_name + " is invalid."
-                judger = False
-                break
-            total += rmsd[1]
-            count += 1
-
-        if judger:
-            print "pass" + " - " + "average rmsd: " + str(total / count)
 
 if __name__ == "__main__":
     main()